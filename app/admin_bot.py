@@ -1,45 +1,72 @@
 import os
+import uuid
 import asyncio
-import inspect
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import html
 import math
-from .pagination.view_history import view_history_paginated
+from .pagination.view_history import view_history_paginated, render_history_page, range_label
+from .pagination.listings import view_listing, send_listing, render_listing, set_prefix
+from .pagination.company_picker import (
+    company_picker_callback, send_company_picker, refresh_company_picker, apply_picker_filter,
+)
 from sqlalchemy.exc import SQLAlchemyError
 
 
 from dotenv import load_dotenv
-from sqlalchemy import exists
-from telegram.error import TimedOut, RetryAfter, NetworkError
+from telegram.error import BadRequest, TimedOut
 from telegram.helpers import escape_markdown
 from telegram import (
-    BotCommand, Update, InlineKeyboardButton, InlineKeyboardMarkup, Bot
+    BotCommand, Update, InlineKeyboardButton, InlineKeyboardMarkup
 )
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler, MessageHandler, filters,
-    CallbackQueryHandler, ContextTypes, ConversationHandler
+    CommandHandler, MessageHandler, InlineQueryHandler, filters,
+    CallbackQueryHandler, ContextTypes, ConversationHandler, TypeHandler
 )
 
-from .db import SessionLocal
+from .db import SessionLocal, engine
+from .bots import get_client_bot, application_builder
+from .metrics import instrument_application, instrument_engine, start_metrics_server
 from .models import Admin, Company, Client, Message, Claim
 from .utils import (
     init_db, add_admin, add_company, add_client,
     update_admin, delete_admin,
     update_company, delete_company,
-    update_client, delete_client,
-    get_company_history
+    update_client,
+    add_clients, update_clients, delete_clients, unit_of_work,
+    get_company_history, get_client_history, history_range_bounds, HISTORY_RANGES,
+    get_unprocessed_messages, get_burst_texts, burst_text, get_unreachable_report, mark_clients_unreachable
+)
+from .tracing import tracer
+from .logging_setup import setup_logging, bind, bind_update
+from .recorder import install_update_recorder
+from .persistence import DbPersistence
+from .ratelimit import NOTIFICATION_ARGS
+from .search import search_results, clear_search_cache
+from .importer import import_clients_csv, IMPORT_MAX_BYTES
+from .media_store import store_telegram_file, collect_garbage, pin_media, unpin_media, MEDIA_GC_INTERVAL
+from .broadcast import (
+    UNREACHABLE_RETRY_DAYS, ACTIVE_DAYS_CHOICES, SENDERS, ClientUnreachable, safe_send,
+    new_audience, count_audience, describe_audience, run_broadcast,
+    parse_schedule, describe_schedule, schedule_broadcast, list_scheduled, claim_due_broadcasts,
+    resume_interrupted_broadcasts, cancel_scheduled, execute_scheduled, media_lost
+)
+from .stats import (
+    record_claim, record_outbound, get_sla_summary, get_admin_summary, format_duration
 )
 
 # Load environment variables
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 ADMIN_TOKEN = os.getenv("TELEGRAM_TOKEN_ADMIN")
 INITIAL_ADMIN = os.getenv("INITIAL_ADMIN_ID")
 SUPPORT_EMAIL = os.getenv("SUPPORT_EMAIL", "support@yourcompany.com")
+UNREACHABLE_REPORT_HOURS = float(os.getenv("UNREACHABLE_REPORT_HOURS", "24"))  # 0 — без звіту
+SCHEDULE_POLL_SECONDS = float(os.getenv("SCHEDULE_POLL_SECONDS", "60"))  # як часто перевіряти заплановані розсилки
+SEARCH_ANSWER_CACHE = 5  # секунд кешу inline-відповідей на боці Telegram (свіжість кнопки «Взяти запит»)
 
 init_db(initial_admin_tg_id=INITIAL_ADMIN)
 WRITE_TO_CLIENT = 1
@@ -49,20 +76,14 @@ ASK_CONTACT = range(1)
 ASK_ADMIN_ID, ASK_ADMIN_NAME, ASK_ADMIN_SUPER = range(3)
 ASK_BROADCAST_TEXT = 200
 ASK_BROADCAST_CONFIRM = 201
+ASK_BROADCAST_COMPANIES = 202
+ASK_BROADCAST_SCHEDULE = 203
 
 ASK_CLIENT_CONTACT, ASK_CLIENT_NAME, ASK_CLIENT_COMPANY = range(300, 303)
 
 
-def log_tracepoint(tag: str, context: ContextTypes.DEFAULT_TYPE = None):
-    """Показує чіткий трек у консолі — хто викликав, де і з якими прапорцями."""
-    frame = inspect.stack()[1]
-    logger.info(
-        f"[TRACE] {tag} | caller={frame.function} | "
-        f"broadcast_active={context.user_data.get('broadcast_active')} | "
-        f"replying_claim_id={context.user_data.get('replying_claim_id')} | "
-        f"reply_mode_active={context.user_data.get('reply_mode_active')} | "
-        f"has_broadcast={bool(context.user_data.get('broadcast'))}"
-    )
+# Показує чіткий трек у консолі — хто викликав, де і з якими прапорцями (див. app/tracing.py).
+log_tracepoint = tracer.trace
 
 
 
@@ -110,36 +131,18 @@ async def handle_broadcast_input(update: Update, context: ContextTypes.DEFAULT_T
             file_id = update.message.audio.file_id
             file_type = "audio"
 
-        bc = {"text": text, "file_id": file_id, "file_type": file_type, "media_path": None}
+        bc = {"text": text, "file_id": file_id, "file_type": file_type, "media_path": None,
+              "audience": new_audience()}
         context.user_data["broadcast"] = bc
-        log_tracepoint(f"SET broadcast structure: {bc}", context)
+        log_tracepoint("SET broadcast structure", context, file_type=file_type, has_text=bool(text))
 
         if file_id:
-            try:
-                bot = context.bot
-                file = await bot.get_file(file_id)
-                ext = {
-                    "photo": "jpg", "document": "dat", "video": "mp4",
-                    "voice": "ogg", "audio": "mp3"
-                }.get(file_type, "bin")
-                filename = f"broadcast_{file_type}_{int(datetime.utcnow().timestamp())}_{tg_id}.{ext}"
-                media_path = f"/data/media/{filename}"
-                os.makedirs("/data/media", exist_ok=True)
-                await file.download_to_drive(media_path)
-                bc["media_path"] = media_path
-                logger.info(f"[BROADCAST_INPUT] 📁 Saved file: {media_path}")
-            except Exception as e:
-                logger.warning(f"[BROADCAST_INPUT] ⚠️ File save failed: {e}")
-
-        confirm_kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Підтвердити і надіслати", callback_data="broadcast_confirm")],
-            [InlineKeyboardButton("❌ Скасувати", callback_data="broadcast_cancel")]
-        ])
-        summary = bc["text"] or "(без тексту)"
-        if bc["file_type"]:
-            summary += f"\n\n(з медіа: {bc['file_type']})"
+            bc["media_path"] = await store_telegram_file(context.bot, file_id, file_type)
+
+        # аудиторія за замовчуванням — усі доступні клієнти; адмін звужує її кнопками перед підтвердженням
+        text, confirm_kb = render_broadcast_confirm(bc)
         log_tracepoint("SEND CONFIRM PROMPT", context)
-        await update.message.reply_text(f"📣 Підтвердіть розсилку:\n\n{summary}", reply_markup=confirm_kb)
+        await update.message.reply_text(text, reply_markup=confirm_kb)
 
         log_tracepoint("END handle_broadcast_input", context)
         return ASK_BROADCAST_CONFIRM
@@ -157,8 +160,9 @@ async def claim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_tracepoint("START claim_callback", context)
 
     app = context.application
-    chat_id = update.effective_chat.id
     user_id = update.effective_user.id
+    # кнопка з inline-результату пошуку: чату немає, розмова адміна — його приватний чат з ботом
+    chat_id = update.effective_chat.id if update.effective_chat else user_id
 
     # 💣 Якщо активна розсилка — знищуємо її сесію повністю
     if context.user_data.get("broadcast_active") or context.user_data.get("broadcast"):
@@ -175,7 +179,7 @@ async def claim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     key = (chat_id, user_id)
                     if hasattr(handler, "conversations") and key in handler.conversations:
                         handler.conversations.pop(key, None)
-                        logger.info(f"🧹 [CLAIM] Broadcast conversation forcibly closed for {user_id}")
+                        logger.info("🧹 [CLAIM] Broadcast conversation forcibly closed for %s", user_id)
 
         logger.info("✅ [CLAIM] Broadcast очищено перед взяттям запиту.")
 
@@ -189,7 +193,7 @@ async def claim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         msgid = int(data.split(":", 1)[1])
     except Exception:
-        await q.message.reply_text("Неправильний формат запиту.")
+        await context.bot.send_message(chat_id=user_id, text="Неправильний формат запиту.")
         return
 
     session = SessionLocal()
@@ -198,7 +202,7 @@ async def claim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # знайти повідомлення
         message = session.query(Message).filter_by(id=msgid).first()
         if not message:
-            await q.message.reply_text("Повідомлення вже не знайдено.")
+            await context.bot.send_message(chat_id=user_id, text="Повідомлення вже не знайдено.")
             return
 
         # перевірити чи вже є Claim по цьому message_id
@@ -206,13 +210,13 @@ async def claim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if existing:
             admin_obj = session.query(Admin).filter_by(id=existing.admin_id).first()
             admin_name = admin_obj.name if admin_obj else str(existing.admin_id)
-            await q.message.reply_text(f"⚠️ Запит вже взяв адміністратор {admin_name}")
+            await context.bot.send_message(chat_id=user_id, text=f"⚠️ Запит вже взяв адміністратор {admin_name}")
             return
 
         # знайти адміна (того, хто натиснув кнопку)
         admin_obj = session.query(Admin).filter_by(tg_id=admin_tg).first()
         if not admin_obj:
-            await q.message.reply_text("❌ Ви не зареєстровані як адміністратор.")
+            await context.bot.send_message(chat_id=user_id, text="❌ Ви не зареєстровані як адміністратор.")
             return
 
         # знайти клієнта (можливо None)
@@ -224,28 +228,30 @@ async def claim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             client_id=client_obj.id if client_obj else None,
             admin_id=admin_obj.id,
             title=f"Запит від {client_obj.name if client_obj else message.client_tg_id}",
-            description=(message.text or "")[:4000],
+            description=(burst_text(message, get_burst_texts(session, [msgid])) or "")[:4000],
             status="in_progress"
         )
         session.add(claim)
+        record_claim(session, message.company_id, admin_tg, message.created_at)
         session.commit()
         session.refresh(claim)
+        bind(claim_id=claim.id)
 
         # сповіщаємо інших адміністраторів
         other_admins = session.query(Admin).filter(Admin.tg_id != admin_tg).all()
         notify_text = f"🔒 Запит #{msgid} взяв адміністратор {admin_obj.name or admin_obj.tg_id}"
         for a in other_admins:
             try:
-                await context.bot.send_message(chat_id=int(a.tg_id), text=notify_text)
+                await context.bot.send_message(chat_id=int(a.tg_id), text=notify_text, rate_limit_args=NOTIFICATION_ARGS)
             except Exception as e:
-                logger.warning(f"Can't notify admin {a.tg_id}: {e}")
+                logger.warning("Can't notify admin %s: %s", a.tg_id, e)
 
         # оновлюємо кнопку
         keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Взято ✅", callback_data="taken")]])
         try:
             await q.edit_message_reply_markup(reply_markup=keyboard)
         except Exception as e:
-            logger.debug(f"edit_message_reply_markup failed: {e}")
+            logger.debug("edit_message_reply_markup failed: %s", e)
 
         # зберігаємо в контекст
         context.user_data["replying_claim_id"] = claim.id
@@ -265,12 +271,12 @@ async def claim_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data["write_to_client_mode"] = True
         context.user_data["target_client_tg"] = message.client_tg_id
 
-        logger.info(f"✅ Admin {admin_tg} взяв claim #{claim.id}")
+        logger.info("✅ Admin %s взяв claim #%s", admin_tg, claim.id)
 
     except Exception as e:
-        logger.exception(f"Error in claim_callback: {e}")
+        logger.exception("Error in claim_callback: %s", e)
         try:
-            await q.message.reply_text("⚠️ Сталася помилка під час обробки запиту.")
+            await context.bot.send_message(chat_id=user_id, text="⚠️ Сталася помилка під час обробки запиту.")
         except Exception:
             pass
 
@@ -306,7 +312,7 @@ async def start_claim_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         existing = session.query(Claim).filter_by(message_id=msgid).first()
         if existing:
-            logger.warning(f"[CLAIM_FLOW] already claimed {msgid}")
+            logger.warning("[CLAIM_FLOW] already claimed %s", msgid)
             return ConversationHandler.END
 
         admin_obj = session.query(Admin).filter_by(tg_id=admin_tg).first()
@@ -317,13 +323,15 @@ async def start_claim_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
             client_id=client_obj.id if client_obj else None,
             admin_id=admin_obj.id,
             title=f"Запит від {client_obj.name if client_obj else message.client_tg_id}",
-            description=(message.text or "")[:4000],
+            description=(burst_text(message, get_burst_texts(session, [msgid])) or "")[:4000],
             status="in_progress"
         )
         session.add(claim)
+        record_claim(session, message.company_id, admin_tg, message.created_at)
         session.commit()
         session.refresh(claim)
-        log_tracepoint(f"[CLAIM_FLOW] created claim #{claim.id}", context)
+        bind(claim_id=claim.id)
+        log_tracepoint("[CLAIM_FLOW] created claim", context, claim_id=claim.id)
 
         context.user_data["replying_claim_id"] = claim.id
 
@@ -334,7 +342,7 @@ async def start_claim_flow(update: Update, context: ContextTypes.DEFAULT_TYPE):
                   f"воно буде надіслано клієнту від вашого імені.")
         )
 
-        logger.info(f"[CLAIM_FLOW] ✅ claim ready #{claim.id}")
+        logger.info("[CLAIM_FLOW] ✅ claim ready #%s", claim.id)
         log_tracepoint("END start_claim_flow", context)
         return ConversationHandler.END
     finally:
@@ -362,7 +370,7 @@ async def start_broadcast_callback(update: Update, context: ContextTypes.DEFAULT
             if isinstance(handler, ConversationHandler) and getattr(handler, "name", "") == "broadcast_conv":
                 if hasattr(handler, "conversations"):
                     handler.conversations.pop((chat_id, user_id), None)
-                    logger.info(f"💣 [BROADCAST_RESET] Стару сесію broadcast_conv видалено для {user_id}")
+                    logger.info("💣 [BROADCAST_RESET] Стару сесію broadcast_conv видалено для %s", user_id)
 
     # 🧹 Повністю очищаємо контекст користувача
     context.user_data.clear()
@@ -421,15 +429,10 @@ async def handle_client_contact(update: Update, context: ContextTypes.DEFAULT_TY
         return ASK_CLIENT_NAME
 
     # Якщо вже є ім’я — одразу переходимо до вибору компанії
-    companies = session.query(Company).all()
-    if not companies:
+    session.close()
+    if not await send_company_picker(msg, context, "client", reset_filter=True):
         await msg.reply_text("⚠️ Немає жодної компанії. Спочатку додайте компанію.")
-        session.close()
         return ConversationHandler.END
-
-    text = "🏢 Доступні компанії:\n" + "\n".join([f"{c.id} — {c.name}" for c in companies])
-    await msg.reply_text(text + "\n\nВведіть ID компанії:")
-    session.close()
     return ASK_CLIENT_COMPANY
 
 #хендлер обробки введення імені клієнта:
@@ -439,35 +442,48 @@ async def handle_client_name(update: Update, context: ContextTypes.DEFAULT_TYPE)
     name = update.message.text.strip()
     context.user_data["new_client_name"] = name
 
-    session = SessionLocal()
-    companies = session.query(Company).all()
-    if not companies:
+    if not await send_company_picker(update.message, context, "client", reset_filter=True):
         await update.message.reply_text("⚠️ Немає жодної компанії. Спочатку додайте компанію.")
-        session.close()
         return ConversationHandler.END
-
-    text = "🏢 Доступні компанії:\n" + "\n".join([f"{c.id} — {c.name}" for c in companies])
-    await update.message.reply_text(text + "\n\nВведіть ID компанії:")
-    session.close()
     return ASK_CLIENT_COMPANY
 
 
 #хендлер обробки введення компанії для клієнта:
 
 async def handle_client_company(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Фінальний крок — збереження клієнта."""
-    session = SessionLocal()
+    """ID компанії текстом — зберігаємо клієнта; будь-який інший текст — фільтр пікера за назвою."""
     company_id_text = update.message.text.strip()
 
     if not company_id_text.isdigit():
-        await update.message.reply_text("❌ ID компанії має бути числом. Спробуйте ще раз:")
-        session.close()
+        apply_picker_filter(context, "client", company_id_text)
+        await send_company_picker(update.message, context, "client")
         return ASK_CLIENT_COMPANY
 
-    company_id = int(company_id_text)
+    return await save_new_client(update.message, context, int(company_id_text))
+
+
+async def client_company_pick_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки пікера компаній у кроці ASK_CLIENT_COMPANY."""
+    purpose, op, company_id = await company_picker_callback(update, context)
+    if op != "s":
+        return ASK_CLIENT_COMPANY
+    q = update.callback_query
+    await q.answer()
+    state = await save_new_client(q.message, context, company_id)
+    if state == ConversationHandler.END:
+        try:
+            await q.edit_message_reply_markup(reply_markup=None)
+        except BadRequest as e:
+            logger.debug("edit_message_reply_markup failed: %s", e)
+    return state
+
+
+async def save_new_client(message, context: ContextTypes.DEFAULT_TYPE, company_id: int):
+    """Фінальний крок — збереження клієнта."""
+    session = SessionLocal()
     company = session.query(Company).filter_by(id=company_id).first()
     if not company:
-        await update.message.reply_text("❌ Компанію не знайдено. Введіть інший ID:")
+        await message.reply_text("❌ Компанію не знайдено. Оберіть іншу або введіть інший ID:")
         session.close()
         return ASK_CLIENT_COMPANY
 
@@ -480,12 +496,12 @@ async def handle_client_company(update: Update, context: ContextTypes.DEFAULT_TY
     add_client(session, tg_id=tg_id, name=name, company_id=company_id)
     session.close()
 
-    await update.message.reply_text(
+    await message.reply_text(
         f"✅ Клієнта *{name}* успішно додано до компанії *{company_name}*.",
         parse_mode="Markdown"
     )
 
-    logger.info(f"✅ [ADD_CLIENT] Клієнта '{name}' додано до компанії '{company_name}' (tg_id={tg_id})")
+    logger.info("✅ [ADD_CLIENT] Клієнта '%s' додано до компанії '%s' (tg_id=%s)", name, company_name, tg_id)
 
     context.user_data.clear()
     return ConversationHandler.END
@@ -494,38 +510,6 @@ async def handle_client_company(update: Update, context: ContextTypes.DEFAULT_TY
 
 
 
-#повторні спроби та обробка помилок
-async def safe_send(client_bot: Bot, send_coro_callable, *args, retry=1, delay_on_timeout=5, **kwargs):
-    """
-    send_coro_callable — корутина-заглушка типу client_bot.send_message або send_photo (функція, не виклик!)
-    Викликається як: await safe_send(bot, bot.send_message, chat_id, text=..., retry=2)
-    Повертає True якщо успішно, False якщо провалилися всі спроби.
-    """
-    try_count = 0
-    while True:
-        try:
-            await send_coro_callable(*args, **kwargs)
-            return True
-        except RetryAfter as e:
-            delay = int(getattr(e, "retry_after", 5))
-            logger.warning(f"RateLimit — чекаю {delay}s")
-            await asyncio.sleep(delay)
-            try_count += 1
-        except TimedOut:
-            logger.warning(f"TimedOut при відправці, спробую через {delay_on_timeout}s")
-            await asyncio.sleep(delay_on_timeout)
-            try_count += 1
-        except NetworkError:
-            logger.warning("NetworkError при відправці — пропускаю цей контакт")
-            return False
-        except Exception as e:
-            logger.exception(f"Несподівана помилка при відправці: {e}")
-            return False
-
-        if try_count > retry:
-            logger.error("Вичерпано кількість повторних спроб")
-            return False
-
 async def broadcast_confirm_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -538,80 +522,233 @@ async def broadcast_confirm_callback(update: Update, context: ContextTypes.DEFAU
     if not bc:
         await q.message.reply_text("⚠️ Немає підготовленого повідомлення для розсилки.")
         return
+    if media_lost(bc):
+        await reply_media_lost(q.message, context)
+        return ConversationHandler.END
+
+    broadcast_id = uuid.uuid4().hex[:12]
+    bind(broadcast_id=broadcast_id)
+    audience = bc.get("audience") or new_audience()
+    logger.info("📣 [BROADCAST] Старт розсилки %s від admin=%s, аудиторія %s", broadcast_id, tg_id, audience)
+
+    try:
+        session = SessionLocal()
+        try:
+            # недоступні клієнти (заблокували бота) не витрачають ліміт; через UNREACHABLE_RETRY_DAYS пробуємо знову
+            total, skipped = count_audience(session, audience)
+        finally:
+            session.close()
+        await q.message.reply_text(
+            f"🚀 Починаю розсилку на {total} клієнтів (пропущено недоступних: {skipped}). "
+            f"Звіт надійде окремим повідомленням — тим часом бот доступний як зазвичай."
+        )
+        # чернетка зараз зникне з user_data — до кінця розсилки файл тримає pin_media
+        pin_media(bc.get("media_path"))
+        # окремою задачею: інакше апдейти цього адміна (claim, відповіді) чекали б кінця розсилки
+        context.application.create_task(run_confirmed_broadcast(context, bc, tg_id, audience),
+                                        name=f"broadcast:{broadcast_id}")
+    finally:
+        # файл розсилки лишається в сховищі медіа: на нього посилається історія, прибирає GC
+        context.user_data.pop("broadcast", None)
+        context.user_data["broadcast_active"] = False
+    return ConversationHandler.END
 
-    # Параметри розсилки
-    delay = float(os.getenv("BROADCAST_DELAY", "0.06"))  # сек між повідомленнями (налаштовувано)
-    client_token = os.getenv("TELEGRAM_TOKEN_CLIENT")
-    client_bot = Bot(token=client_token)
+async def run_confirmed_broadcast(context: ContextTypes.DEFAULT_TYPE, bc: dict, admin_tg: str, audience: dict):
+    try:
+        stats = await run_broadcast(get_client_bot(), bc, admin_tg, audience)
+    except Exception as e:
+        logger.exception("❌ [BROADCAST] Розсилка впала: %s", e)
+        text = "❌ Розсилка перервалась через помилку — частина клієнтів могла її не отримати."
+    else:
+        if stats.get("media_lost"):
+            text = (
+                f"❌ Розсилку зупинено: файл для розсилки недоступний (відправлено: {stats['sent']}). "
+                f"Почніть розсилку заново й надішліть медіа ще раз."
+            )
+        else:
+            text = (
+                f"✅ Розсилка завершена. Відправлено: {stats['sent']}, помилок: {stats['failed']}, "
+                f"недоступних (більше не надсилатимемо): {stats['unreachable']}"
+            )
+    finally:
+        unpin_media(bc.get("media_path"))
+    try:
+        await context.bot.send_message(chat_id=int(admin_tg), text=text, rate_limit_args=NOTIFICATION_ARGS)
+    except Exception as e:
+        logger.warning("⚠️ Не вдалося повідомити адміна %s про розсилку: %s", admin_tg, e)
+
+
+# ------------------- АУДИТОРІЯ РОЗСИЛКИ -------------------
 
+def render_broadcast_confirm(bc: dict):
+    """Текст і клавіатура підтвердження розсилки з поточною аудиторією та кількістю отримувачів."""
+    audience = bc.setdefault("audience", new_audience())
     session = SessionLocal()
     try:
-        clients = session.query(Client.tg_id).all()  # список кортежів
-        client_ids = [c[0] for c in clients]
-        total = len(client_ids)
-        await q.message.reply_text(f"🚀 Починаю розсилку на {total} клієнтів. Це може зайняти деякий час...")
+        total, skipped = count_audience(session, audience)
+        names = {}
+        if audience["company_ids"]:
+            names = dict(
+                session.query(Company.id, Company.name)
+                .filter(Company.id.in_(audience["company_ids"]))
+                .all()
+            )
+    finally:
+        session.close()
 
-        sent = 0
-        failed = 0
+    summary = bc["text"] or "(без тексту)"
+    if bc["file_type"]:
+        summary += f"\n\n(з медіа: {bc['file_type']})"
+    text = (
+        f"📣 Підтвердіть розсилку:\n\n{summary}\n\n"
+        f"👥 Аудиторія:\n{describe_audience(audience, names)}\n"
+        f"Отримувачів: {total} (недоступних пропущено: {skipped})"
+    )
+    days = audience["active_days"]
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🏢 Обрати компанії", callback_data="broadcast_companies")],
+        [InlineKeyboardButton(f"🕒 Активність: {f'{days} дн.' if days else 'усі'} (змінити)", callback_data="broadcast_active_days")],
+        [InlineKeyboardButton(f"✅ Підтвердити і надіслати ({total})", callback_data="broadcast_confirm")],
+        [InlineKeyboardButton("🕒 Запланувати", callback_data="broadcast_schedule")],
+        [InlineKeyboardButton("❌ Скасувати", callback_data="broadcast_cancel")]
+    ])
+    return text, keyboard
 
-        # Відправка: відкриваємо локальний файл (якщо є), і для кожного клієнта посилаємо.
-        media_path = bc.get("media_path")
-        file_type = bc.get("file_type")
-        text = bc.get("text")
+async def broadcast_active_days_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Перемикає фільтр "писали за останні N днів" і оновлює кількість отримувачів."""
+    q = update.callback_query
+    await q.answer()
+    bc = context.user_data.get("broadcast")
+    if not bc:
+        await q.message.reply_text("⚠️ Немає підготовленого повідомлення для розсилки.")
+        return ConversationHandler.END
+    audience = bc.setdefault("audience", new_audience())
+    current = audience.get("active_days") or 0
+    choices = list(ACTIVE_DAYS_CHOICES)
+    audience["active_days"] = choices[(choices.index(current) + 1) % len(choices)] if current in choices else 0
+    text, keyboard = render_broadcast_confirm(bc)
+    try:
+        await q.edit_message_text(text, reply_markup=keyboard)
+    except BadRequest as e:
+        logger.debug("edit_message_text failed: %s", e)
+    return ASK_BROADCAST_CONFIRM
 
-        # Для економії: якщо media_path є — будемо відкривати файл щоразу в циклі
-        for cid in client_ids:
-            try:
-                # 1) зберегти запис у БД (direction='out') ПЕРЕД відправкою
-                m = Message(client_tg_id=str(cid), admin_tg_id=str(tg_id), direction="out",
-                            text=text, file_id=bc.get("file_id"), file_type=file_type,
-                            file_path=media_path, company_snapshot=None)
-                session.add(m)
-                session.commit()
-
-                # 2) відправка через safe_send
-                if media_path and os.path.exists(media_path):
-                    with open(media_path, "rb") as f:
-                        if file_type == "photo":
-                            ok = await safe_send(client_bot, client_bot.send_photo, chat_id=int(cid), photo=f, caption=f"📣 {text or ''}")
-                        elif file_type == "document":
-                            ok = await safe_send(client_bot, client_bot.send_document, chat_id=int(cid), document=f, caption=f"📣 {text or ''}")
-                        elif file_type == "video":
-                            ok = await safe_send(client_bot, client_bot.send_video, chat_id=int(cid), video=f, caption=f"📣 {text or ''}")
-                        elif file_type == "voice" or file_type == "audio":
-                            ok = await safe_send(client_bot, client_bot.send_voice if file_type == "voice" else client_bot.send_audio, chat_id=int(cid), voice=f if file_type=="voice" else None, audio=f if file_type=="audio" else None, caption=f"📣 {text or ''}")
-                        else:
-                            ok = await safe_send(client_bot, client_bot.send_message, chat_id=int(cid), text=f"📣 {text or ''}")
-                else:
-                    ok = await safe_send(client_bot, client_bot.send_message, chat_id=int(cid), text=f"📣 {text or ''}")
+async def broadcast_companies_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    if not context.user_data.get("broadcast"):
+        await q.message.reply_text("⚠️ Немає підготовленого повідомлення для розсилки.")
+        return ConversationHandler.END
+    await send_company_picker(q.message, context, "bc", reset_filter=True)
+    return ASK_BROADCAST_COMPANIES
+
+async def broadcast_company_pick_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки пікера компаній розсилки: позначити / зняти компанію, «Готово» — назад до підтвердження."""
+    purpose, op, company_id = await company_picker_callback(update, context)
+    if op not in ("s", "d"):
+        return ASK_BROADCAST_COMPANIES
+    q = update.callback_query
+    await q.answer()
+    bc = context.user_data.get("broadcast")
+    if not bc:
+        await q.message.reply_text("⚠️ Немає підготовленого повідомлення для розсилки.")
+        return ConversationHandler.END
 
-                if ok:
-                    sent += 1
-                else:
-                    failed += 1
+    audience = bc.setdefault("audience", new_audience())
+    if op == "s":
+        ids = set(audience.get("company_ids") or [])
+        ids ^= {company_id}
+        audience["company_ids"] = sorted(ids)
+        await refresh_company_picker(q.message, context, "bc", keep_page=True)
+        return ASK_BROADCAST_COMPANIES
 
-            except Exception as e:
-                logger.exception(f"Помилка при розсилці клієнту {cid}: {e}")
-                failed += 1
+    text, keyboard = render_broadcast_confirm(bc)
+    await q.message.reply_text(text, reply_markup=keyboard)
+    return ASK_BROADCAST_CONFIRM
 
-            # throttle
-            await asyncio.sleep(delay)
+async def handle_broadcast_companies(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    bc = context.user_data.get("broadcast")
+    if not bc:
+        await update.message.reply_text("⚠️ Немає підготовленого повідомлення для розсилки.")
+        return ConversationHandler.END
 
-        await q.message.reply_text(f"✅ Розсилка завершена. Відправлено: {sent}, помилок: {failed}")
+    raw = update.message.text.replace(",", " ").split()
+    if not raw or not all(part.isdigit() for part in raw):
+        # не список ID — початок назви компанії для пікера
+        apply_picker_filter(context, "bc", update.message.text)
+        await send_company_picker(update.message, context, "bc")
+        return ASK_BROADCAST_COMPANIES
+    ids = sorted({int(part) for part in raw} - {0})
 
-    finally:
-        # очистка: видаляємо тимчасовий файл тільки після завершення циклу
+    if ids:
+        session = SessionLocal()
         try:
-            if bc.get("media_path") and os.path.exists(bc.get("media_path")):
-                os.remove(bc.get("media_path"))
-                logger.info(f"🗑️ Видалено тимчасове медіа: {bc.get('media_path')}")
-        except Exception as e:
-            logger.warning(f"⚠️ Не вдалося видалити тимчасовий файл: {e}")
+            found = {cid for (cid,) in session.query(Company.id).filter(Company.id.in_(ids)).all()}
+        finally:
+            session.close()
+        missing = [cid for cid in ids if cid not in found]
+        if missing:
+            await update.message.reply_text(f"⚠️ Компаній не знайдено: {', '.join(map(str, missing))}. Спробуйте ще раз.")
+            return ASK_BROADCAST_COMPANIES
+
+    bc.setdefault("audience", new_audience())["company_ids"] = ids
+    text, keyboard = render_broadcast_confirm(bc)
+    await update.message.reply_text(text, reply_markup=keyboard)
+    return ASK_BROADCAST_CONFIRM
+
+async def company_picker_nav_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пікер поза розмовою: гортання для історії; вибір у завершеній розмові вже неактуальний."""
+    purpose, op, _ = await company_picker_callback(update, context)
+    if op in ("s", "d"):
+        await update.callback_query.answer("⚠️ Цей вибір уже неактуальний — почніть заново.", show_alert=True)
+
+async def reply_media_lost(message, context: ContextTypes.DEFAULT_TYPE):
+    """Файл чернетки розсилки не збережено або вже немає — не розсилаємо підпис без медіа."""
+    context.user_data.pop("broadcast", None)
+    context.user_data["broadcast_active"] = False
+    await message.reply_text("⚠️ Файл для розсилки недоступний. Почніть розсилку заново й надішліть медіа ще раз.")
+
+async def broadcast_schedule_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    if not context.user_data.get("broadcast"):
+        await q.message.reply_text("⚠️ Немає підготовленого повідомлення для розсилки.")
+        return ConversationHandler.END
+    await q.message.reply_text(
+        "🕒 Коли надіслати? Формат: [РРРР-ММ-ДД] ГГ:ХХ [щодня|щотижня] [до ГГ:ХХ] [N/с]\n"
+        "• 02:00 — сьогодні або завтра о 02:00\n"
+        "• РРРР-ММ-ДД 09:30 — конкретний день, напр. на вихідних\n"
+        "• 01:00 щодня до 06:00 10/с — щоночі з 1 до 6, не швидше 10 повідомлень/с; "
+        "що не встигло — продовжиться наступної ночі\n"
+        "Скасувати: /cancel"
+    )
+    return ASK_BROADCAST_SCHEDULE
 
-        context.user_data.pop("broadcast", None)
+async def handle_broadcast_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    bc = context.user_data.get("broadcast")
+    tg_id = str(update.effective_user.id)
+    if not bc:
+        await update.message.reply_text("⚠️ Немає підготовленого повідомлення для розсилки.")
+        return ConversationHandler.END
+    try:
+        schedule = parse_schedule(update.message.text)
+    except ValueError as e:
+        await update.message.reply_text(f"⚠️ {e}. Спробуйте ще раз або /cancel.")
+        return ASK_BROADCAST_SCHEDULE
+    if media_lost(bc):
+        await reply_media_lost(update.message, context)
+        return ConversationHandler.END
+
+    session = SessionLocal()
+    try:
+        item = schedule_broadcast(session, bc, tg_id, schedule)
+        text = f"🕒 Розсилку #{item.id} заплановано: {describe_schedule(item)}.\nСписок і скасування: /scheduled"
+    finally:
         session.close()
-        context.user_data.pop("broadcast", None)
-        context.user_data["broadcast_active"] = False
+    # медіа лишається на диску до завершення / скасування запланованої розсилки
+    context.user_data.pop("broadcast", None)
+    context.user_data["broadcast_active"] = False
+    await update.message.reply_text(text)
     return ConversationHandler.END
 
 #callback handlers для підтвердження / відміни. Додавши обробку broadcast_confirm та broadcast_cancel в admin_menu_callback або як глобальні CallbackQueryHandler — краще окремим handler-ом:
@@ -626,7 +763,7 @@ async def reset_states_callback(update: Update, context: ContextTypes.DEFAULT_TY
 
     await context.bot.send_message(chat_id, "🔄 Скидаю всі стани...")
 
-    logger.warning(f"🔄 Admin {query.from_user.username} ({user_id}) виконав повний reset станів.")
+    logger.warning("🔄 Admin %s (%s) виконав повний reset станів.", query.from_user.username, user_id)
 
     try:
         # 1) Очистка локальних context-даних
@@ -667,7 +804,7 @@ async def reset_states_callback(update: Update, context: ContextTypes.DEFAULT_TY
                                 cleaned = True
                                 break
                             except Exception:
-                                logger.debug(f"Не вдалося очистити {attr} у handler {handler}", exc_info=True)
+                                logger.debug("Не вдалося очистити %s у handler %s", attr, handler, exc_info=True)
                     if cleaned:
                         cleared_handlers += 1
 
@@ -694,22 +831,16 @@ async def reset_states_callback(update: Update, context: ContextTypes.DEFAULT_TY
         except Exception:
             logger.debug("Не вдалося почистити context.application._conversations", exc_info=True)
 
-        # 4) Якщо є persistence — спробувати почистити його записи для цього користувача/чату
-        try:
-            persistence = getattr(context.application, "persistence", None)
-            if persistence:
-                try:
-                    if hasattr(persistence, "drop_user_data"):
-                        persistence.drop_user_data(user_id)
-                    if hasattr(persistence, "drop_chat_data"):
-                        persistence.drop_chat_data(chat_id)
-                    # якщо є flush/close методи
-                    if hasattr(persistence, "flush"):
-                        persistence.flush()
-                except Exception as e:
-                    logger.warning(f"Не вдалося очистити persistence: {e}")
-        except Exception:
-            logger.debug("Помилка при роботі з persistence", exc_info=True)
+        # 4) Persistence: прибираємо збережені дані цього користувача/чату
+        #    (очищені вище стани розмов PTB сам передасть у persistence як видалені)
+        persistence = context.application.persistence
+        if persistence:
+            try:
+                await persistence.drop_user_data(user_id)
+                await persistence.drop_chat_data(chat_id)
+                await persistence.flush()
+            except Exception as e:
+                logger.warning("Не вдалося очистити persistence: %s", e)
 
         await context.bot.send_message(chat_id, f"✅ Всі стани очищено. Очищено handlers: {cleared_handlers}")
         try:
@@ -722,7 +853,7 @@ async def reset_states_callback(update: Update, context: ContextTypes.DEFAULT_TY
                 except Exception:
                     pass
         except Exception as e:
-            logger.warning(f"⚠️ Не вдалося очистити історію чату: {e}")
+            logger.warning("⚠️ Не вдалося очистити історію чату: %s", e)
 
         # 5) Повернутися в головне меню (start_admin обробляє як message.reply_text або callback)
         # Викликаємо start_admin з оригінальним update (в якому є query.message) — воно відпрацює нормально
@@ -739,13 +870,8 @@ async def reset_states_callback(update: Update, context: ContextTypes.DEFAULT_TY
         
 async def silent_broadcast_cancel(context: ContextTypes.DEFAULT_TYPE):
     """Прибирає усі дані розсилки без відправлення повідомлення."""
-    bc = context.user_data.pop("broadcast", None)
-    if bc and bc.get("media_path"):
-        try:
-            if os.path.exists(bc["media_path"]):
-                os.remove(bc["media_path"])
-        except Exception:
-            pass
+    # медіа без посилань прибере GC сховища (app/media_store.py)
+    context.user_data.pop("broadcast", None)
     context.user_data.pop("broadcast_active", None)
     logger.info("🧹 Silent broadcast cancel executed.")
 
@@ -770,14 +896,6 @@ async def broadcast_cancel_callback(update: Update, context: ContextTypes.DEFAUL
         await target.reply_text("⛔ Ви не є адміністратором.")
         return ConversationHandler.END
 
-    # 🧹 Видалення медіа (якщо було)
-    bc = context.user_data.get("broadcast")
-    if bc and bc.get("media_path"):
-        try:
-            os.remove(bc["media_path"])
-        except Exception:
-            pass
-
     # 🧠 Повне очищення контексту користувача
     context.user_data.clear()
 
@@ -791,13 +909,13 @@ async def broadcast_cancel_callback(update: Update, context: ContextTypes.DEFAUL
             if isinstance(handler, ConversationHandler) and getattr(handler, "name", "") == "broadcast_conv":
                 if hasattr(handler, "conversations"):
                     handler.conversations.pop((chat_id, user_id), None)
-                    logger.info(f"💣 [BROADCAST_CANCEL] Залишки сесії broadcast_conv видалено для user={user_id}")
+                    logger.info("💣 [BROADCAST_CANCEL] Залишки сесії broadcast_conv видалено для user=%s", user_id)
 
     # 💤 Маленька затримка для стабільного виходу зі стану
     await asyncio.sleep(0.2)
 
     await target.reply_text("❌ Розсилку скасовано.")
-    logger.info(f"🧹 [BROADCAST_CANCEL] Розсилку скасовано вручну для admin={tg_id}")
+    logger.info("🧹 [BROADCAST_CANCEL] Розсилку скасовано вручну для admin=%s", tg_id)
 
     return ConversationHandler.END
 
@@ -838,12 +956,16 @@ def safe_md2(value):
 
 # --- Виклик з меню ---
 async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.debug(f"ADMIN_MENU_CALLBACK invoked. data={getattr(update.callback_query, 'data', None)}; from={update.effective_user.id}")
+    logger.debug("ADMIN_MENU_CALLBACK invoked. data=%s; from=%s", getattr(update.callback_query, 'data', None), update.effective_user.id)
     if context.user_data.get("broadcast_active"):
         context.user_data.pop("broadcast_active", None)
         context.user_data.pop("broadcast", None)
 
     query = update.callback_query
+    if query.message is None:
+        # inline-повідомлення з пошуку: меню відкривається лише в чаті з ботом
+        await query.answer("ℹ️ Відкрийте меню в чаті з ботом.", show_alert=True)
+        return
     await query.answer()
     data = query.data
     tg_id = str(update.effective_user.id)
@@ -908,15 +1030,14 @@ async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         session = SessionLocal()
         try:
             # беремо всі вхідні messages без пов'язаного claim
-            q = session.query(Message).filter(Message.direction == "in")
-            q = q.filter(~exists().where(Claim.message_id == Message.id))
-            messages = q.order_by(Message.created_at.asc()).limit(100).all()  # ліміт, щоб не спамити
+            messages = get_unprocessed_messages(session, limit=100)  # ліміт, щоб не спамити
 
             if not messages:
                 await query.message.reply_text("📭 Немає необроблених повідомлень.")
                 return
 
             await query.message.reply_text(f"📬 Знайдено {len(messages)} необроблених повідомлень (показую нові першими).")
+            bursts = get_burst_texts(session, [m.id for m in messages])
 
             for msg in messages:
                 # текст, короткий снэпшот компанії
@@ -924,7 +1045,7 @@ async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
                     f"📩 Повідомлення від клієнта <b>{msg.client.name if hasattr(msg, 'client') and msg.client else msg.client_tg_id}</b>\n"
                     f"🏢 Компанія: {msg.company_snapshot or '-'}\n"
                     f"🆔 MsgID: <code>{msg.id}</code>\n\n"
-                    f"💬 {msg.text or '(без тексту)'}"
+                    f"💬 {burst_text(msg, bursts) or '(без тексту)'}"
                 )
                 keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("💬 Відповісти", callback_data=f"claim:{msg.id}")]])
 
@@ -948,28 +1069,15 @@ async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
                     else:
                         await context.bot.send_message(chat_id=int(tg_id), text=notify_text, parse_mode="HTML", reply_markup=keyboard)
                 except Exception as e:
-                    logger.warning(f"⚠️ Не вдалося надіслати необроблене повідомлення {msg.id} адміну {tg_id}: {e}")
+                    logger.warning("⚠️ Не вдалося надіслати необроблене повідомлення %s адміну %s: %s", msg.id, tg_id, e)
 
         finally:
             session.close()
 
 
     elif data == "history_menu":
-        session = SessionLocal()
-        try:
-            companies = session.query(Company).all()
-            if not companies:
-                await query.message.reply_text("📭 Немає компаній для перегляду історії.")
-                return
-
-            keyboard = []
-            for comp in companies:
-                keyboard.append([InlineKeyboardButton(f"{comp.name}", callback_data=f"view_history:{comp.id}")])
-
-            keyboard.append([InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main")])
-            await query.message.reply_text("🕓 Оберіть компанію для перегляду історії:", reply_markup=InlineKeyboardMarkup(keyboard))
-        finally:
-            session.close()
+        if not await send_company_picker(query.message, context, "history", reset_filter=True):
+            await query.message.reply_text("📭 Немає компаній для перегляду історії.")
 
     elif data.startswith("view_history:"):
         await view_history_paginated(update, context)
@@ -983,12 +1091,17 @@ async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
             [InlineKeyboardButton("✏️ Оновити клієнта", callback_data="update_client_menu")],
             [InlineKeyboardButton("🗑️ Видалити клієнта", callback_data="delete_client_menu")],
             [InlineKeyboardButton("📋 Переглянути всіх", callback_data="list_clients_menu")],
+            [InlineKeyboardButton("📥 Імпорт з CSV", callback_data="import_clients_menu")],
             [InlineKeyboardButton("⬅️ Назад", callback_data="back_to_main")],
         ]
         await query.message.reply_text("👥 Меню клієнтів:", reply_markup=InlineKeyboardMarkup(keyboard))
     # --- CRUD компаній ---
     elif data == "add_company_menu":
-        await query.message.reply_text("Введіть дані компанії у форматі:\n`Назва|Контакт|ClientID|ClientSecret`", parse_mode="Markdown")
+        await query.message.reply_text(
+            "Введіть дані компанії у форматі:\n`Назва|Контакт|ClientID|ClientSecret`\n"
+            "Наступними рядками можна одразу додати працівників: `tg_id|Ім’я` (по одному на рядок)",
+            parse_mode="Markdown"
+        )
         context.user_data["action"] = "add_company_menu"
 
     elif data == "update_company_menu":
@@ -1000,36 +1113,9 @@ async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         context.user_data["action"] = "delete_company_menu"
 
     elif data == "list_companies_menu":
-        session = SessionLocal()
-        try:
-            companies = session.query(Company).all()
-            if not companies:
-                await query.message.reply_text("📭 Немає зареєстрованих компаній.")
-                return
-
-            text = "<b>🏢 Список компаній з працівниками:</b>\n\n"
-            for comp in companies:
-                text += (
-                    f"<b>🏢 {comp.name or '-'} (ID: {comp.id})</b>\n"
-                    f"👤 Контакт: {comp.contact_name or '-'}\n"
-                    f"🧩 ClientID: <code>{comp.client_id or '-'}</code>\n"
-                    f"🔑 ClientSecret: <code>{comp.client_secret or '-'}</code>\n"
-                )
-
-                clients = session.query(Client).filter_by(company_id=comp.id).all()
-                if clients:
-                    text += "👥 <b>Працівники:</b>\n"
-                    for cl in clients:
-                        text += f"• {cl.name or '-'} (tg_id: <code>{cl.tg_id}</code>)\n"
-                else:
-                    text += "👥 Працівників не знайдено.\n"
-
-                text += "\n────────────────────────\n\n"
-
-            await query.message.reply_text(text, parse_mode="HTML")
-
-        finally:
-            session.close()
+        # сторінками по COMPANIES_PER_PAGE в одному повідомленні (app/pagination/listings.py)
+        set_prefix(context, "companies", None)
+        await send_listing(query.message, context, "companies")
 
         
     # --- CRUD клієнтів ---
@@ -1045,41 +1131,25 @@ async def admin_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         return ASK_CLIENT_CONTACT
 
     elif data == "update_client_menu":
-        await query.message.reply_text("Введіть нові дані клієнта у форматі:\n`tg_id|Ім’я|company_id`", parse_mode="Markdown")
+        await query.message.reply_text(
+            "Введіть нові дані клієнта у форматі:\n`tg_id|Ім’я|company_id`\n"
+            "Кілька клієнтів — по одному на рядок (усі зміни однією транзакцією)",
+            parse_mode="Markdown"
+        )
         context.user_data["action"] = "update_client_menu"
 
     elif data == "delete_client_menu":
-        await query.message.reply_text("Введіть tg_id клієнта для видалення:")
+        await query.message.reply_text("Введіть tg_id клієнта для видалення (кілька — через пробіл або кому):")
         context.user_data["action"] = "delete_client_menu"
 
     elif data == "list_clients_menu":
-        session = SessionLocal()
-        try:
-            clients = session.query(Client).all()
-            if not clients:
-                await query.message.reply_text("📭 Немає клієнтів.")
-                return
+        # раніше — окреме повідомлення на кожного клієнта; тепер сторінки в одному повідомленні
+        set_prefix(context, "clients", None)
+        await send_listing(query.message, context, "clients:0")
 
-            await query.message.reply_text("📋 *Список клієнтів:*", parse_mode="Markdown")
-
-            for c in clients:
-                company = session.query(Company).filter_by(id=c.company_id).first()
-                comp_name = company.name if company else "—"
-
-                text = (
-                    f"👤 <b>{c.name or '—'}</b>\n"
-                    f"🏢 Компанія: <i>{comp_name}</i>\n"
-                    f"🆔 tg_id: <code>{c.tg_id}</code>"
-                )
-
-                keyboard = InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✉️ Написати", callback_data=f"write_to_client:{c.tg_id}")]
-                ])
-
-                await query.message.reply_text(text, parse_mode="HTML", reply_markup=keyboard)
-
-        finally:
-            session.close()
+    elif data == "import_clients_menu":
+        context.user_data["action"] = "import_clients"
+        await query.message.reply_text(IMPORT_HELP, parse_mode="HTML")
 
 
     elif data.startswith("write_to_client:"):
@@ -1129,14 +1199,19 @@ async def help_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text += "/add_company - додати компанію (/add_company Назва|Контакт|ClientID|ClientSecret)\n"
     text += "/list_companies - список компаній\n"
     text += "/register_client - прив'язати клієнта до компанії (/register_client tg_id|ім'я|company_id)\n"
-    text += "/history_client tg_id - переглянути історію по клієнту\n"
+    text += "/import_clients - масовий імпорт клієнтів з CSV (tg_id,name,company)\n"
+    text += "/history_client tg_id [24h|7d|30d|YYYY-MM-DD YYYY-MM-DD] - переглянути історію по клієнту\n"
+    text += "/stats [днів] - SLA: час першої відповіді та беклог по компаніях\n"
+    text += "/trace on|off|0.1 - трасування станів (вкл/викл/частка подій)\n"
+    text += "/unreachable - клієнти, що заблокували бота (розсилки їх пропускають)\n"
+    text += "/scheduled - заплановані розсилки (скасування)\n"
     text += "\nОновлення та видалення:\n"
     text += "/update_admin tg_id|name|is_super(True/False)\n"
     text += "/delete_admin tg_id\n"
     text += "/update_company id|name|contact|client_id|client_secret\n"
     text += "/delete_company id\n"
     text += "/update_client tg_id|name|company_id\n"
-    text += "/delete_client tg_id\n"
+    text += "/delete_client tg_id [tg_id ...]\n"
 
     await update.message.reply_text(text)
 
@@ -1172,7 +1247,7 @@ async def receive_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             await context.bot.send_message(chat_id=int(tg), text="Привіт! Тебе призначили адміністратором 🚀")
         except Exception as e:
-            logger.warning(f"Не вдалося надіслати повідомлення новому адміну {tg}: {e}")
+            logger.warning("Не вдалося надіслати повідомлення новому адміну %s: %s", tg, e)
 
         await update.message.reply_text(f"✅ Адмін доданий: {name or tg}")
 
@@ -1286,15 +1361,8 @@ async def list_companies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_is_admin(str(update.effective_user.id)):
         await update.message.reply_text("Доступ заборонено.")
         return
-    session = SessionLocal()
-    try:
-        cs = session.query(Company).all()
-        text = "Компанії:\n"
-        for c in cs:
-            text += f"- {c.id}: {c.name} (contact: {c.contact_name or '-'})\n"
-        await update.message.reply_text(text)
-    finally:
-        session.close()
+    set_prefix(context, "companies", None)
+    await send_listing(update.message, context, "companies")
 
 async def register_client_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # /register_client tg_id|ім'я|company_id
@@ -1316,22 +1384,103 @@ async def register_client_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
     finally:
         session.close()
 
+IMPORT_HELP = (
+    "📥 Надішліть CSV-файл документом. Перший рядок — заголовок:\n"
+    "<code>tg_id,name,company</code>  (або company_id замість company; роздільник , чи ;)\n"
+    "Нові компанії створюються за назвою, наявні клієнти оновлюються."
+)
+IMPORT_REJECTED_SHOWN = 20
+
+async def import_clients_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/import_clients — наступний документ від адміна імпортується як CSV клієнтів."""
+    if not await ensure_is_admin(str(update.effective_user.id)):
+        await update.message.reply_text("Доступ заборонено.")
+        return
+    context.user_data["action"] = "import_clients"
+    await update.message.reply_text(IMPORT_HELP, parse_mode="HTML")
+
+def format_import_report(stats: dict) -> str:
+    text = (
+        "📥 <b>Імпорт завершено</b>\n"
+        f"➕ Додано: {stats['inserted']}\n"
+        f"✏️ Оновлено: {stats['updated']}\n"
+        f"▫️ Без змін: {stats['unchanged']}\n"
+        f"🏢 Нових компаній: {stats['companies_created']}\n"
+        f"❌ Відхилено: {len(stats['rejected'])}"
+    )
+    rejected = stats["rejected"]
+    if rejected:
+        text += "\n\n" + "\n".join(
+            f"рядок {line}: {html.escape(reason)}" for line, reason in rejected[:IMPORT_REJECTED_SHOWN]
+        )
+        if len(rejected) > IMPORT_REJECTED_SHOWN:
+            text += f"\n… ще {len(rejected) - IMPORT_REJECTED_SHOWN}"
+    return text
+
+async def handle_import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    context.user_data.pop("action", None)
+    doc = update.message.document
+    if doc.file_size and doc.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text(f"❌ Файл завеликий (максимум {IMPORT_MAX_BYTES // (1024 * 1024)} МБ).")
+        return
+    if not (doc.file_name or "").lower().endswith((".csv", ".txt")):
+        await update.message.reply_text("❌ Потрібен CSV-файл (.csv). Спробуйте /import_clients ще раз.")
+        return
+
+    file = await doc.get_file()
+    data = bytes(await file.download_as_bytearray())
+    try:
+        # розбір і пачки INSERT / UPDATE — у потоці, бот тим часом обробляє інші апдейти
+        stats = await asyncio.to_thread(import_clients_csv, data)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Не вдалося прочитати файл: {e}")
+        return
+    except SQLAlchemyError as e:
+        logger.exception("❌ [IMPORT] Помилка БД: %s", e)
+        await update.message.reply_text("⚠️ Помилка бази даних під час імпорту; збережено лише завершені пачки.")
+        return
+    clear_search_cache()
+    await update.message.reply_text(format_import_report(stats), parse_mode="HTML")
+
+HISTORY_CLIENT_LIMIT = 50
+
+def parse_range_args(args):
+    """["7d"] -> "7d"; ["2025-01-01", "2025-01-31"] -> "20250101-20250131"; [] -> "all"."""
+    if not args:
+        return "all"
+    if args[0] in HISTORY_RANGES or args[0] == "all":
+        return args[0]
+    dates = [datetime.strptime(d, "%Y-%m-%d").strftime("%Y%m%d") for d in args[:2]]
+    return "-".join(dates)
+
 async def history_client_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_is_admin(str(update.effective_user.id)):
         await update.message.reply_text("Доступ заборонено.")
         return
-    args = update.message.text.partition(" ")[2].strip()
+    args = update.message.text.partition(" ")[2].split()
     if not args:
-        await update.message.reply_text("Формат: /history_client tg_id")
+        await update.message.reply_text(
+            "Формат: /history_client tg_id [24h|7d|30d|all|YYYY-MM-DD [YYYY-MM-DD]]"
+        )
+        return
+    tg = str(args[0])
+    try:
+        range_token = parse_range_args(args[1:])
+    except ValueError:
+        await update.message.reply_text("❌ Невірний період. Приклад: /history_client 123 7d або 2025-01-01 2025-01-31")
         return
-    tg = str(args)
+    since, until = history_range_bounds(range_token)
     session = SessionLocal()
     try:
-        msgs = session.query(Message).filter_by(client_tg_id=tg).order_by(Message.created_at).all()
+        # найновіші HISTORY_CLIENT_LIMIT у межах періоду, показуємо від старіших до новіших
+        msgs = get_client_history(session, tg, since, until, newest_first=True, limit=HISTORY_CLIENT_LIMIT)
+        msgs.reverse()
         if not msgs:
             await update.message.reply_text("Повідомлень не знайдено.")
             return
-        text = f"Історія розмови з {tg}:\n"
+        text = f"Історія розмови з {tg} ({range_label(range_token)}):\n"
+        if len(msgs) == HISTORY_CLIENT_LIMIT:
+            text += f"(показано останні {HISTORY_CLIENT_LIMIT})\n"
         for m in msgs:
             dir_mark = "📥" if m.direction == "in" else "📤"
             text += f"{dir_mark} {m.created_at} {m.text}\n"
@@ -1339,6 +1488,205 @@ async def history_client_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE)
     finally:
         session.close()
 
+async def trace_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/trace on|off|<0..1> — вмикає, вимикає або семплює трасування без перезапуску."""
+    if not await ensure_is_admin(str(update.effective_user.id)):
+        await update.message.reply_text("Доступ заборонено.")
+        return
+    arg = update.message.text.partition(" ")[2].strip().lower()
+    try:
+        if arg == "on":
+            tracer.configure(enabled=True)
+        elif arg == "off":
+            tracer.configure(enabled=False)
+        elif arg:
+            tracer.configure(sample_rate=float(arg))
+    except ValueError:
+        await update.message.reply_text("Формат: /trace on|off|0.1")
+        return
+    state = "увімкнено" if tracer.enabled else "вимкнено"
+    await update.message.reply_text(f"🔎 Трасування {state}, sample_rate={tracer.sample_rate:g}")
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats [днів] — SLA по компаніях і адмінах (читає лише зведені таблиці)."""
+    if not await ensure_is_admin(str(update.effective_user.id)):
+        await update.message.reply_text("Доступ заборонено.")
+        return
+    args = update.message.text.partition(" ")[2].strip()
+    days = int(args) if args.isdigit() and int(args) > 0 else 7
+
+    session = SessionLocal()
+    try:
+        companies = get_sla_summary(session, days)
+        admins = get_admin_summary(session, days)
+        if not companies and not admins:
+            await update.message.reply_text("📭 Статистики ще немає.")
+            return
+
+        names = dict(
+            session.query(Company.id, Company.name)
+            .filter(Company.id.in_([c["company_id"] for c in companies]))
+            .all()
+        )
+        admin_names = dict(
+            session.query(Admin.tg_id, Admin.name)
+            .filter(Admin.tg_id.in_([a["admin_tg_id"] for a in admins]))
+            .all()
+        )
+
+        text = f"<b>📊 SLA за {days} дн.</b>\n\n"
+        for c in companies[:15]:
+            name = names.get(c["company_id"]) or ("Без компанії" if not c["company_id"] else f"ID {c['company_id']}")
+            text += (
+                f"<b>🏢 {html.escape(name)}</b>\n"
+                f"📥 {c['inbound']} | 🔒 {c['claims']} | 📤 {c['outbound']} | ⏳ беклог: {c['backlog']}\n"
+                f"⏱ перша відповідь: сер. {format_duration(c['avg_sec'])}, "
+                f"p50 ≤ {format_duration(c['p50'])}, p90 ≤ {format_duration(c['p90'])}\n\n"
+            )
+        if admins:
+            text += "<b>🛠️ Адміни:</b>\n"
+            for a in admins:
+                name = admin_names.get(a["admin_tg_id"]) or a["admin_tg_id"]
+                text += (
+                    f"• {html.escape(name)}: 🔒 {a['claims']} | 📤 {a['outbound']} | "
+                    f"⏱ сер. {format_duration(a['avg_sec'])}\n"
+                )
+        await update.message.reply_text(text, parse_mode="HTML")
+    finally:
+        session.close()
+
+def format_unreachable_report(report: dict, period: str = None) -> str:
+    text = f"<b>🚫 Недоступні клієнти: {report['total']}</b>\n"
+    if period:
+        text += f"🆕 Нових за {period}: {report['new']}\n"
+    if report["reasons"]:
+        text += "\n"
+        for reason, count in report["reasons"][:10]:
+            text += f"• {html.escape(reason or '—')}: {count}\n"
+    if UNREACHABLE_RETRY_DAYS:
+        text += f"\nРозсилки пропускають їх {UNREACHABLE_RETRY_DAYS} дн., або доки клієнт сам не напише боту."
+    else:
+        text += "\nРозсилки пропускають їх, доки клієнт сам не напише боту."
+    return text
+
+async def unreachable_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/unreachable — скільки клієнтів заблокували бота (їм не надсилаються розсилки)."""
+    if not await ensure_is_admin(str(update.effective_user.id)):
+        await update.message.reply_text("Доступ заборонено.")
+        return
+    session = SessionLocal()
+    try:
+        report = get_unreachable_report(session, since=datetime.utcnow() - timedelta(days=1))
+        await update.message.reply_text(format_unreachable_report(report, "добу"), parse_mode="HTML")
+    finally:
+        session.close()
+
+async def unreachable_report_job(context: ContextTypes.DEFAULT_TYPE):
+    """Раз на UNREACHABLE_REPORT_HOURS: супер-адмінам (або всім, якщо таких немає) — нові недоступні клієнти."""
+    session = SessionLocal()
+    try:
+        since = datetime.utcnow() - timedelta(hours=UNREACHABLE_REPORT_HOURS)
+        report = get_unreachable_report(session, since=since)
+        if not report["new"]:
+            return
+        admins = session.query(Admin.tg_id).filter(Admin.is_super == 1).all() or session.query(Admin.tg_id).all()
+    finally:
+        session.close()
+
+    text = format_unreachable_report(report, f"{UNREACHABLE_REPORT_HOURS:g} год.")
+    for (admin_tg,) in admins:
+        try:
+            await context.bot.send_message(chat_id=int(admin_tg), text=text, parse_mode="HTML",
+                                           rate_limit_args=NOTIFICATION_ARGS)
+        except Exception as e:
+            logger.warning("⚠️ Не вдалося надіслати звіт про недоступних адміну %s: %s", admin_tg, e)
+    logger.info("🚫 [UNREACHABLE] Звіт: усього %s, нових %s", report["total"], report["new"])
+
+async def media_gc_job(context: ContextTypes.DEFAULT_TYPE):
+    """Раз на MEDIA_GC_INTERVAL: прохід GC сховища медіа (обхід диска — в окремому потоці)."""
+    try:
+        await asyncio.to_thread(collect_garbage)
+    except Exception:
+        logger.exception("❌ [MEDIA] Помилка GC сховища медіа")
+
+async def scheduled_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/scheduled — заплановані розсилки з кнопками скасування."""
+    if not await ensure_is_admin(str(update.effective_user.id)):
+        await update.message.reply_text("Доступ заборонено.")
+        return
+    session = SessionLocal()
+    try:
+        items = list_scheduled(session)
+        if not items:
+            await update.message.reply_text("🕒 Запланованих розсилок немає.")
+            return
+        text = "<b>🕒 Заплановані розсилки</b>\n\n"
+        keyboard = []
+        for item in items:
+            status = "▶️ йде зараз" if item.status == "running" else describe_schedule(item)
+            preview = (item.text or f"({item.file_type})")[:40]
+            text += f"#{item.id}: {html.escape(status)}\n{html.escape(preview)}"
+            if item.cursor:
+                text += f" (продовжиться з клієнта ID {item.cursor})"
+            text += "\n\n"
+            keyboard.append([InlineKeyboardButton(f"❌ Скасувати #{item.id}", callback_data=f"scheduled_cancel:{item.id}")])
+        await update.message.reply_text(text, parse_mode="HTML", reply_markup=InlineKeyboardMarkup(keyboard))
+    finally:
+        session.close()
+
+async def scheduled_cancel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    if not await ensure_is_admin(str(update.effective_user.id)):
+        await q.message.reply_text("⛔ Ви не є адміністратором.")
+        return
+    sched_id = int(q.data.split(":", 1)[1])
+    session = SessionLocal()
+    try:
+        cancelled = cancel_scheduled(session, sched_id)
+    finally:
+        session.close()
+    await q.message.reply_text(
+        f"❌ Розсилку #{sched_id} скасовано." if cancelled else f"⚠️ Розсилка #{sched_id} вже завершена або скасована."
+    )
+
+async def run_scheduled_broadcast(context: ContextTypes.DEFAULT_TYPE, sched_id: int):
+    bind(broadcast_id=f"scheduled-{sched_id}")
+    try:
+        result = await execute_scheduled(get_client_bot(), sched_id)
+    except Exception as e:
+        logger.exception("❌ [BROADCAST] Запланована розсилка #%s впала: %s", sched_id, e)
+        return
+    if not result:
+        return
+
+    item, stats = result["item"], result["stats"]
+    text = (
+        f"📣 Запланована розсилка #{sched_id}: відправлено {stats['sent']}, помилок {stats['failed']}, "
+        f"недоступних {stats['unreachable']}."
+    )
+    if result["status"] == "scheduled":
+        more = "Продовження" if not stats["complete"] else "Наступний запуск"
+        text += f"\n🕒 {more}: {describe_schedule(item)}"
+    elif stats.get("media_lost"):
+        text += "\n❌ Зупинено: файл розсилки втрачено — заплануйте її заново."
+    elif result["status"] == "cancelled":
+        text += "\n❌ Зупинено: розсилку скасовано."
+    try:
+        await context.bot.send_message(chat_id=int(item.admin_tg_id), text=text, rate_limit_args=NOTIFICATION_ARGS)
+    except Exception as e:
+        logger.warning("⚠️ Не вдалося повідомити адміна %s про розсилку #%s: %s", item.admin_tg_id, sched_id, e)
+
+async def scheduled_broadcasts_job(context: ContextTypes.DEFAULT_TYPE):
+    """Раз на SCHEDULE_POLL_SECONDS: запускає заплановані розсилки, час яких настав (кожну — окремою задачею)."""
+    session = SessionLocal()
+    try:
+        due = claim_due_broadcasts(session)
+    finally:
+        session.close()
+    for sched_id in due:
+        context.application.create_task(run_scheduled_broadcast(context, sched_id), name=f"scheduled_broadcast:{sched_id}")
+
 async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get("broadcast_active"):
         context.user_data.pop("broadcast_active", None)
@@ -1352,6 +1700,7 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not claim_id:
         await update.message.reply_text("⚠️ Відсутній активний запит для відповіді.")
         return
+    bind(claim_id=claim_id)
 
     file_id, file_type = None, None
     if update.message.photo:
@@ -1383,23 +1732,7 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         media_path = None
         if file_id:
-            try:
-                bot = context.bot
-                file = await bot.get_file(file_id)
-                ext = {
-                    "photo": "jpg",
-                    "document": "dat",
-                    "video": "mp4",
-                    "voice": "ogg"
-                }.get(file_type, "bin")
-
-                filename = f"{file_type}_{int(datetime.utcnow().timestamp())}_{tg_id}.{ext}"
-                media_path = f"/data/media/{filename}"
-                os.makedirs("/data/media", exist_ok=True)
-                await file.download_to_drive(media_path)
-                logger.info(f"📁 Медіа збережено: {media_path}")
-            except Exception as e:
-                logger.warning(f"⚠️ Не вдалося зберегти медіа: {e}")
+            media_path = await store_telegram_file(context.bot, file_id, file_type)
 
         reply_msg = Message(
             client_tg_id=client_tg_id,
@@ -1408,61 +1741,53 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
             file_id=file_id,
             file_type=file_type,
             file_path=media_path,
-            company_snapshot=message.company_snapshot if message else None
+            company_snapshot=message.company_snapshot if message else None,
+            company_id=message.company_id if message else None
         )
         session.add(reply_msg)
+
+        # 📊 SLA: перша відповідь на claim фіксує час реакції
+        now = datetime.utcnow()
+        first_response_sec = None
+        if claim.first_response_at is None:
+            claim.first_response_at = now
+            if message and message.created_at:
+                first_response_sec = (now - message.created_at).total_seconds()
+        record_outbound(session, reply_msg.company_id, tg_id, at=now, first_response_sec=first_response_sec)
         session.commit()
 
-        client_bot = Bot(token=os.getenv("TELEGRAM_TOKEN_CLIENT"))
+        client_bot = get_client_bot()
+        caption = f"💬 Відповідь від менеджера:\n{text or '(без тексту)'}"
 
+        # повтори після 429 / тайм-аутів / збоїв мережі робить черга токена (app/ratelimit.py)
+        notice = "✅ Відповідь надіслана клієнту."
         try:
-            # === ВІДПРАВКА МЕДІА ===
-            if media_path and os.path.exists(media_path):
+            if media_path and os.path.exists(media_path) and file_type in SENDERS:
+                method, field = SENDERS[file_type]
                 with open(media_path, "rb") as f:
-                    if file_type == "photo":
-                        await client_bot.send_photo(chat_id=int(client_tg_id), photo=f, caption=f"💬 Відповідь від менеджера:\n{text or '(без тексту)'}")
-                    elif file_type == "document":
-                        await client_bot.send_document(chat_id=int(client_tg_id), document=f, caption=f"💬 Відповідь від менеджера:\n{text or '(без тексту)'}")
-                    elif file_type == "video":
-                        await client_bot.send_video(chat_id=int(client_tg_id), video=f, caption=f"💬 Відповідь від менеджера:\n{text or '(без тексту)'}")
-                    elif file_type == "voice":
-                        await client_bot.send_voice(chat_id=int(client_tg_id), voice=f, caption="💬 Відповідь від менеджера.")
-                logger.info(f"🗑️ Видаляю медіа після відправки: {media_path}")
-                os.remove(media_path)
+                    sent = await safe_send(getattr(client_bot, method), chat_id=int(client_tg_id),
+                                           caption=caption, **{field: f})
             else:
-                # === ВІДПРАВКА ТЕКСТУ ===
-                await client_bot.send_message(chat_id=int(client_tg_id), text=f"💬 Відповідь від менеджера:\n{text}")
-
-        # === ОБРОБКА ПОМИЛОК TELEGRAM API ===
-        except TimedOut:
-            logger.warning(f"⚠️ Telegram API timeout при надсиланні клієнту {client_tg_id}. Повтор через 5 секунд.")
-            await asyncio.sleep(5)
-            try:
-                await client_bot.send_message(chat_id=int(client_tg_id), text=f"💬 Відповідь від менеджера (повторна спроба):\n{text}")
-            except Exception as e:
-                logger.error(f"❌ Повторна спроба не вдалася: {e}")
-
-        except RetryAfter as e:
-            delay = int(getattr(e, 'retry_after', 5))
-            logger.warning(f"⚠️ Перевищено ліміт запитів. Чекаю {delay} секунд перед повтором.")
-            await asyncio.sleep(delay)
-            try:
-                await client_bot.send_message(chat_id=int(client_tg_id), text=f"💬 Відповідь від менеджера:\n{text}")
-            except Exception as e:
-                logger.error(f"❌ Повтор після RateLimit не вдався: {e}")
-
-        except NetworkError:
-            logger.warning(f"🌐 Проблема з мережею під час відправки клієнту {client_tg_id}. Повідомлення пропущено.")
-
+                sent = await safe_send(client_bot.send_message, chat_id=int(client_tg_id), text=caption)
+            if not sent:
+                notice = "⚠️ Telegram відхилив відповідь — клієнт її не отримав."
+        except ClientUnreachable as e:
+            mark_clients_unreachable(session, {client_tg_id: e.reason})
+            notice = "🚫 Клієнт заблокував бота — відповідь не доставлено (збережено в історії)."
+        except TimedOut as e:
+            # повтор міг би надіслати відповідь удруге — черга його не робить, рішення за адміном
+            logger.warning("⚠️ Тайм-аут відповіді клієнту %s: %s", client_tg_id, e)
+            notice = "⚠️ Telegram не підтвердив доставку (тайм-аут) — перевірте чат клієнта, перш ніж надсилати знову."
         except Exception as e:
-            logger.exception(f"❌ Помилка при надсиланні клієнту {client_tg_id}: {e}")
+            logger.warning("⚠️ Не вдалося надіслати відповідь клієнту %s: %s", client_tg_id, e)
+            notice = "⚠️ Telegram зараз недоступний — відповідь не доставлено (збережено в історії). Спробуйте пізніше."
 
         # --- Відповідь адміну ---
-        await update.message.reply_text("✅ Відповідь надіслана клієнту.")
+        await update.message.reply_text(notice)
         context.user_data.pop("replying_claim_id", None)
 
     except Exception as e:
-        logger.exception(f"❌ Помилка у handle_admin_reply: {e}")
+        logger.exception("❌ Помилка у handle_admin_reply: %s", e)
         await update.message.reply_text("⚠️ Сталася помилка при надсиланні.")
     finally:
         session.close()
@@ -1489,15 +1814,17 @@ async def reply_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     session = SessionLocal()
     try:
         # 1) зберегти вихідне повідомлення у БД
-        m = Message(client_tg_id=str(client_tg), admin_tg_id=str(update.effective_user.id), direction='out', text=text)
+        client_obj = session.query(Client).filter_by(tg_id=str(client_tg)).first()
+        company_id = client_obj.company_id if client_obj else None
+        m = Message(client_tg_id=str(client_tg), admin_tg_id=str(update.effective_user.id), direction='out', text=text,
+                    company_id=company_id)
         session.add(m)
+        record_outbound(session, company_id, update.effective_user.id)
         session.commit()
         session.refresh(m)
 
         # 2) надіслати клієнту через bot з токеном client
-        from telegram import Bot
-        client_token = os.getenv("TELEGRAM_TOKEN_CLIENT")
-        bot = Bot(token=client_token)
+        bot = get_client_bot()
         try:
             await bot.send_message(chat_id=int(client_tg), text=f"Відповідь від адміністратора {update.effective_user.full_name}:\n\n{text}")
             await update.message.reply_text("Відправлено клієнту.")
@@ -1624,16 +1951,17 @@ async def delete_client_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await ensure_is_admin(str(update.effective_user.id)):
         await update.message.reply_text("Доступ заборонено.")
         return
-    args = update.message.text.partition(" ")[2].strip()
-    if not args:
-        await update.message.reply_text("Формат: /delete_client tg_id")
+    tg_ids = update.message.text.partition(" ")[2].replace(",", " ").split()
+    if not tg_ids:
+        await update.message.reply_text("Формат: /delete_client tg_id [tg_id ...]")
         return
-    tg_id = args
     session = SessionLocal()
     try:
-        ok = delete_client(session, tg_id)
-        if ok:
-            await update.message.reply_text(f"✅ Клієнт {tg_id} видалений.")
+        deleted = delete_clients(session, tg_ids)
+        if len(tg_ids) > 1:
+            await update.message.reply_text(f"✅ Видалено клієнтів: {deleted} з {len(tg_ids)}.")
+        elif deleted:
+            await update.message.reply_text(f"✅ Клієнт {tg_ids[0]} видалений.")
         else:
             await update.message.reply_text("❌ Клієнта не знайдено.")
     finally:
@@ -1653,11 +1981,27 @@ async def handle_crud_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         # --- Companies ---
         if action == "add_company_menu":
-            parts = [p.strip() for p in text.split("|")]
-            c = add_company(session, name=parts[0], contact_name=parts[1] if len(parts) > 1 else None,
-                            client_id=parts[2] if len(parts) > 2 else None,
-                            client_secret=parts[3] if len(parts) > 3 else None)
-            await update.message.reply_text(f"✅ Компанія '{c.name}' додана (id={c.id})")
+            lines = [line for line in text.splitlines() if line.strip()]
+            parts = [p.strip() for p in lines[0].split("|")]
+            employees = []
+            for line in lines[1:]:
+                tg, _, name = (p.strip() for p in line.partition("|"))
+                if not tg.isdigit():
+                    await update.message.reply_text(f"❌ Невірний tg_id у рядку «{line}» — нічого не збережено.")
+                    return
+                employees.append({"tg_id": tg, "name": name or None})
+            # компанія і її працівники — одна транзакція: або все, або нічого
+            with unit_of_work(session):
+                c = add_company(session, name=parts[0], contact_name=parts[1] if len(parts) > 1 else None,
+                                client_id=parts[2] if len(parts) > 2 else None,
+                                client_secret=parts[3] if len(parts) > 3 else None, commit=False)
+                for e in employees:
+                    e["company_id"] = c.id
+                add_clients(session, employees, commit=False)
+            text_out = f"✅ Компанія '{c.name}' додана (id={c.id})"
+            if employees:
+                text_out += f", працівників: {len(employees)}"
+            await update.message.reply_text(text_out)
 
         elif action == "update_company_menu":
             parts = [p.strip() for p in text.split("|")]
@@ -1680,14 +2024,55 @@ async def handle_crud_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(f"✅ Клієнт {c.name or c.tg_id} доданий.")
 
         elif action == "update_client_menu":
-            parts = [p.strip() for p in text.split("|")]
-            c = update_client(session, parts[0], parts[1] if len(parts) > 1 else None,
-                              int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else None)
-            await update.message.reply_text("✅ Клієнт оновлений." if c else "❌ Не знайдено.")
+            changes = []
+            for line in text.splitlines():
+                if not line.strip():
+                    continue
+                parts = [p.strip() for p in line.split("|")]
+                changes.append({"tg_id": parts[0], "name": parts[1] if len(parts) > 1 and parts[1] else None,
+                                "company_id": int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else None})
+            found = update_clients(session, changes)
+            if len(changes) == 1:
+                await update.message.reply_text("✅ Клієнт оновлений." if found else "❌ Не знайдено.")
+            else:
+                await update.message.reply_text(f"✅ Оновлено клієнтів: {found} з {len(changes)}.")
 
         elif action == "delete_client_menu":
-            ok = delete_client(session, text)
-            await update.message.reply_text("✅ Клієнта видалено." if ok else "❌ Не знайдено.")
+            tg_ids = text.replace(",", " ").split()
+            deleted = delete_clients(session, tg_ids)
+            if len(tg_ids) == 1:
+                await update.message.reply_text("✅ Клієнта видалено." if deleted else "❌ Не знайдено.")
+            else:
+                await update.message.reply_text(f"✅ Видалено клієнтів: {deleted} з {len(tg_ids)}.")
+
+        # --- History: власний період ---
+        elif action == "history_custom_range":
+            try:
+                range_token = parse_range_args(text.replace("..", " ").split())
+            except ValueError:
+                await update.message.reply_text(
+                    "❌ Невірний формат (приклад: 2025-01-01 2025-01-31). Оберіть «Свій період» ще раз."
+                )
+                return
+            company = session.query(Company).filter_by(id=context.user_data.get("history_company_id")).first()
+            if not company:
+                await update.message.reply_text("❌ Компанію не знайдено.")
+                return
+            page_text, markup = render_history_page(session, company, 0, range_token)
+            await update.message.reply_text(page_text, parse_mode="HTML", reply_markup=markup)
+
+        # --- Списки: фільтр за початком назви ---
+        elif action == "list_filter":
+            target = context.user_data.pop("list_filter_target", None) or "clients:0"
+            set_prefix(context, target.split(":", 1)[0], text[:64])
+            page_text, markup = render_listing(session, context, target)
+            await update.message.reply_text(page_text, parse_mode="HTML", reply_markup=markup)
+
+        # --- Пікер компаній (поза розмовами — вибір компанії для історії) ---
+        elif action == "picker_filter":
+            purpose = context.user_data.get("picker_filter_target") or "history"
+            apply_picker_filter(context, purpose, text)
+            await send_company_picker(update.message, context, purpose)
 
     except Exception as e:
         await update.message.reply_text(f"⚠️ Помилка: {e}")
@@ -1700,6 +2085,12 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     """Головний обробник будь-яких повідомлень від адміна.
     Пріоритет: 1) reply (replying_claim_id)  2) CRUD action  3) broadcast_active  4) handle_admin_reply
     """
+    # 0) Адмін щойно обрав імпорт — документ є CSV клієнтів, а не відповіддю клієнту
+    if context.user_data.get("action") == "import_clients":
+        if update.message.document:
+            return await handle_import_document(update, context)
+        context.user_data.pop("action", None)
+
     # 1) Якщо адмін взяв claim — відповіді мають бути оброблені насамперед
     if context.user_data.get("replying_claim_id"):
         logger.debug("ℹ️ Повідомлення обробляється як відповідь на claim (replying_claim_id).")
@@ -1714,7 +2105,8 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     action = context.user_data.get("action")
     if action in [
         "add_company_menu", "update_company_menu", "delete_company_menu",
-        "add_client_menu", "update_client_menu", "delete_client_menu"
+        "add_client_menu", "update_client_menu", "delete_client_menu",
+        "history_custom_range", "list_filter", "picker_filter"
     ]:
         return await handle_crud_input(update, context)
 
@@ -1761,7 +2153,7 @@ async def handle_write_to_client(update: Update, context: ContextTypes.DEFAULT_T
         file_type = "audio"
 
     session = SessionLocal()
-    client_bot = Bot(token=os.getenv("TELEGRAM_TOKEN_CLIENT"))
+    client_bot = get_client_bot()
 
     try:
         admin_tg = str(update.effective_user.id)
@@ -1786,12 +2178,14 @@ async def handle_write_to_client(update: Update, context: ContextTypes.DEFAULT_T
             file_id=file_id,
             file_type=file_type,
             company_snapshot=company_name,
+            company_id=client_obj.company_id,
             created_at=datetime.utcnow(),
         )
         session.add(message)
+        record_outbound(session, client_obj.company_id, admin_tg)
         session.commit()
         session.refresh(message)
-        logger.info(f"✅ Повідомлення записано в базу (ID={message.id})")
+        logger.info("✅ Повідомлення записано в базу (ID=%s)", message.id)
 
         # 📤 Потім відправляємо клієнту
         if file_id and file_type:
@@ -1837,11 +2231,38 @@ async def start_write_to_client(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return WRITE_TO_CLIENT
 
+    # Deep link з inline-пошуку: /start write_<tg_id>
+    if update.message and context.args and context.args[0].startswith("write_"):
+        if not await ensure_is_admin(str(update.effective_user.id)):
+            await update.message.reply_text("⛔ Ви не є адміністратором.")
+            return ConversationHandler.END
+        tg = context.args[0].split("_", 1)[1]
+        context.user_data["write_to_client_mode"] = True
+        context.user_data["target_client_tg"] = tg
+        await update.message.reply_text(
+            f"✍️ Введіть повідомлення (текст або медіа) для клієнта `{tg}`.\nЩоб скасувати, /cancel",
+            parse_mode="Markdown"
+        )
+        return WRITE_TO_CLIENT
+
     # Якщо команда /write_client (опціонально) — запитай tg_id
     if update.message:
         await update.message.reply_text("Введіть tg_id клієнта або натисніть кнопку.")
         return WRITE_TO_CLIENT
 
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """@adminbot <ім'я | tg_id | компанія> — пошук з діями прямо в результатах (лише для адмінів)."""
+    iq = update.inline_query
+    if not await ensure_is_admin(str(update.effective_user.id)):
+        await iq.answer([], cache_time=60, is_personal=True)
+        return
+    session = SessionLocal()
+    try:
+        results = search_results(session, iq.query, context.bot.username)
+    finally:
+        session.close()
+    await iq.answer(results, cache_time=SEARCH_ANSWER_CACHE, is_personal=True)
+
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.pop("write_to_client_mode", None)
     context.user_data.pop("target_client_tg", None)
@@ -1857,8 +2278,19 @@ async def set_admin_commands(app):
     ])
     logger.info("✅ Команди /start і /help_admin додані в меню Telegram")
 
-def run_admin_bot():
-    app = ApplicationBuilder().token(ADMIN_TOKEN).post_init(set_admin_commands).build()
+def build_admin_app():
+    """Збирає Application адмін-бота з усіма хендлерами (без запуску polling)."""
+    app = (
+        application_builder(ADMIN_TOKEN)
+        .persistence(DbPersistence("admin"))
+        .post_init(set_admin_commands)
+        .build()
+    )
+
+    # --- 🔗 Кореляційні id для логів (виконується першим для кожного апдейту) ---
+    app.add_handler(TypeHandler(Update, bind_update), group=-1)
+    # --- 📼 Запис апдейтів для bench/replay.py (якщо задано UPDATE_RECORD_PATH) ---
+    install_update_recorder(app, "admin")
 
     # --- 🧭 Основні команди ---
     app.add_handler(CommandHandler("start1", start_admin))
@@ -1871,14 +2303,23 @@ def run_admin_bot():
     app.add_handler(CommandHandler("add_company", add_company_cmd))
     app.add_handler(CommandHandler("list_companies", list_companies))
     app.add_handler(CommandHandler("register_client", register_client_cmd))
+    app.add_handler(CommandHandler("import_clients", import_clients_cmd))
     app.add_handler(CommandHandler("history_client", history_client_cmd))
     app.add_handler(CommandHandler("reply", reply_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("trace", trace_cmd))
+    app.add_handler(CommandHandler("unreachable", unreachable_cmd))
+    app.add_handler(CommandHandler("scheduled", scheduled_cmd))
 
     # --- 💬 Callback для кнопки "Відповісти" ---
     app.add_handler(CallbackQueryHandler(claim_callback, pattern=r"^claim:\d+$"))
+    app.add_handler(InlineQueryHandler(inline_search))
+    app.add_handler(CallbackQueryHandler(scheduled_cancel_callback, pattern=r"^scheduled_cancel:\d+$"))
 
     # --- 👥 CRUD адміністраторів (окремий ConversationHandler) ---
     admin_conv = ConversationHandler(
+        name="admin_conv",
+        persistent=True,
         entry_points=[
             CallbackQueryHandler(admin_menu_callback, pattern="^(add_admin|update_admin|delete_admin)$"),
         ],
@@ -1898,6 +2339,7 @@ def run_admin_bot():
     # --- 📣 Масова розсилка ---
     broadcast_conv = ConversationHandler(
         name="broadcast_conv",
+        persistent=True,
         entry_points=[
             CallbackQueryHandler(start_broadcast_callback, pattern="^broadcast$")
         ],
@@ -1913,6 +2355,18 @@ def run_admin_bot():
             ASK_BROADCAST_CONFIRM: [
                 CallbackQueryHandler(broadcast_confirm_callback, pattern="^broadcast_confirm$"),
                 CallbackQueryHandler(broadcast_cancel_callback, pattern="^broadcast_cancel$"),
+                CallbackQueryHandler(broadcast_companies_callback, pattern="^broadcast_companies$"),
+                CallbackQueryHandler(broadcast_active_days_callback, pattern="^broadcast_active_days$"),
+                CallbackQueryHandler(broadcast_schedule_callback, pattern="^broadcast_schedule$"),
+            ],
+            ASK_BROADCAST_SCHEDULE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_broadcast_schedule),
+                CommandHandler("cancel", broadcast_cancel_callback),
+            ],
+            ASK_BROADCAST_COMPANIES: [
+                CallbackQueryHandler(broadcast_company_pick_callback, pattern=r"^pick_co:bc:[npfxsd]:\d+$"),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_broadcast_companies),
+                CommandHandler("cancel", broadcast_cancel_callback),
             ],
         },
         fallbacks=[],
@@ -1922,6 +2376,8 @@ def run_admin_bot():
     )
     # --- ➕ Додавання клієнта ---
     add_client_conv = ConversationHandler(
+        name="add_client_conv",
+        persistent=True,
         entry_points=[CallbackQueryHandler(admin_menu_callback, pattern="^add_client_menu$")],
         states={
             ASK_CLIENT_CONTACT: [
@@ -1931,7 +2387,8 @@ def run_admin_bot():
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_client_name)
             ],
             ASK_CLIENT_COMPANY: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_client_company)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_client_company),
+                CallbackQueryHandler(client_company_pick_callback, pattern=r"^pick_co:client:[npfxs]:\d+$"),
             ],
         },
         fallbacks=[],
@@ -1951,9 +2408,11 @@ def run_admin_bot():
     # --- 💬 FSM для відповіді клієнту (рекомендується) ---
     write_to_client_conv = ConversationHandler(
         name="write_to_client_conv",
+        persistent=True,
         entry_points=[
             CallbackQueryHandler(start_write_to_client, pattern=r"^write_to_client:\d+$"),
             CommandHandler("write_client", start_write_to_client),  # опціонально
+            CommandHandler("start", start_write_to_client, filters=filters.Regex(r"^/start write_\d+$")),
         ],
         states={
             WRITE_TO_CLIENT: [
@@ -1983,9 +2442,50 @@ def run_admin_bot():
 
     app.add_handler(CallbackQueryHandler(reset_states_callback, pattern="^reset_states$"))
     # --- 🧩 Callback для решти меню ---
-    app.add_handler(CallbackQueryHandler(view_history_paginated, pattern=r"^history_page:\d+:\d+$"))
+    app.add_handler(CallbackQueryHandler(view_history_paginated, pattern=r"^history_page:\d+:\d+:[\w-]+$"))
+    app.add_handler(CallbackQueryHandler(view_listing, pattern=r"^(clients_page:\d+:[np]:\d+|companies_page:[np]:\d+|list_filter(_clear)?:(clients:\d+|companies))$"))
+    app.add_handler(CallbackQueryHandler(view_history_paginated, pattern=r"^(view_history|history_custom):\d+(:[\w-]+)?$"))
+    app.add_handler(CallbackQueryHandler(company_picker_nav_callback, pattern=r"^pick_co:\w+:[npfxsd]:\d+$"))
     app.add_handler(CallbackQueryHandler(admin_menu_callback, pattern=r'^(?!add_admin$|update_admin$|delete_admin$|broadcast$|add_client_menu$|claim:).+'))
 
+    # --- 🚫 Періодичний звіт про клієнтів, що заблокували бота ---
+    if UNREACHABLE_REPORT_HOURS > 0:
+        if app.job_queue is None:
+            logger.warning("⚠️ JobQueue недоступна (pip install \"python-telegram-bot[job-queue]\") — звіт вимкнено")
+        else:
+            interval = UNREACHABLE_REPORT_HOURS * 3600
+            app.job_queue.run_repeating(unreachable_report_job, interval=interval, first=interval,
+                                        name="unreachable_report")
+
+    # --- 🕒 Заплановані розсилки (таблиця scheduled_broadcasts, переживають рестарт) ---
+    if app.job_queue is None:
+        logger.warning("⚠️ JobQueue недоступна — заплановані розсилки не виконуватимуться")
+    else:
+        session = SessionLocal()
+        try:
+            resume_interrupted_broadcasts(session)
+        finally:
+            session.close()
+        app.job_queue.run_repeating(scheduled_broadcasts_job, interval=SCHEDULE_POLL_SECONDS, first=5,
+                                    name="scheduled_broadcasts")
+
+    # --- 🧹 Сховище медіа: сироти та LRU-витіснення понад MEDIA_MAX_MB (спільне для обох ботів) ---
+    if MEDIA_GC_INTERVAL > 0:
+        if app.job_queue is None:
+            logger.warning("⚠️ JobQueue недоступна — сховище медіа не очищатиметься")
+        else:
+            app.job_queue.run_repeating(media_gc_job, interval=MEDIA_GC_INTERVAL, first=60, name="media_gc")
+
+    # --- 📈 Метрики: латентність хендлерів, SQL, Bot API ---
+    instrument_application(app)
+    instrument_engine(engine)
+    return app
+
+
+def run_admin_bot():
+    app = build_admin_app()
+    start_metrics_server()
+
     logger.info("✅ Запускаю admin bot")
     app.run_polling()
 
@@ -0,0 +1,82 @@
+"""
+Спільні екземпляри Bot для відправок "чужим" токеном
+(адмін-бот шле клієнтам через клієнтський токен і навпаки).
+
+Раніше Bot(token=...) створювався на кожне повідомлення — новий HTTP-пул щоразу.
+Тепер один інструментований екземпляр на токен на процес.
+
+Усі екземпляри одного токена в процесі (включно з ботом Application) ділять одну
+чергу вихідних запитів з пріоритетами (app/ratelimit.py), тож це ExtBot.
+
+Адресу Bot API можна перевизначити (TELEGRAM_API_BASE_URL / TELEGRAM_FILE_BASE_URL),
+наприклад, щоб ганяти ботів проти локального bench/fake_bot_api.py.
+"""
+import os
+from telegram.ext import ApplicationBuilder, ExtBot
+
+from .metrics import InstrumentedRequest
+from .concurrency import update_processor_from_env
+from .ratelimit import PriorityRateLimiter
+
+DEFAULT_API_BASE_URL = "https://api.telegram.org/bot"
+DEFAULT_FILE_BASE_URL = "https://api.telegram.org/file/bot"
+
+_bots = {}
+_limiters = {}
+
+
+def api_base_urls():
+    """(base_url, base_file_url) з оточення; читається під час виклику, бо .env вантажиться пізніше."""
+    return (
+        os.getenv("TELEGRAM_API_BASE_URL") or DEFAULT_API_BASE_URL,
+        os.getenv("TELEGRAM_FILE_BASE_URL") or DEFAULT_FILE_BASE_URL,
+    )
+
+
+def rate_limiter(token: str) -> PriorityRateLimiter:
+    """Одна черга вихідних запитів на токен на процес."""
+    limiter = _limiters.get(token)
+    if limiter is None:
+        limiter = _limiters[token] = PriorityRateLimiter(name=token.split(":", 1)[0])
+    return limiter
+
+
+def get_bot(token: str) -> ExtBot:
+    bot = _bots.get(token)
+    if bot is None:
+        base_url, base_file_url = api_base_urls()
+        bot = ExtBot(
+            token=token,
+            base_url=base_url,
+            base_file_url=base_file_url,
+            request=InstrumentedRequest(connection_pool_size=64),
+            rate_limiter=rate_limiter(token),
+        )
+        _bots[token] = bot
+    return bot
+
+
+def get_client_bot() -> ExtBot:
+    return get_bot(os.getenv("TELEGRAM_TOKEN_CLIENT"))
+
+
+def get_admin_bot() -> ExtBot:
+    return get_bot(os.getenv("TELEGRAM_TOKEN_ADMIN"))
+
+
+def application_builder(token: str, pool_size: int = 256) -> ApplicationBuilder:
+    """
+    ApplicationBuilder з інструментованим HTTP-клієнтом, адресою Bot API з оточення
+    та паралельною обробкою апдейтів із порядком у межах користувача (BOT_WORKERS);
+    вихідні запити йдуть через спільну для токена чергу з пріоритетами.
+    """
+    base_url, base_file_url = api_base_urls()
+    return (
+        ApplicationBuilder()
+        .token(token)
+        .base_url(base_url)
+        .base_file_url(base_file_url)
+        .request(InstrumentedRequest(connection_pool_size=pool_size))
+        .concurrent_updates(update_processor_from_env())
+        .rate_limiter(rate_limiter(token))
+    )
@@ -0,0 +1,561 @@
+"""
+Масові розсилки: вибір аудиторії та паралельна відправка.
+
+Аудиторія — JSON-словник (лежить у user_data, тож переживає рестарт адмін-бота):
+
+    {"company_ids": [1, 5], "active_days": 30}   # [] / 0 — без обмеження
+
+Отримувачі читаються одним індексованим запитом (get_broadcast_audience) потоком — yield_per
+в окремій сесії, без .all() на весь список клієнтів — і роздаються BROADCAST_WORKERS воркерам.
+Темп задає спільна черга вихідних запитів (app/ratelimit.py, клас broadcast), тож живі відповіді
+менеджерів проходять поза чергою. Після 429 чи збою мережі отримувач відкладається в чергу повторів
+(до BROADCAST_RETRIES разів, з backoff), а воркер бере наступного. Історія (direction='out') пишеться пачками, медіа завантажується
+в Telegram один раз — далі розсилається за file_id.
+
+Розсилку можна запланувати (таблиця scheduled_broadcasts): на час, щодня / щотижня і з вікном
+("02:00 щодня до 06:00 20/с"). Запускає її JobQueue адмін-бота (scheduled_broadcasts_job), темп
+і кількість воркерів — свої для кожної розсилки. Прогрес зберігається курсором по clients.id,
+тож розсилка, що не вмістилась у вікно або обірвалась рестартом, продовжується з того ж місця.
+"""
+import os
+import re
+import json
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import insert, update
+from telegram.error import Forbidden, BadRequest
+
+from .db import SessionLocal
+from .models import Message, ScheduledBroadcast
+from .metrics import BROADCAST_SENT, BROADCAST_RATE
+from .ratelimit import BROADCAST_ARGS, is_transient, retry_safe, backoff_delay
+from .utils import get_broadcast_audience, mark_clients_unreachable, extract_media
+
+logger = logging.getLogger(__name__)
+
+UNREACHABLE_RETRY_DAYS = int(os.getenv("UNREACHABLE_RETRY_DAYS", "30"))  # 0 — не пробувати повторно
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_MAX_RATE = float(os.getenv("BROADCAST_MAX_RATE", "0"))  # повідомлень/с; 0 — лише OUTBOUND_RATE
+BROADCAST_TIMEZONE = ZoneInfo(os.getenv("BROADCAST_TIMEZONE", "Europe/Kyiv"))  # у ньому адмін задає час
+BROADCAST_RETRIES = 3  # скільки разів відкладати отримувача після тимчасової помилки (429, мережа)
+RETRY_POLL = 0.2       # с; як часто перевіряти відкладених отримувачів
+STREAM_BATCH = 500     # клієнтів за один fetch з БД
+HISTORY_BATCH = 200    # рядків історії за один INSERT
+
+# file_type -> (метод Bot, назва параметра з файлом)
+SENDERS = {
+    "photo": ("send_photo", "photo"),
+    "document": ("send_document", "document"),
+    "video": ("send_video", "video"),
+    "voice": ("send_voice", "voice"),
+    "audio": ("send_audio", "audio"),
+}
+
+ACTIVE_DAYS_CHOICES = (0, 7, 30, 90)
+
+
+# помилки Bot API, після яких повтор не допоможе: клієнт заблокував бота або видалив акаунт
+UNREACHABLE_MARKERS = ("blocked by the user", "user is deactivated", "chat not found", "user not found",
+                       "bot can't initiate conversation")
+
+
+class ClientUnreachable(Exception):
+    """Клієнт недоступний для бота; reason — текст помилки Telegram."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class MediaLost(Exception):
+    """Файлу розсилки з медіа вже немає, а в Telegram його ще не завантажено — надсилати нічого."""
+
+
+def unreachable_reason(error):
+    """Причина, якщо помилка означає недоступного клієнта, інакше None."""
+    if isinstance(error, (Forbidden, BadRequest)):
+        message = str(error)
+        if isinstance(error, Forbidden) or any(m in message.lower() for m in UNREACHABLE_MARKERS):
+            return message
+    return None
+
+
+#обробка помилок відправки
+async def safe_send(send_coro_callable, *args, **kwargs):
+    """
+    send_coro_callable — метод Bot (bot.send_message, bot.send_photo...), не виклик!
+    Викликається як: await safe_send(bot.send_message, chat_id, text=...)
+    Паузи на 429, повтори з backoff і circuit breaker — у черзі токена (app/ratelimit.py), тут лише
+    розбір результату. Повертає надіслане повідомлення (truthy); False — Telegram відхилив запит.
+    Якщо клієнт заблокував бота / видалив акаунт — ClientUnreachable (повторювати марно).
+    Тимчасові помилки (429, мережа), що лишились після повторів черги, пробрасуються:
+    викликач вирішує, відкласти відправку (run_broadcast) чи повідомити адміна.
+    """
+    try:
+        return await send_coro_callable(*args, **kwargs) or True
+    except (Forbidden, BadRequest) as e:
+        reason = unreachable_reason(e)
+        if reason:
+            raise ClientUnreachable(reason) from e
+        logger.warning("Telegram відхилив повідомлення: %s", e)
+        return False
+    except Exception as e:
+        if is_transient(e):
+            raise
+        logger.exception("Несподівана помилка при відправці: %s", e)
+        return False
+
+
+# === АУДИТОРІЯ ===
+def new_audience() -> dict:
+    return {"company_ids": [], "active_days": 0}
+
+
+def audience_query(session, audience: dict, reachable_only: bool = True, after_id: int = None):
+    audience = audience or new_audience()
+    return get_broadcast_audience(
+        session, UNREACHABLE_RETRY_DAYS,
+        company_ids=audience.get("company_ids"),
+        active_days=audience.get("active_days"),
+        reachable_only=reachable_only,
+        after_id=after_id,
+    )
+
+
+def count_audience(session, audience: dict):
+    """(отримувачів, пропущено недоступних) — показується адміну до підтвердження."""
+    total = audience_query(session, audience).order_by(None).count()
+    everyone = audience_query(session, audience, reachable_only=False).order_by(None).count()
+    return total, everyone - total
+
+
+def describe_audience(audience: dict, company_names: dict = None) -> str:
+    audience = audience or new_audience()
+    parts = []
+    ids = audience.get("company_ids") or []
+    if ids:
+        names = [(company_names or {}).get(cid) or f"ID {cid}" for cid in ids]
+        parts.append("🏢 " + ", ".join(names))
+    else:
+        parts.append("🏢 усі компанії")
+    days = audience.get("active_days")
+    parts.append(f"🕒 писали за {days} дн." if days else "🕒 незалежно від активності")
+    return "\n".join(parts)
+
+
+# === ВІДПРАВКА ===
+async def run_broadcast(bot, bc: dict, admin_tg, audience: dict = None, workers: int = None, rate: float = None,
+                        after_id: int = 0, deadline: datetime = None, checkpoint=None, stop: asyncio.Event = None) -> dict:
+    """
+    Розсилає bc ({"text", "file_id", "file_type", "media_path"}) клієнтам аудиторії.
+    rate — не швидше за стільки повідомлень/с (поверх спільної черги токена). Для запланованих:
+    after_id — почати після цього clients.id; deadline (UTC) або stop — більше не брати нових
+    отримувачів; checkpoint(cursor) — викликається з кожною пачкою історії.
+    Повертає {"sent", "failed", "unreachable", "elapsed", "cursor", "complete"};
+    cursor — clients.id, до якого (включно) все оброблено. Недоступних позначає в clients.
+    Якщо файл медіа зник до першого завантаження — розсилка зупиняється, у stats "media_lost": True.
+    """
+    workers = max(1, workers or BROADCAST_WORKERS)
+    rate = rate if rate is not None else BROADCAST_MAX_RATE
+    interval = 1 / rate if rate and rate > 0 else 0
+    text = bc.get("text")
+    file_type = bc.get("file_type")
+    media_path = bc.get("media_path")
+    caption = f"📣 {text or ''}"
+
+    stats = {"sent": 0, "failed": 0, "unreachable": 0}
+    unreachable = {}  # tg_id -> причина
+    history = []
+    media = {"file_id": None}
+    upload_lock = asyncio.Lock()
+    queue = asyncio.Queue(maxsize=workers * 4)
+    deferred = []  # heap: (коли повторити, номер, елемент черги) — отримувачі після 429 / збою мережі
+    seq = itertools.count()
+    pending = set()  # clients.id у черзі, у роботі або відкладені
+    progress = {"queued": after_id or 0, "next_slot": time.monotonic()}
+    writer = SessionLocal()
+
+    def cursor():
+        return min(pending) - 1 if pending else progress["queued"]
+
+    def halted():
+        return (progress.get("media_lost") or (stop is not None and stop.is_set())
+                or (deadline is not None and datetime.utcnow() >= deadline))
+
+    def flush_history():
+        if history:
+            writer.execute(insert(Message), history[:])
+            writer.commit()
+            history.clear()
+        if checkpoint:
+            checkpoint(cursor())
+
+    async def pace():
+        # темп саме цієї розсилки: воркери ділять один розклад слотів
+        if not interval:
+            return
+        now = time.monotonic()
+        slot = max(progress["next_slot"], now)
+        progress["next_slot"] = slot + interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def send(cid):
+        if file_type in SENDERS:
+            method, field = SENDERS[file_type]
+            send_method = getattr(bot, method)
+            if media["file_id"] is None:
+                async with upload_lock:
+                    if media["file_id"] is None:
+                        if not (media_path and os.path.exists(media_path)):
+                            raise MediaLost(media_path)
+                        # перше надсилання вантажить файл; далі — той самий file_id без повторного upload
+                        with open(media_path, "rb") as f:
+                            result = await safe_send(send_method, chat_id=int(cid), caption=caption,
+                                                     rate_limit_args=BROADCAST_ARGS, **{field: f})
+                        if result and result is not True:
+                            media["file_id"] = extract_media(result)[0]
+                        return result
+            return await safe_send(send_method, chat_id=int(cid), caption=caption,
+                                   rate_limit_args=BROADCAST_ARGS, **{field: media["file_id"]})
+        return await safe_send(bot.send_message, chat_id=int(cid), text=caption, rate_limit_args=BROADCAST_ARGS)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            cid, company_id, client_id, attempt = item
+            if halted():
+                continue  # лишається в pending — курсор не просунеться за нього
+            try:
+                await pace()
+                result = "sent" if await send(cid) else "failed"
+            except ClientUnreachable as e:
+                unreachable[cid] = e.reason
+                result = "unreachable"
+            except MediaLost:
+                # підпис без медіа не надсилаємо; решта отримувачів лишається в pending
+                if not progress.get("media_lost"):
+                    logger.error("📣 [BROADCAST] Файлу %s немає — розсилку зупинено", media_path)
+                progress["media_lost"] = True
+                continue
+            except Exception as e:
+                if retry_safe(e, creates_message=True) and attempt < BROADCAST_RETRIES:
+                    # 429 / збій до відправки: отримувач повернеться в чергу пізніше, воркер бере наступного;
+                    # після тайм-ауту відповіді не повторюємо — клієнт міг уже отримати розсилку
+                    due = time.monotonic() + backoff_delay(attempt, e)
+                    heapq.heappush(deferred, (due, next(seq), (cid, company_id, client_id, attempt + 1)))
+                    continue
+                logger.warning("Не вдалося надіслати розсилку клієнту %s: %s", cid, e)
+                result = "failed"
+            history.append({
+                "client_tg_id": str(cid), "admin_tg_id": str(admin_tg), "direction": "out",
+                "text": text, "file_id": bc.get("file_id"), "file_type": file_type,
+                "file_path": media_path, "company_snapshot": None, "company_id": company_id,
+            })
+            pending.discard(client_id)
+            stats[result] += 1
+            BROADCAST_SENT.inc(result=result)
+            if len(history) >= HISTORY_BATCH:
+                flush_history()
+
+    async def retrier():
+        while True:
+            if deferred and deferred[0][0] <= time.monotonic():
+                await queue.put(heapq.heappop(deferred)[2])
+                continue
+            await asyncio.sleep(min(RETRY_POLL, deferred[0][0] - time.monotonic()) if deferred else RETRY_POLL)
+
+    started = time.monotonic()
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    retry_task = asyncio.create_task(retrier())
+    reader = SessionLocal()
+    try:
+        for cid, company_id, client_id in audience_query(reader, audience, after_id=after_id).yield_per(STREAM_BATCH):
+            if halted():
+                break
+            pending.add(client_id)
+            progress["queued"] = client_id
+            await queue.put((cid, company_id, client_id, 0))
+        else:
+            progress["exhausted"] = True
+        reader.close()
+        # дочекатися відкладених повторів
+        while pending and not halted():
+            await asyncio.sleep(RETRY_POLL)
+    finally:
+        reader.close()
+        retry_task.cancel()
+        for _ in tasks:
+            await queue.put(None)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            flush_history()
+            mark_clients_unreachable(writer, unreachable)
+        finally:
+            writer.close()
+
+    stats["elapsed"] = time.monotonic() - started
+    stats["cursor"] = cursor()
+    stats["complete"] = progress.get("exhausted", False) and not pending
+    if progress.get("media_lost"):
+        stats["media_lost"] = True
+    done = stats["sent"] + stats["failed"] + stats["unreachable"]
+    if stats["elapsed"] > 0 and done:
+        BROADCAST_RATE.set(done / stats["elapsed"])
+    logger.info("📣 [BROADCAST] Завершено: %s за %.1fs", stats, stats["elapsed"])
+    return stats
+
+
+# === ЗАПЛАНОВАНІ РОЗСИЛКИ ===
+REPEATS = {"щодня": "daily", "daily": "daily", "щотижня": "weekly", "weekly": "weekly"}
+REPEAT_DAYS = {"daily": 1, "weekly": 7}
+REPEAT_LABELS = {"daily": "щодня", "weekly": "щотижня"}
+
+_stops = {}  # id запланованої розсилки, що виконується в цьому процесі -> asyncio.Event для скасування
+
+
+def _to_utc(local: datetime) -> datetime:
+    return local.replace(tzinfo=BROADCAST_TIMEZONE).astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+
+
+def _to_local(utc: datetime) -> datetime:
+    return utc.replace(tzinfo=ZoneInfo("UTC")).astimezone(BROADCAST_TIMEZONE).replace(tzinfo=None)
+
+
+def _parse_time(value: str):
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", value)
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError(f"Невірний час: {value} (потрібно ГГ:ХХ)")
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_schedule(text: str, now: datetime = None) -> dict:
+    """
+    "[РРРР-ММ-ДД] ГГ:ХХ [щодня|щотижня] [до ГГ:ХХ] [N/с]" (час у BROADCAST_TIMEZONE) ->
+    {"run_at" (UTC), "repeat", "window_minutes", "rate"}. Помилки — ValueError з текстом для адміна.
+    """
+    now_local = _to_local(now or datetime.utcnow())
+    tokens = text.lower().split()
+    date = start = end = repeat = rate = None
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", token):
+            try:
+                date = datetime.strptime(token, "%Y-%m-%d").date()
+            except ValueError:
+                raise ValueError(f"Невірна дата: {token}") from None
+        elif token == "до" and i + 1 < len(tokens):
+            end = _parse_time(tokens[i + 1])
+            i += 1
+        elif token in REPEATS:
+            repeat = REPEATS[token]
+        elif re.fullmatch(r"\d+/[сs]", token):
+            rate = int(token.split("/")[0]) or None
+        elif ":" in token and start is None:
+            start = _parse_time(token)
+        else:
+            raise ValueError(f"Незрозуміло: {token}")
+        i += 1
+    if start is None:
+        raise ValueError("Вкажіть час початку, напр. 02:00")
+
+    run_local = datetime.combine(date or now_local.date(), datetime.min.time()).replace(hour=start[0], minute=start[1])
+    if run_local <= now_local:
+        if date:
+            raise ValueError("Цей час уже минув")
+        run_local += timedelta(days=1)
+
+    window = None
+    if end is not None:
+        end_local = run_local.replace(hour=end[0], minute=end[1])
+        if end_local <= run_local:
+            end_local += timedelta(days=1)
+        window = int((end_local - run_local).total_seconds() // 60)
+    return {"run_at": _to_utc(run_local), "repeat": repeat, "window_minutes": window, "rate": rate}
+
+
+def describe_schedule(item) -> str:
+    """Короткий опис для адміна: коли, повтор, вікно, темп."""
+    run_local = _to_local(item.run_at)
+    text = run_local.strftime("%Y-%m-%d %H:%M")
+    if item.repeat:
+        text += f", {REPEAT_LABELS.get(item.repeat, item.repeat)}"
+    if item.window_minutes:
+        text += f", до {(run_local + timedelta(minutes=item.window_minutes)).strftime('%H:%M')}"
+    if item.rate:
+        text += f", {item.rate}/с"
+    return text
+
+
+def media_lost(bc: dict) -> bool:
+    """Розсилка з медіа, файлу якої вже немає: надсилати її текстом замість медіа не можна."""
+    if bc.get("file_type") not in SENDERS:
+        return False
+    path = bc.get("media_path")
+    return not (path and os.path.exists(path))
+
+
+def schedule_broadcast(session, bc: dict, admin_tg, schedule: dict, workers: int = None) -> ScheduledBroadcast:
+    item = ScheduledBroadcast(
+        admin_tg_id=str(admin_tg),
+        text=bc.get("text"),
+        file_id=bc.get("file_id"),
+        file_type=bc.get("file_type"),
+        media_path=bc.get("media_path"),
+        audience=json.dumps(bc.get("audience") or new_audience()),
+        run_at=schedule["run_at"],
+        repeat=schedule.get("repeat"),
+        window_minutes=schedule.get("window_minutes"),
+        rate=schedule.get("rate"),
+        workers=workers,
+    )
+    session.add(item)
+    session.commit()
+    logger.info("🕒 [BROADCAST] Заплановано #%s від admin=%s: %s", item.id, admin_tg, describe_schedule(item))
+    return item
+
+
+def list_scheduled(session):
+    return (
+        session.query(ScheduledBroadcast)
+        .filter(ScheduledBroadcast.status.in_(("scheduled", "running")))
+        .order_by(ScheduledBroadcast.run_at)
+        .all()
+    )
+
+
+def claim_due_broadcasts(session, now: datetime = None):
+    """Переводить розсилки, час яких настав, у running (одним UPDATE) і повертає їхні id."""
+    now = now or datetime.utcnow()
+    ids = [sid for (sid,) in session.query(ScheduledBroadcast.id).filter(
+        ScheduledBroadcast.status == "scheduled", ScheduledBroadcast.run_at <= now
+    ).all()]
+    if ids:
+        session.execute(
+            update(ScheduledBroadcast)
+            .where(ScheduledBroadcast.id.in_(ids), ScheduledBroadcast.status == "scheduled")
+            .values(status="running", last_run_at=now)
+        )
+        session.commit()
+    return ids
+
+
+def resume_interrupted_broadcasts(session):
+    """Після рестарту: розсилки, що лишились у running, знову стають у чергу — продовжаться з cursor."""
+    count = (
+        session.query(ScheduledBroadcast)
+        .filter(ScheduledBroadcast.status == "running")
+        .update({"status": "scheduled"}, synchronize_session=False)
+    )
+    session.commit()
+    if count:
+        logger.warning("🕒 [BROADCAST] Продовжую %s перервану(і) заплановану(і) розсилку(и)", count)
+    return count
+
+
+def cancel_scheduled(session, sched_id: int) -> bool:
+    item = session.get(ScheduledBroadcast, sched_id)
+    if item is None or item.status not in ("scheduled", "running"):
+        return False
+    item.status = "cancelled"
+    session.commit()
+    if sched_id in _stops:
+        _stops[sched_id].set()
+    logger.info("🕒 [BROADCAST] Заплановану розсилку #%s скасовано", sched_id)
+    return True
+
+
+def _next_slot(run_at: datetime, days: int, now: datetime) -> datetime:
+    # крок за місцевим часом, щоб "02:00" лишалось 02:00 після переходу на літній/зимовий час
+    local = _to_local(run_at)
+    while True:
+        local += timedelta(days=days)
+        nxt = _to_utc(local)
+        if nxt > now:
+            return nxt
+
+
+def _save_cursor(sched_id: int, cursor: int):
+    session = SessionLocal()
+    try:
+        session.execute(update(ScheduledBroadcast).where(ScheduledBroadcast.id == sched_id).values(cursor=cursor))
+        session.commit()
+    finally:
+        session.close()
+
+
+async def execute_scheduled(bot, sched_id: int) -> dict:
+    """
+    Виконує заплановану розсилку (уже в статусі running) і планує наступний запуск:
+    не вмістилась у вікно — продовження в те ж вікно наступного дня; завершена — наступний
+    повтор з початку аудиторії або done. Повертає {"item": знімок рядка, "stats", "status"}.
+    """
+    session = SessionLocal()
+    try:
+        item = session.get(ScheduledBroadcast, sched_id)
+        if item is None or item.status != "running":
+            return None
+        bc = {"text": item.text, "file_id": item.file_id, "file_type": item.file_type, "media_path": item.media_path}
+        audience = json.loads(item.audience) if item.audience else new_audience()
+        deadline = item.run_at + timedelta(minutes=item.window_minutes) if item.window_minutes else None
+        params = dict(admin_tg=item.admin_tg_id, workers=item.workers, rate=item.rate, after_id=item.cursor)
+    finally:
+        session.close()
+
+    stop = _stops[sched_id] = asyncio.Event()
+    now = datetime.utcnow()
+    try:
+        if media_lost(bc):
+            logger.error("🕒 [BROADCAST] Заплановану розсилку #%s зупинено: немає файлу %s", sched_id, bc["media_path"])
+            stop.set()
+            stats = {"sent": 0, "failed": 0, "unreachable": 0, "elapsed": 0.0,
+                     "cursor": params["after_id"], "complete": False, "media_lost": True}
+        elif deadline and deadline <= now:
+            # вікно минуло, поки бот не працював — чекаємо наступного
+            stats = {"sent": 0, "failed": 0, "unreachable": 0, "elapsed": 0.0,
+                     "cursor": params["after_id"], "complete": False}
+        else:
+            logger.info("🕒 [BROADCAST] Запуск запланованої #%s з cursor=%s", sched_id, params["after_id"])
+            stats = await run_broadcast(
+                bot, bc, params["admin_tg"], audience, workers=params["workers"], rate=params["rate"],
+                after_id=params["after_id"], deadline=deadline, stop=stop,
+                checkpoint=lambda cursor: _save_cursor(sched_id, cursor),
+            )
+    finally:
+        _stops.pop(sched_id, None)
+
+    session = SessionLocal()
+    try:
+        item = session.get(ScheduledBroadcast, sched_id)
+        item.cursor = stats["cursor"]
+        item.last_result = json.dumps(stats)
+        now = datetime.utcnow()
+        if item.status == "cancelled":
+            pass
+        elif stats.get("media_lost"):
+            item.status = "cancelled"
+        elif not stats["complete"]:
+            item.status = "scheduled"
+            item.run_at = _next_slot(item.run_at, 1, now)
+        elif item.repeat:
+            item.status = "scheduled"
+            item.cursor = 0
+            item.run_at = _next_slot(item.run_at, REPEAT_DAYS[item.repeat], now)
+        else:
+            item.status = "done"
+        # done / cancelled знімає з медіа "закріплення" — далі ним опікується GC сховища
+        session.commit()
+        session.refresh(item)  # знімок для звіту адміну: після commit атрибути прострочені
+        session.expunge(item)
+        return {"item": item, "stats": stats, "status": item.status}
+    finally:
+        session.close()
@@ -1,18 +1,32 @@
 import os
+import json
+import asyncio
+import functools
+from contextlib import ExitStack
 from dotenv import load_dotenv
-from datetime import datetime
 
 load_dotenv()
 
 
-from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
-from .db import SessionLocal
-from .models import Client, Message, Company, Admin
-from .utils import init_db
+from telegram import (
+    Update, InlineKeyboardButton, InlineKeyboardMarkup,
+    InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio,
+)
+from telegram.ext import CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
+from .db import SessionLocal, engine
+from .bots import get_admin_bot, application_builder
+from .metrics import instrument_application, instrument_engine, start_metrics_server
+from sqlalchemy import exists
+from .models import Client, Company, Admin, Claim
+from .utils import init_db, extract_media, inbound_seen, save_incoming_message
+from .stats import record_inbound
+from .logging_setup import setup_logging, bind_update
+from .recorder import install_update_recorder
+from .ratelimit import NOTIFICATION_ARGS
+from .media_store import store_telegram_file
 import logging
 
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 ADMIN_TOKEN = os.getenv("TELEGRAM_TOKEN_ADMIN")
@@ -20,13 +34,24 @@ CLIENT_TOKEN = os.getenv("TELEGRAM_TOKEN_CLIENT")
 INITIAL_ADMIN = os.getenv("INITIAL_ADMIN_ID")
 SUPPORT_EMAIL = os.getenv("SUPPORT_EMAIL", "support@yourcompany.com")
 DB_PATH = os.getenv("DB_PATH", "/data/support_bot.db")
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", "1.0"))  # секунд тиші після останньої частини альбому
+
+BURST_WINDOW = float(os.getenv("BURST_WINDOW", "10"))  # секунд між повідомленнями однієї серії; 0 — вимкнено
+BURST_EDIT_DELAY = 1.0  # не частіше одного редагування сповіщень серії за цей час
+TEXT_LIMIT, CAPTION_LIMIT = 4096, 1024
+
+INPUT_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument, "audio": InputMediaAudio}
+
+# (tg_id, media_group_id) -> {"messages": [...], "last": час останньої частини, "update", "task": таймер}
+_albums = {}
+# tg_id -> задачі альбомів, які таймер уже почав обробляти
+_album_flushes = {}
+# tg_id -> відкрита серія повідомлень клієнта (див. start_burst)
+_bursts = {}
 
 # ensure DB + initial admin
 init_db(initial_admin_tg_id=INITIAL_ADMIN)
 
-# We will use two Bot instances: one for client (handles user chats) and one admin_bot to notify admins
-admin_bot = Bot(token=ADMIN_TOKEN)
-
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tg_id = str(update.effective_user.id)
     session = SessionLocal()
@@ -37,6 +62,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 f"Ви не зареєстровані в системі як наш Б2Б клієнт. Прохання звернутися з запитом: {SUPPORT_EMAIL}"
             )
             return
+        if mark_reachable(client):
+            session.commit()
         # client exists -> show info
         comp = client.company
         text = f"Назва компанії: {comp.name if comp else '—'}\n"
@@ -47,121 +74,377 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     finally:
         session.close()
 
+def build_notify_text(client_name, company_name, tg_id, text):
+    return (
+        f"📩 Нове повідомлення від клієнта <b>{client_name}</b>\n"
+        f"🏢 Компанія: {company_name}\n"
+        f"🆔 TG ID: <code>{tg_id}</code>\n\n"
+        f"💬 {text or '(без тексту)'}"
+    )
+
+
+def mark_reachable(client) -> bool:
+    """Клієнт написав боту — отже, не блокує його: знову отримує розсилки. True, якщо щось змінилося."""
+    if client.unreachable_at is None:
+        return False
+    logger.info("🔓 Клієнт %s знову доступний (було: %s)", client.tg_id, client.unreachable_reason)
+    client.unreachable_at = None
+    client.unreachable_reason = None
+    return True
+
+
+async def reply_not_registered(update: Update):
+    await update.message.reply_text(
+        f"Ви не зареєстровані в системі як наш Б2Б клієнт. "
+        f"Прохання звернутися з запитом: {SUPPORT_EMAIL}"
+    )
+
+
 async def handle_client_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
-    
+
+    await flush_pending_albums(update, context)
+    if update.message.media_group_id:
+        buffer_album_part(update, context)
+        return
+
     tg_id = str(update.effective_user.id)
+    source = (update.effective_chat.id, update.message.message_id)
     session = SessionLocal()
 
     try:
+        if inbound_seen(session, *source):
+            log_duplicate(*source)
+            return
         client = session.query(Client).filter_by(tg_id=tg_id).first()
         if not client:
-            await update.message.reply_text(
-                f"Ви не зареєстровані в системі як наш Б2Б клієнт. "
-                f"Прохання звернутися з запитом: {SUPPORT_EMAIL}"
-            )
+            await reply_not_registered(update)
             return
+        if mark_reachable(client):
+            # окремою короткою транзакцією: інакше autoflush відкрив би запис у БД на весь час завантаження медіа
+            session.commit()
     
         text = update.message.caption or update.message.text or None
-        file_id, file_type = None, None
-    
-        if update.message.photo:
-            file_id = update.message.photo[-1].file_id
-            file_type = "photo"
-        elif update.message.document:
-            file_id = update.message.document.file_id
-            file_type = "document"
-        elif update.message.video:
-            file_id = update.message.video.file_id
-            file_type = "video"
-        elif update.message.voice:
-            file_id = update.message.voice.file_id
-            file_type = "voice"
-        elif update.message.audio:
-            file_id = update.message.audio.file_id
-            file_type = "audio"
+        file_id, file_type = extract_media(update.message)
+
+        # короткі повідомлення підряд доповнюють сповіщення першого, а не розсилаються заново
+        if not file_id and await append_to_burst(session, client, tg_id, text, source):
+            await update.message.reply_text("✅ Ваше повідомлення надіслано менеджерам. Очікуйте відповіді.")
+            return
 
         company_name = client.company.name if client.company else f"(ID: {client.company_id or 'невідомо'})"
 
         media_path = None
         if file_id:
-            try:
-                bot = context.bot
-                file = await bot.get_file(file_id)
-                ext = {
-                    "photo": "jpg",
-                    "document": "dat",
-                    "video": "mp4",
-                    "voice": "ogg"
-                }.get(file_type, "bin")
-
-                filename = f"{file_type}_{int(datetime.utcnow().timestamp())}_{tg_id}.{ext}"
-                media_path = f"/data/media/{filename}"
-                os.makedirs("/data/media", exist_ok=True)
-                await file.download_to_drive(media_path)
-                logger.info(f"📁 Медіа збережено: {media_path}")
-            except Exception as e:
-                logger.warning(f"⚠️ Не вдалося зберегти медіа: {e}")
+            media_path = await store_telegram_file(context.bot, file_id, file_type)
         
-        msg = Message(
+        msg_id = save_incoming_message(
+            session, *source,
             client_tg_id=tg_id,
-            direction='in',
             text=text,
             file_id=file_id,
             file_type=file_type,
             file_path=media_path,
-            company_snapshot=company_name
-        )        
-            
-        session.add(msg)
+            company_snapshot=company_name,
+            company_id=client.company_id
+        )
+        if msg_id is None:
+            # той самий апдейт паралельно обробляє інший хендлер — сповіщення вже його
+            session.rollback()
+            log_duplicate(*source)
+            return
+        record_inbound(session, client.company_id)
         session.commit()
-        session.refresh(msg)
 
         admins = session.query(Admin.tg_id).all()
-        notify_text = (
-            f"📩 Нове повідомлення від клієнта <b>{client.name or update.effective_user.full_name}</b>\n"
-            f"🏢 Компанія: {company_name}\n"
-            f"🆔 TG ID: <code>{tg_id}</code>\n\n"
-            f"💬 {text or '(без тексту)'}"
-        )
-        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("💬 Відповісти", callback_data=f"claim:{msg.id}")]])
+        client_name = client.name or update.effective_user.full_name
+        notify_text = build_notify_text(client_name, company_name, tg_id, text)
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("💬 Відповісти", callback_data=f"claim:{msg_id}")]])
     
-        admin_bot = Bot(token=os.getenv("TELEGRAM_TOKEN_ADMIN"))
+        admin_bot = get_admin_bot()
+        notices = []  # (chat_id, message_id, чи це підпис до медіа) — для редагування серії
         for a in admins:
             try:
                 if media_path and os.path.exists(media_path):
                     with open(media_path, "rb") as f:
                         if file_type == "photo":
-                            await admin_bot.send_photo(chat_id=int(a[0]), photo=f, caption=notify_text, parse_mode="HTML", reply_markup=keyboard)
+                            sent = await admin_bot.send_photo(chat_id=int(a[0]), photo=f, caption=notify_text, parse_mode="HTML", reply_markup=keyboard, rate_limit_args=NOTIFICATION_ARGS)
                         elif file_type == "document":
-                            await admin_bot.send_document(chat_id=int(a[0]), document=f, caption=notify_text, parse_mode="HTML", reply_markup=keyboard)
+                            sent = await admin_bot.send_document(chat_id=int(a[0]), document=f, caption=notify_text, parse_mode="HTML", reply_markup=keyboard, rate_limit_args=NOTIFICATION_ARGS)
                         elif file_type == "video":
-                            await admin_bot.send_video(chat_id=int(a[0]), video=f, caption=notify_text, parse_mode="HTML", reply_markup=keyboard)
+                            sent = await admin_bot.send_video(chat_id=int(a[0]), video=f, caption=notify_text, parse_mode="HTML", reply_markup=keyboard, rate_limit_args=NOTIFICATION_ARGS)
                         elif file_type == "voice":
-                            await admin_bot.send_voice(chat_id=int(a[0]), voice=f, caption=notify_text, parse_mode="HTML", reply_markup=keyboard)
+                            sent = await admin_bot.send_voice(chat_id=int(a[0]), voice=f, caption=notify_text, parse_mode="HTML", reply_markup=keyboard, rate_limit_args=NOTIFICATION_ARGS)
+                        else:
+                            sent = None
                 else:
-                    await admin_bot.send_message(chat_id=int(a[0]), text=notify_text, parse_mode="HTML", reply_markup=keyboard)
+                    sent = await admin_bot.send_message(chat_id=int(a[0]), text=notify_text, parse_mode="HTML", reply_markup=keyboard, rate_limit_args=NOTIFICATION_ARGS)
+                if sent is not None:
+                    notices.append((sent.chat_id, sent.message_id, sent.text is None))
             except Exception as e:
-                logger.warning(f"⚠️ Не вдалося надіслати адміну {a[0]}: {e}")
+                logger.warning("⚠️ Не вдалося надіслати адміну %s: %s", a[0], e)
+
+        start_burst(tg_id, msg_id, text, notices, keyboard,
+                    render=functools.partial(build_notify_text, client_name, company_name, tg_id))
+    
+        await update.message.reply_text("✅ Ваше повідомлення надіслано менеджерам. Очікуйте відповіді.")
+
+    finally:
+        session.close()
+
+
+def log_duplicate(chat_id, message_id):
+    # повторна доставка апдейту (рестарт, мережевий ретрай, replay) — нічого не записуємо й не розсилаємо
+    logger.info("♻️ Повтор апдейту: повідомлення %s/%s вже збережене — пропускаю", chat_id, message_id)
 
-        # 🔥 Після успішної розсилки всім адмінам — видаляємо локальний файл
-        if media_path and os.path.exists(media_path):
+
+# === СЕРІЇ КОРОТКИХ ПОВІДОМЛЕНЬ (BURST_WINDOW) ===
+# Клієнт часто пише п'ять рядків за п'ять секунд. Перше повідомлення розсилається адмінам як зазвичай
+# і відкриває серію; текстові повідомлення, що приходять менш ніж за BURST_WINDOW після попереднього
+# (і поки серію ніхто не взяв), зберігаються з burst_head_id і лише дописуються в уже надіслані
+# сповіщення — одне редагування на пачку, не частіше за BURST_EDIT_DELAY. Claim — один на всю серію.
+# Апдейти одного клієнта обробляються по черзі (app/concurrency.py), тож серію не треба блокувати.
+def start_burst(tg_id, head_id, text, notices, keyboard, render):
+    if BURST_WINDOW <= 0 or not notices:
+        return
+    now = asyncio.get_running_loop().time()
+    for key in [k for k, b in _bursts.items() if now - b["last"] > BURST_WINDOW and b["edit_task"] is None]:
+        del _bursts[key]
+    _bursts[tg_id] = {
+        "head_id": head_id,
+        "lines": [text or ""],
+        "notices": notices,
+        "keyboard": keyboard,
+        "render": render,
+        "last": now,
+        "edit_task": None,
+    }
+
+
+async def append_to_burst(session, client, tg_id, text, source):
+    """Додає повідомлення до відкритої серії клієнта; False — серії немає, потрібне окреме сповіщення."""
+    burst = _bursts.get(tg_id)
+    if burst is None or not text:
+        return False
+    loop = asyncio.get_running_loop()
+    if loop.time() - burst["last"] > BURST_WINDOW:
+        _bursts.pop(tg_id, None)
+        return False
+    # сповіщення з медіа редагується як підпис, а в нього менший ліміт
+    limit = CAPTION_LIMIT if any(caption for _, _, caption in burst["notices"]) else TEXT_LIMIT
+    if len(render_burst(burst, text)) > limit:
+        return False
+    if burst_claimed(session, burst):
+        # серію вже взяли в роботу — нове повідомлення стає окремим запитом
+        _bursts.pop(tg_id, None)
+        return False
+
+    company_name = client.company.name if client.company else f"(ID: {client.company_id or 'невідомо'})"
+    msg_id = save_incoming_message(
+        session, *source,
+        client_tg_id=tg_id,
+        text=text,
+        burst_head_id=burst["head_id"],
+        company_snapshot=company_name,
+        company_id=client.company_id
+    )
+    if msg_id is None:
+        # дубль, що проскочив повз inbound_seen (паралельна обробка) — вже в серії
+        session.rollback()
+        log_duplicate(*source)
+        return True
+    record_inbound(session, client.company_id, claimable=False)
+    session.commit()
+
+    burst["lines"].append(text)
+    burst["last"] = loop.time()
+    if burst["edit_task"] is None:
+        burst["edit_task"] = loop.create_task(edit_burst_later(burst))
+    logger.info("🧩 Повідомлення від %s додано до серії #%s (%s)", tg_id, burst["head_id"], len(burst["lines"]))
+    return True
+
+
+async def edit_burst_later(burst):
+    edited = 1  # перше повідомлення вже є в сповіщеннях
+    while len(burst["lines"]) > edited:
+        await asyncio.sleep(BURST_EDIT_DELAY)
+        # усе, що прийшло до цього моменту, піде одним редагуванням; решта — наступним колом
+        edited = len(burst["lines"])
+        session = SessionLocal()
+        try:
+            # не повертаємо кнопку "Відповісти" на вже взятий запит
+            if burst_claimed(session, burst):
+                break
+        finally:
+            session.close()
+        text = render_burst(burst)
+        admin_bot = get_admin_bot()
+        for chat_id, message_id, caption in burst["notices"]:
             try:
-                logger.info(f"🗑️ Видаляю медіа після відправки: {media_path}")
-                os.remove(media_path)
+                if caption:
+                    await admin_bot.edit_message_caption(chat_id=chat_id, message_id=message_id, caption=text,
+                                                         parse_mode="HTML", reply_markup=burst["keyboard"],
+                                                         rate_limit_args=NOTIFICATION_ARGS)
+                else:
+                    await admin_bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text,
+                                                      parse_mode="HTML", reply_markup=burst["keyboard"],
+                                                      rate_limit_args=NOTIFICATION_ARGS)
             except Exception as e:
-                logger.warning(f"⚠️ Не вдалося видалити {media_path}: {e}")
-    
+                logger.warning("⚠️ Не вдалося оновити сповіщення %s адміну %s: %s", message_id, chat_id, e)
+    burst["edit_task"] = None
+
+
+def burst_claimed(session, burst):
+    return session.query(exists().where(Claim.message_id == burst["head_id"])).scalar()
+
+
+def render_burst(burst, extra=None):
+    lines = [line for line in burst["lines"] + ([extra] if extra else []) if line]
+    return burst["render"]("\n💬 ".join(lines) or None)
+
+
+# === АЛЬБОМИ (media_group_id) ===
+# Telegram присилає альбом окремими апдейтами — по одному на фото. Частини збираються
+# протягом ALBUM_WINDOW секунд після останньої й обробляються як одне звернення:
+# один Message / claim, одне сповіщення адмінам (send_media_group + текст з кнопкою), одне "✅".
+# Таймер працює поза чергою апдейтів клієнта (app/concurrency.py), тому наступний апдейт того ж
+# клієнта спершу дообробляє його альбом (flush_pending_albums): Telegram шле частини альбому підряд,
+# тож інше повідомлення означає, що альбом уже повний, — і текст після альбому йде адмінам після нього.
+def buffer_album_part(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    key = (update.effective_user.id, update.message.media_group_id)
+    loop = asyncio.get_running_loop()
+    album = _albums.get(key)
+    if album is None:
+        # альбом — окремий запит, наступні повідомлення вже не доповнюють попередню серію
+        _bursts.pop(str(key[0]), None)
+        album = _albums[key] = {"messages": [], "last": loop.time(), "update": update}
+        album["task"] = context.application.create_task(flush_album_later(key, context), update=update)
+    album["messages"].append(update.message)
+    album["last"] = loop.time()
+
+
+async def flush_album_later(key, context: ContextTypes.DEFAULT_TYPE):
+    loop = asyncio.get_running_loop()
+    while True:
+        wait = _albums[key]["last"] + ALBUM_WINDOW - loop.time()
+        if wait <= 0:
+            break
+        await asyncio.sleep(wait)
+    album = _albums.pop(key)
+    flushes = _album_flushes.setdefault(key[0], set())
+    task = asyncio.current_task()
+    flushes.add(task)
+    try:
+        await process_album(album["update"], context, sorted(album["messages"], key=lambda m: m.message_id))
+    finally:
+        flushes.discard(task)
+        if not flushes:
+            _album_flushes.pop(key[0], None)
+
+
+async def flush_pending_albums(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Дообробляє альбоми клієнта, що прийшли до цього апдейту (крім альбому, частиною якого він є)."""
+    user_id = update.effective_user.id
+    flushes = _album_flushes.get(user_id)
+    if flushes:
+        await asyncio.wait(set(flushes))
+    for key in [k for k in _albums if k[0] == user_id and k[1] != update.message.media_group_id]:
+        album = _albums.pop(key)
+        album["task"].cancel()
+        await process_album(album["update"], context, sorted(album["messages"], key=lambda m: m.message_id))
+
+
+async def process_album(update: Update, context: ContextTypes.DEFAULT_TYPE, messages):
+    tg_id = str(update.effective_user.id)
+    # альбом ідентифікує його перша частина
+    source = (update.effective_chat.id, messages[0].message_id)
+    session = SessionLocal()
+
+    try:
+        if inbound_seen(session, *source):
+            log_duplicate(*source)
+            return
+        client = session.query(Client).filter_by(tg_id=tg_id).first()
+        if not client:
+            await reply_not_registered(update)
+            return
+        if mark_reachable(client):
+            session.commit()
+
+        text = next((m.caption for m in messages if m.caption), None)
+        attachments = []
+        for m in messages:
+            file_id, file_type = extract_media(m)
+            if file_id:
+                attachments.append({"file_id": file_id, "file_type": file_type})
+
+        company_name = client.company.name if client.company else f"(ID: {client.company_id or 'невідомо'})"
+
+        paths = [await store_telegram_file(context.bot, a["file_id"], a["file_type"]) for a in attachments]
+        files = [(a["file_type"], p) for a, p in zip(attachments, paths) if p and a["file_type"] in INPUT_MEDIA]
+
+        first = attachments[0] if attachments else {}
+        msg_id = save_incoming_message(
+            session, *source,
+            client_tg_id=tg_id,
+            text=text,
+            file_id=first.get("file_id"),
+            file_type=first.get("file_type"),
+            file_path=paths[0] if paths else None,
+            media_group_id=messages[0].media_group_id,
+            attachments=json.dumps(attachments),
+            company_snapshot=company_name,
+            company_id=client.company_id
+        )
+        if msg_id is None:
+            session.rollback()
+            log_duplicate(*source)
+            return
+        record_inbound(session, client.company_id)
+        session.commit()
+
+        admins = session.query(Admin.tg_id).all()
+        notify_text = build_notify_text(client.name or update.effective_user.full_name, company_name, tg_id, text)
+        notify_text += f"\n📎 Альбом: {len(attachments)} файлів"
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("💬 Відповісти", callback_data=f"claim:{msg_id}")]])
+
+        admin_bot = get_admin_bot()
+        uploaded = None  # file_id-и адмін-бота: файли вантажимо один раз, далі шлемо за id
+        for a in admins:
+            try:
+                if files:
+                    if uploaded is None:
+                        with ExitStack() as stack:
+                            media = [INPUT_MEDIA[t](stack.enter_context(open(p, "rb"))) for t, p in files]
+                            sent = await admin_bot.send_media_group(chat_id=int(a[0]), media=media, rate_limit_args=NOTIFICATION_ARGS)
+                        uploaded = [(t, extract_media(s)[0]) for (t, _), s in zip(files, sent)]
+                    else:
+                        await admin_bot.send_media_group(
+                            chat_id=int(a[0]), media=[INPUT_MEDIA[t](file_id) for t, file_id in uploaded],
+                            rate_limit_args=NOTIFICATION_ARGS,
+                        )
+                await admin_bot.send_message(chat_id=int(a[0]), text=notify_text, parse_mode="HTML", reply_markup=keyboard, rate_limit_args=NOTIFICATION_ARGS)
+            except Exception as e:
+                logger.warning("⚠️ Не вдалося надіслати адміну %s: %s", a[0], e)
+
+        logger.info("📎 Альбом %s від %s: %s файлів → повідомлення #%s", messages[0].media_group_id, tg_id, len(attachments), msg_id)
+
         await update.message.reply_text("✅ Ваше повідомлення надіслано менеджерам. Очікуйте відповіді.")
 
     finally:
         session.close()
 
             
-def run_client_bot():
-    app = ApplicationBuilder().token(CLIENT_TOKEN).build()
+def build_client_app():
+    """Збирає Application клієнтського бота з усіма хендлерами (без запуску polling)."""
+    app = application_builder(CLIENT_TOKEN).build()
     
+    # --- Кореляційні id для логів (виконується першим для кожного апдейту) ---
+    app.add_handler(TypeHandler(Update, bind_update), group=-1)
+    # --- 📼 Запис апдейтів для bench/replay.py (якщо задано UPDATE_RECORD_PATH) ---
+    install_update_recorder(app, "client")
+
     # --- Команди ---
     app.add_handler(CommandHandler("start", start))
     
@@ -181,5 +464,15 @@ def run_client_bot():
     ))
 
     
+    # --- 📈 Метрики: латентність хендлерів, SQL, Bot API ---
+    instrument_application(app)
+    instrument_engine(engine)
+    return app
+
+
+def run_client_bot():
+    app = build_client_app()
+    start_metrics_server()
+
     logger.info("Запускаю client bot")
     app.run_polling()
@@ -0,0 +1,80 @@
+"""
+Паралельна обробка апдейтів зі збереженням порядку в межах одного користувача.
+
+PTB за замовчуванням обробляє апдейти строго по черзі: повільне завантаження медіа одного
+клієнта або розсилка одного адміна блокує всіх інших. PerUserUpdateProcessor пускає апдейти
+різних користувачів паралельно (не більше BOT_WORKERS одночасно), а апдейти одного
+користувача — строго один за одним, у порядку надходження. Саме на цьому тримаються
+ConversationHandler-и та прапорці в context.user_data (replying_claim_id, broadcast_active...).
+"""
+import os
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+DEFAULT_WORKERS = 16
+# скільки апдейтів може чекати своєї черги на кожен воркер, перш ніж PTB перестане їх брати
+PENDING_PER_WORKER = 8
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Семафор базового класу (max_concurrent_updates) обмежує лише кількість апдейтів "у роботі",
+    включно з тими, що чекають на свого користувача. Справжній ліміт паралельності — self._workers,
+    він береться вже після блокування користувача: десять фото одного клієнта не займуть
+    десять воркерів, поки виконується лише перше.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int = None):
+        if max_workers < 1:
+            raise ValueError("max_workers має бути >= 1")
+        self.max_workers = max_workers
+        self._workers = asyncio.Semaphore(max_workers)
+        self._locks = {}  # ключ користувача -> [asyncio.Lock, кількість апдейтів, що його чекають]
+        super().__init__(max_pending or max_workers * PENDING_PER_WORKER)
+
+    @staticmethod
+    def ordering_key(update):
+        """Апдейти з однаковим ключем обробляються послідовно; None — без обмежень порядку."""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return ("user", update.effective_user.id)
+        if update.effective_chat:
+            return ("chat", update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        # asyncio.Lock віддає блокування у порядку виклику acquire(), а задачі PTB створює
+        # у порядку надходження апдейтів — до acquire() тут немає жодного await
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._locks.pop(key, None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def update_processor_from_env() -> PerUserUpdateProcessor:
+    """BOT_WORKERS — скільки апдейтів обробляється одночасно (1 = строго послідовно)."""
+    workers = int(os.getenv("BOT_WORKERS") or DEFAULT_WORKERS)
+    return PerUserUpdateProcessor(max(workers, 1))
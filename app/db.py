@@ -1,6 +1,6 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,5 +11,25 @@ DB_URI = f"sqlite:///{DB_PATH}"
 # ensure dir exists
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
-engine = create_engine(DB_URI, connect_args={"check_same_thread": False})
-SessionLocal = scoped_session(sessionmaker(bind=engine))
+# Хендлери виконуються паралельно в одному event loop і тримають сесію через await,
+# тому пул не обмежуємо (інакше очікування вільного з'єднання блокує весь loop).
+engine = create_engine(
+    DB_URI,
+    connect_args={"check_same_thread": False, "timeout": 10},
+    pool_size=10,
+    max_overflow=-1,
+)
+
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: читачі не блокують запис (client- і admin-бот пишуть в одну БД, сесії живуть через await)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+# Звичайний sessionmaker, а не scoped_session: scoped_session видає одну сесію на потік,
+# а паралельні хендлери живуть в одному потоці й закривали б сесію один одному.
+SessionLocal = sessionmaker(bind=engine)
@@ -0,0 +1,181 @@
+"""
+Масовий імпорт клієнтів (і їхніх компаній) з CSV, який адмін надсилає документом (/import_clients).
+
+Формат: перший рядок — заголовок; роздільник "," або ";" (як зберігає Excel), UTF-8 або Windows-1251.
+Колонки: tg_id (обов'язкова), name, company (назва) або company_id. Компанії з невідомою назвою
+створюються; наявні клієнти оновлюються (порожні клітинки нічого не змінюють).
+
+Замість add_client на кожен рядок (SELECT + COMMIT) — один INSERT нових компаній, один прохід
+пошуку наявних tg_id (IN пачками по IMPORT_BATCH) і пачки INSERT / UPDATE, кожна — одна транзакція.
+"""
+import io
+import csv
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .db import SessionLocal
+from .models import Company, Client, search_key
+from .utils import add_clients, update_clients
+
+logger = logging.getLogger(__name__)
+
+IMPORT_BATCH = 500                  # рядків на транзакцію і на один IN (SQLite: ≤ 999 параметрів у старих версіях)
+IMPORT_MAX_BYTES = 5 * 1024 * 1024  # більші файли не завантажуємо
+NAME_MAX = 255
+
+COLUMNS = {
+    "tg_id": "tg_id", "telegram_id": "tg_id",
+    "name": "name", "ім'я": "name", "ім’я": "name", "імя": "name", "піб": "name",
+    "company": "company", "компанія": "company",
+    "company_id": "company_id",
+}
+
+
+def _decode(data: bytes) -> str:
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return data.decode("cp1251")
+
+
+def parse_clients_csv(data: bytes):
+    """
+    -> (rows, rejected): rows — [{"line", "tg_id", "name", "company", "company_id"}] без повторів tg_id
+    (перемагає останній рядок), rejected — [(номер рядка, причина)]. ValueError — файл не CSV потрібного вигляду.
+    """
+    text = _decode(data)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(io.StringIO(text), dialect)
+
+    header = next(reader, None)
+    if not header:
+        raise ValueError("файл порожній")
+    columns = [COLUMNS.get(h.strip().lower()) for h in header]
+    if "tg_id" not in columns:
+        raise ValueError("немає колонки tg_id (очікується заголовок: tg_id,name,company)")
+
+    rows, rejected, seen = {}, [], {}
+    for line, values in enumerate(reader, start=2):
+        if not any(v.strip() for v in values):
+            continue
+        record = {"line": line, "name": None, "company": None, "company_id": None}
+        for column, value in zip(columns, values):
+            if column:
+                record[column] = value.strip() or None
+
+        tg_id = record.get("tg_id")
+        if not tg_id or not tg_id.isdigit():
+            rejected.append((line, f"tg_id має бути числом: {tg_id or '—'}"))
+            continue
+        if record["company_id"] is not None:
+            if not record["company_id"].isdigit():
+                rejected.append((line, f"company_id має бути числом: {record['company_id']}"))
+                continue
+            record["company_id"] = int(record["company_id"])
+        if record["name"]:
+            record["name"] = record["name"][:NAME_MAX]
+
+        if tg_id in seen:
+            rejected.append((seen[tg_id], f"повтор tg_id {tg_id}, використано рядок {line}"))
+        seen[tg_id] = line
+        rows[tg_id] = record
+    return list(rows.values()), rejected
+
+
+def _chunks(items, size: int = IMPORT_BATCH):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _resolve_companies(session, rows, rejected):
+    """
+    Проставляє rows[i]["company_id"] за назвою (одним запитом; невідомі компанії — одним INSERT)
+    і відкидає рядки з неіснуючим company_id. Повертає (rows, кількість створених компаній).
+    """
+    ids = {r["company_id"] for r in rows if r["company_id"] is not None}
+    known = set()
+    for chunk in _chunks(list(ids)):
+        known.update(cid for (cid,) in session.query(Company.id).filter(Company.id.in_(chunk)))
+    valid = []
+    for r in rows:
+        if r["company_id"] is not None and r["company_id"] not in known:
+            rejected.append((r["line"], f"компанії з ID {r['company_id']} не існує"))
+        else:
+            valid.append(r)
+
+    names = sorted({r["company"] for r in valid if r["company"] and r["company_id"] is None})
+    by_name = {}
+    for chunk in _chunks(names):
+        # однакові назви — беремо найстаршу компанію
+        for name, cid in (session.query(Company.name, func.min(Company.id))
+                          .filter(Company.name.in_(chunk)).group_by(Company.name)):
+            by_name[name] = cid
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        result = session.execute(
+            sqlite_insert(Company).returning(Company.id, Company.name),
+            [{"name": name, "name_search": search_key(name)} for name in missing],
+        )
+        by_name.update({name: cid for cid, name in result})
+        session.commit()
+
+    for r in valid:
+        if r["company_id"] is None and r["company"]:
+            r["company_id"] = by_name[r["company"]]
+    return valid, len(missing)
+
+
+def import_clients(session, rows, rejected=None):
+    """Upsert підготовлених рядків пачками; -> {"inserted", "updated", "unchanged", "companies_created", "rejected"}."""
+    rejected = list(rejected or [])
+    rows, companies_created = _resolve_companies(session, rows, rejected)
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0, "companies_created": companies_created}
+
+    for chunk in _chunks(rows):
+        # пошук наявних лише для звіту "додано / оновлено / без змін": запис однаково upsert
+        existing = {
+            tg_id: (name, company_id)
+            for tg_id, name, company_id in session.query(Client.tg_id, Client.name, Client.company_id)
+            .filter(Client.tg_id.in_([r["tg_id"] for r in chunk]))
+        }
+        inserts, updates = [], []
+        for r in chunk:
+            change = {"tg_id": r["tg_id"], "name": r["name"], "company_id": r["company_id"]}
+            if r["tg_id"] not in existing:
+                inserts.append(change)
+                continue
+            name, company_id = existing[r["tg_id"]]
+            if ((r["name"] or name), (r["company_id"] or company_id)) == (name, company_id):
+                stats["unchanged"] += 1
+            else:
+                updates.append(change)
+
+        # пачка — одна транзакція
+        stats["inserted"] += add_clients(session, inserts, commit=False)
+        stats["updated"] += update_clients(session, updates, commit=False)
+        session.commit()
+
+    stats["rejected"] = sorted(rejected)
+    return stats
+
+
+def import_clients_csv(data: bytes):
+    """Розбір і імпорт у власній сесії (викликається через asyncio.to_thread, щоб не блокувати бота)."""
+    rows, rejected = parse_clients_csv(data)
+    session = SessionLocal()
+    try:
+        stats = import_clients(session, rows, rejected)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    logger.info("📥 [IMPORT] додано=%s оновлено=%s без змін=%s компаній=%s відхилено=%s",
+                stats["inserted"], stats["updated"], stats["unchanged"],
+                stats["companies_created"], len(stats["rejected"]))
+    return stats
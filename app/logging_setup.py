@@ -0,0 +1,128 @@
+"""
+Неблокуючий структурований логінг для обох ботів.
+
+Хендлери в event loop лише кладуть LogRecord у чергу (QueueHandler) — форматування
+та запис у stderr виконує фоновий потік (QueueListener). Тому логи використовують
+%-аргументи, а не f-рядки: якщо всі аргументи — незмінні примітиви (рядки, числа, None,
+datetime), повідомлення збирається вже у фоновому потоці. Решту (dict / list зі статистикою
+чи аудиторією, ORM-об'єкти, винятки) _DeferredQueueHandler форматує одразу: до фонового
+потоку вони могли б дійти вже зміненими, а ORM-об'єкт не можна чіпати з іншого потоку.
+
+Кожен запис отримує кореляційні id з contextvars: update_id (ставиться на початку
+обробки апдейту), claim_id, broadcast_id, а також ім'я хендлера.
+Формат: LOG_FORMAT=json (за замовчуванням) або text; рівень — LOG_LEVEL.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+from datetime import datetime, date, time, timedelta, timezone
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics import current_handler
+
+update_id_var: ContextVar = ContextVar("update_id", default=None)
+claim_id_var: ContextVar = ContextVar("claim_id", default=None)
+broadcast_id_var: ContextVar = ContextVar("broadcast_id", default=None)
+
+_CORRELATION_VARS = {
+    "update_id": update_id_var,
+    "claim_id": claim_id_var,
+    "broadcast_id": broadcast_id_var,
+}
+
+_listener = None
+
+# аргументи, які безпечно форматувати пізніше в іншому потоці
+_DEFERRABLE_ARGS = (str, int, float, type(None), datetime, date, time, timedelta)
+
+
+def bind(**ids):
+    """Прив'язує кореляційні id до поточного контексту (апдейту / задачі)."""
+    for name, value in ids.items():
+        _CORRELATION_VARS[name].set(value)
+
+
+async def bind_update(update, context):
+    """TypeHandler у групі -1: новий апдейт — новий update_id, старі claim/broadcast id скидаються."""
+    bind(update_id=getattr(update, "update_id", None), claim_id=None, broadcast_id=None)
+
+
+class CorrelationFilter(logging.Filter):
+    """Виконується в потоці, що логує, тому бачить contextvars поточного апдейту."""
+
+    def filter(self, record):
+        for name, var in _CORRELATION_VARS.items():
+            setattr(record, name, var.get())
+        record.handler = current_handler.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name in ("handler", *_CORRELATION_VARS):
+            value = getattr(record, name, None)
+            if value not in (None, "-"):
+                payload[name] = value
+        trace = getattr(record, "trace", None)
+        if trace:
+            payload["trace"] = trace
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Не форматує запис у викликаючому потоці (стандартний prepare() робить це одразу),
+    якщо всі аргументи — незмінні примітиви; інакше збирає повідомлення тут і скидає args.
+    """
+
+    def prepare(self, record):
+        if record.args and not (
+            isinstance(record.args, tuple) and all(isinstance(arg, _DEFERRABLE_ARGS) for arg in record.args)
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def setup_logging(level: str = None, fmt: str = None):
+    """Налаштовує root-логер: QueueHandler -> фоновий QueueListener -> stderr. Ідемпотентна."""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+
+    stream = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [upd=%(update_id)s claim=%(claim_id)s bc=%(broadcast_id)s] %(message)s"
+        ))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    # httpx логує кожен запит до Bot API на INFO — це шум на гарячому шляху
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -0,0 +1,248 @@
+"""
+Сховище медіа на диску (MEDIA_DIR): файли з Telegram, які боти перевантажують адмінам / клієнтам.
+
+Ім'я файлу — sha256 вмісту, каталоги шардовані за першими байтами хешу:
+    MEDIA_DIR/ab/cd/abcd...ef.jpg
+Той самий файл (пересланий кілька разів, однакова картинка в розсилках) зберігається один раз,
+а імена не колізять, хоч би скільки файлів прийшло за секунду.
+
+Посилання на файл — Message.file_path (і media_path незавершених запланованих розсилок);
+лічильник посилань рахується з БД. Хендлери файли не видаляють — це робить collect_garbage()
+(JobQueue адмін-бота, раз на MEDIA_GC_INTERVAL):
+  - файли без жодного посилання, старші за MEDIA_ORPHAN_GRACE (невдалі відправки, скасовані розсилки,
+    недокачані тимчасові) — видаляються;
+  - якщо сховище більше за MEDIA_MAX_MB — видаляються найдавніше використані (LRU за mtime:
+    повторне збереження того самого вмісту оновлює mtime); у Message.file_path таких файлів
+    записується NULL — у історії лишається file_id Telegram.
+Файли запланованих розсилок, чернеток розсилок (user_data["broadcast"] адмінів у bot_state) і розсилок,
+що зараз ідуть (pin_media), не витісняються: без них розсилку нічим надсилати.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import Counter
+
+from sqlalchemy import func, update
+
+from .db import SessionLocal
+from .models import Message, ScheduledBroadcast, BotState
+from .persistence import USER_DATA
+from .metrics import MEDIA_STORE_BYTES
+from .ratelimit import is_transient, backoff_delay
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", "/data/media")
+MEDIA_MAX_BYTES = int(float(os.getenv("MEDIA_MAX_MB", "1024")) * 1024 * 1024)  # 0 — без ліміту
+MEDIA_GC_INTERVAL = int(os.getenv("MEDIA_GC_INTERVAL", "3600"))       # секунд; 0 — GC вимкнено
+MEDIA_ORPHAN_GRACE = int(os.getenv("MEDIA_ORPHAN_GRACE", "900"))      # секунд: файл ще може чекати на commit
+EVICT_TO = 0.9  # витісняємо з запасом, щоб не чистити знову на наступному ж файлі
+
+MEDIA_EXT = {"photo": "jpg", "document": "dat", "video": "mp4", "voice": "ogg", "audio": "mp3"}
+TMP_DIR = "tmp"
+HASH_CHUNK = 1024 * 1024
+IN_CHUNK = 500  # шляхів у одному IN (SQLite: ≤ 999 параметрів у старих версіях)
+FILE_RETRIES = 3  # повторів getFile + завантаження на 429 / мережі / 5xx
+
+# шлях -> скільки розсилок цього процесу його зараз надсилають; GC читає з потоку, тому під lock
+_in_use = Counter()
+_in_use_lock = threading.Lock()
+
+
+def media_path_for(digest: str, file_type: str) -> str:
+    return os.path.join(MEDIA_DIR, digest[:2], digest[2:4], f"{digest}.{MEDIA_EXT.get(file_type, 'bin')}")
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def put_file(tmp_path: str, file_type: str) -> str:
+    """Переносить завантажений файл у сховище під ім'ям за вмістом; -> шлях. Дубль лише оновлює mtime."""
+    path = media_path_for(_sha256(tmp_path), file_type)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        os.utime(path)
+        logger.info("📁 Медіа вже в сховищі: %s", path)
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)  # атомарно; паралельний запис того самого вмісту дає той самий файл
+    logger.info("📁 Медіа збережено: %s", path)
+    return path
+
+
+async def store_telegram_file(bot, file_id, file_type):
+    """
+    Завантажує файл з Telegram у сховище; повертає шлях або None, якщо не вдалося.
+    getFile і завантаження йдуть повз чергу app/ratelimit.py, тож тимчасові помилки повторюються
+    тут (обидва запити нічого не створюють — повтор безпечний).
+    """
+    attempt = 0
+    while True:
+        tmp_path = None
+        try:
+            file = await bot.get_file(file_id)
+            tmp_dir = os.path.join(MEDIA_DIR, TMP_DIR)
+            os.makedirs(tmp_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+            os.close(fd)
+            await file.download_to_drive(tmp_path)
+            return put_file(tmp_path, file_type)
+        except Exception as e:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if not is_transient(e) or attempt >= FILE_RETRIES:
+                logger.warning("⚠️ Не вдалося зберегти медіа: %s", e)
+                return None
+            delay = backoff_delay(attempt, e)
+            attempt += 1
+            logger.info("🔁 [MEDIA] Повтор %s/%s завантаження файлу через %.1fs: %s", attempt, FILE_RETRIES, delay, e)
+            await asyncio.sleep(delay)
+
+
+# === ПОСИЛАННЯ І ЗБИРАННЯ СМІТТЯ ===
+def pin_media(path):
+    """
+    Закріплює файл за розсилкою, що виконується в цьому процесі (чернетку вже прибрано з user_data,
+    а історії ще немає). GC працює в адмін-боті — тому ж процесі, що й розсилки.
+    """
+    if path:
+        with _in_use_lock:
+            _in_use[path] += 1
+
+
+def unpin_media(path):
+    if path:
+        with _in_use_lock:
+            _in_use[path] -= 1
+            if _in_use[path] <= 0:
+                del _in_use[path]
+
+
+def reference_counts(session, paths) -> dict:
+    """path -> кількість Message, що на нього посилаються (лише для paths з хоча б одним посиланням)."""
+    paths = list(paths)
+    counts = {}
+    for i in range(0, len(paths), IN_CHUNK):
+        counts.update(
+            session.query(Message.file_path, func.count())
+            .filter(Message.file_path.in_(paths[i:i + IN_CHUNK]))
+            .group_by(Message.file_path)
+        )
+    return counts
+
+
+def pinned_paths(session) -> set:
+    """
+    Медіа, які ще знадобляться розсилкам, — їх не чіпаємо ніколи: заплановані, що ще
+    виконуватимуться, чернетки, які адмін саме підтверджує (user_data адмін-бота потрапляє
+    в bot_state за PERSISTENCE_INTERVAL — набагато швидше, ніж минає MEDIA_ORPHAN_GRACE),
+    і розсилки, що йдуть зараз (pin_media).
+    """
+    with _in_use_lock:
+        running = set(_in_use)
+    pinned = {path for (path,) in session.query(ScheduledBroadcast.media_path).filter(
+        ScheduledBroadcast.status.in_(("scheduled", "running")), ScheduledBroadcast.media_path.isnot(None),
+    )}
+    draft = func.json_extract(BotState.value, "$.broadcast.media_path")
+    pinned.update(path for (path,) in session.query(draft).filter(
+        BotState.bot == "admin", BotState.kind == USER_DATA, draft.isnot(None),
+    ))
+    return pinned | running
+
+
+def _scan():
+    """[(path, size, mtime)] усіх файлів сховища, включно з tmp/ і файлами старого формату в корені."""
+    files = []
+    for root, _, names in os.walk(MEDIA_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((path, st.st_size, st.st_mtime))
+    return files
+
+
+def _remove(path) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        logger.warning("⚠️ Не вдалося видалити %s: %s", path, e)
+        return False
+
+
+def collect_garbage(max_bytes: int = None, grace: int = None, now: float = None) -> dict:
+    """
+    Один прохід GC: сироти, потім LRU-витіснення понад max_bytes.
+    -> {"files", "bytes", "orphans", "evicted", "freed"} (files / bytes — після проходу).
+    """
+    max_bytes = MEDIA_MAX_BYTES if max_bytes is None else max_bytes
+    grace = MEDIA_ORPHAN_GRACE if grace is None else grace
+    now = now or time.time()
+    stats = {"files": 0, "bytes": 0, "orphans": 0, "evicted": 0, "freed": 0}
+    if not os.path.isdir(MEDIA_DIR):
+        MEDIA_STORE_BYTES.set(0)
+        return stats
+
+    files = _scan()
+    session = SessionLocal()
+    try:
+        refs = reference_counts(session, [path for path, _, _ in files])
+        pinned = pinned_paths(session)
+
+        kept = []
+        for path, size, mtime in files:
+            if path not in refs and path not in pinned and now - mtime > grace:
+                if _remove(path):
+                    stats["orphans"] += 1
+                    stats["freed"] += size
+                continue
+            kept.append((path, size, mtime))
+
+        total = sum(size for _, size, _ in kept)
+        evicted = []
+        if max_bytes and total > max_bytes:
+            # свіжі файли (ще без commit) і файли запланованих розсилок не витісняємо
+            candidates = sorted(
+                (f for f in kept if f[0] not in pinned and now - f[2] > grace),
+                key=lambda f: f[2],
+            )
+            for path, size, _ in candidates:
+                if total <= max_bytes * EVICT_TO:
+                    break
+                if _remove(path):
+                    evicted.append(path)
+                    total -= size
+                    stats["freed"] += size
+            for i in range(0, len(evicted), IN_CHUNK):
+                session.execute(
+                    update(Message).where(Message.file_path.in_(evicted[i:i + IN_CHUNK])).values(file_path=None)
+                )
+            session.commit()
+            if total > max_bytes:
+                logger.warning("⚠️ [MEDIA] Сховище %s МБ понад ліміт: решта файлів свіжі або заплановані",
+                               total // (1024 * 1024))
+    finally:
+        session.close()
+
+    stats["evicted"] = len(evicted)
+    stats["files"] = len(kept) - len(evicted)
+    stats["bytes"] = total
+    MEDIA_STORE_BYTES.set(total)
+    if stats["orphans"] or stats["evicted"]:
+        logger.info("🧹 [MEDIA] GC: сиріт %s, витіснено %s, звільнено %s КБ; у сховищі %s файлів / %s КБ",
+                    stats["orphans"], stats["evicted"], stats["freed"] // 1024, stats["files"], total // 1024)
+    return stats
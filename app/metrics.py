@@ -0,0 +1,281 @@
+"""
+Легка інструментація ботів у форматі Prometheus (без зовнішніх залежностей).
+
+- латентність кожного хендлера (instrument_application обгортає всі зареєстровані хендлери,
+  включно з вкладеними у ConversationHandler);
+- кількість / час SQL-запитів (події SQLAlchemy, з розбивкою по хендлеру);
+- виклики Telegram Bot API: кількість, латентність, 429 RetryAfter (InstrumentedRequest);
+- черга вихідних запитів за класами пріоритету, адаптивний ліміт, повтори, circuit breaker (app/ratelimit.py);
+- пропускна здатність розсилок.
+
+Метрики віддаються текстом на http://<host>:METRICS_PORT/metrics вбудованим HTTP-сервером
+у фоновому потоці (METRICS_PORT=0 вимикає сервер).
+"""
+import os
+import time
+import logging
+import threading
+import functools
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+from telegram.request import HTTPXRequest
+from telegram.ext import ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# хендлер, у межах якого зараз виконується код (для розбивки SQL-метрик)
+current_handler: ContextVar[str] = ContextVar("current_handler", default="-")
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        super().__init__(name, help_text)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_label_str(k)} {v}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [counts per bucket..., +Inf], sum
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = (counts, total + value)
+
+    def snapshot(self) -> dict:
+        """{((label, value), ...): (counts по бакетах + +Inf, сума)} — копія для звітів (bench/replay.py)."""
+        with self._lock:
+            return {k: (list(c), s) for k, (c, s) in self._values.items()}
+
+    def quantile(self, q: float, counts: list):
+        """Оцінка квантиля з лінійною інтерполяцією всередині бакета (як histogram_quantile)."""
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        running, lower = 0, 0.0
+        for bound, count in zip(self.buckets, counts):
+            if count and running + count >= rank:
+                return lower + (bound - lower) * (rank - running) / count
+            running += count
+            lower = bound
+        return self.buckets[-1]
+
+    def render(self):
+        with self._lock:
+            items = [(k, list(c), s) for k, (c, s) in self._values.items()]
+        lines = []
+        for key, counts, total in items:
+            running = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                running += count
+                lines.append(f"{self.name}_bucket{_label_str(key + (('le', bound),))} {running}")
+            lines.append(f"{self.name}_sum{_label_str(key)} {total}")
+            lines.append(f"{self.name}_count{_label_str(key)} {running}")
+        return lines
+
+
+HANDLER_LATENCY = Histogram("bot_handler_duration_seconds", "Час виконання хендлера")
+HANDLER_CALLS = Counter("bot_handler_calls_total", "Виклики хендлерів за результатом")
+DB_QUERIES = Counter("bot_db_queries_total", "Кількість SQL-запитів")
+DB_QUERY_SECONDS = Counter("bot_db_query_seconds_total", "Сумарний час SQL-запитів")
+TG_API_CALLS = Counter("bot_telegram_api_calls_total", "Виклики Telegram Bot API")
+TG_API_LATENCY = Histogram("bot_telegram_api_duration_seconds", "Латентність Telegram Bot API")
+TG_RETRY_AFTER = Counter("bot_telegram_retry_after_total", "Відповіді 429 RetryAfter")
+BROADCAST_SENT = Counter("bot_broadcast_messages_total", "Повідомлення розсилок за результатом")
+OUTBOUND_REQUESTS = Counter("bot_outbound_requests_total", "Вихідні send/edit за класом пріоритету і результатом")
+OUTBOUND_WAIT = Histogram("bot_outbound_queue_wait_seconds", "Час очікування в черзі вихідних запитів")
+OUTBOUND_QUEUE = Gauge("bot_outbound_queue_depth", "Запитів, що чекають у черзі, за класом пріоритету")
+OUTBOUND_RATE = Gauge("bot_outbound_rate_per_second", "Поточний адаптивний ліміт вихідних запитів (AIMD)")
+OUTBOUND_RETRIES = Counter("bot_outbound_retries_total", "Повтори вихідних запитів за причиною")
+OUTBOUND_BREAKER = Gauge("bot_outbound_breaker_open", "1 — Bot API недоступний, відправки на паузі (circuit breaker)")
+MEDIA_STORE_BYTES = Gauge("bot_media_store_bytes", "Розмір сховища медіа (MEDIA_DIR) після останнього GC")
+BROADCAST_RATE = Gauge("bot_broadcast_last_rate_per_second", "Швидкість останньої розсилки (повідомлень/с)")
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# === HANDLERS ===
+def _wrap_callback(callback):
+    if getattr(callback, "_instrumented", False):
+        return callback
+    name = getattr(callback, "__name__", type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        token = current_handler.set(name)
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            return await callback(update, context)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+            HANDLER_CALLS.inc(handler=name, status=status)
+            current_handler.reset(token)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def _instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks:
+            _instrument_handler(nested)
+        for state_handlers in handler.states.values():
+            for nested in state_handlers:
+                _instrument_handler(nested)
+        return
+    if getattr(handler, "callback", None) is not None:
+        handler.callback = _wrap_callback(handler.callback)
+
+
+def instrument_application(application):
+    """Обгортає всі вже зареєстровані хендлери застосунку. Викликати після add_handler."""
+    for group in application.handlers.values():
+        for handler in group:
+            _instrument_handler(handler)
+
+
+# === DATABASE ===
+def instrument_engine(engine):
+    """Підписується на події курсора; повторний виклик для того ж engine нічого не робить."""
+    if getattr(engine, "_instrumented", False):
+        return
+    engine._instrumented = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        handler = current_handler.get()
+        DB_QUERIES.inc(handler=handler)
+        DB_QUERY_SECONDS.inc(elapsed, handler=handler)
+
+
+# === TELEGRAM API ===
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, що рахує виклики Bot API, їх латентність і 429."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        endpoint = "file_download" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        code = "error"
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            return code, payload
+        finally:
+            TG_API_LATENCY.observe(time.perf_counter() - start, endpoint=endpoint)
+            TG_API_CALLS.inc(endpoint=endpoint, code=code)
+            if code == 429:
+                TG_RETRY_AFTER.inc(endpoint=endpoint)
+
+
+# === HTTP ENDPOINT ===
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # не засмічуємо лог кожним scrape
+
+
+def start_metrics_server(port: int = None):
+    """Запускає /metrics у фоновому потоці. Повертає сервер або None (вимкнено / порт зайнятий)."""
+    port = int(os.getenv("METRICS_PORT", "9100")) if port is None else port
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError as e:
+        logger.warning("⚠️ Не вдалося запустити metrics-сервер на порту %s: %s", port, e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("📈 Metrics: http://0.0.0.0:%s/metrics", port)
+    return server
@@ -0,0 +1,201 @@
+"""
+Легкі міграції схеми SQLite.
+
+Base.metadata.create_all() створює лише нові таблиці, тому нові колонки та індекси
+для вже існуючих таблиць додаються тут. Кожна міграція виконується один раз,
+застосовані записуються в таблицю schema_migrations.
+Міграції мають бути ідемпотентними: обидва боти стартують одночасно на одній БД.
+"""
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from .models import search_key
+
+logger = logging.getLogger(__name__)
+
+
+def _has_column(engine, table: str, column: str) -> bool:
+    return any(c["name"] == column for c in inspect(engine).get_columns(table))
+
+
+def _add_column(engine, table: str, column: str, ddl: str):
+    if _has_column(engine, table, column):
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    except OperationalError as e:
+        # client- та admin-бот стартують одночасно на одній БД — колонку міг додати сусідній процес
+        if "duplicate column" not in str(e):
+            raise
+        return
+    logger.info("🧱 [MIGRATION] %s.%s додано", table, column)
+
+
+# === МІГРАЦІЇ ===
+def _0001_claims_first_response_at(engine):
+    _add_column(engine, "claims", "first_response_at", "DATETIME")
+
+
+def _0002_messages_company_id(engine, batch_size: int = 5000):
+    """messages.company_id + бекфіл з clients пачками (щоб не тримати довгий лок на великій БД)."""
+    _add_column(engine, "messages", "company_id", "INTEGER REFERENCES companies(id)")
+
+    with engine.connect() as conn:
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM messages")).scalar()
+
+    updated = 0
+    for low in range(0, max_id, batch_size):
+        with engine.begin() as conn:
+            result = conn.execute(text(
+                "UPDATE messages SET company_id = ("
+                "  SELECT clients.company_id FROM clients WHERE clients.tg_id = messages.client_tg_id"
+                ") WHERE id > :low AND id <= :high AND company_id IS NULL"
+            ), {"low": low, "high": low + batch_size})
+            updated += result.rowcount or 0
+    logger.info("🧱 [MIGRATION] messages.company_id заповнено для %s рядків", updated)
+
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_company_created ON messages (company_id, created_at)"
+        ))
+
+
+def _0003_messages_client_created_index(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_client_created ON messages (client_tg_id, created_at)"
+        ))
+
+
+def _0004_messages_album_columns(engine):
+    _add_column(engine, "messages", "media_group_id", "VARCHAR")
+    _add_column(engine, "messages", "attachments", "TEXT")
+
+
+def _0005_message_bursts(engine):
+    _add_column(engine, "messages", "burst_head_id", "INTEGER REFERENCES messages(id)")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_burst_head_id ON messages (burst_head_id)"))
+        # "необроблені" = NOT EXISTS claim по message_id: без індексу — повний перегляд claims на кожен рядок
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_claims_message_id ON claims (message_id)"))
+
+
+def _0006_clients_unreachable(engine):
+    _add_column(engine, "clients", "unreachable_at", "DATETIME")
+    _add_column(engine, "clients", "unreachable_reason", "VARCHAR")
+
+
+def _0007_clients_company_index(engine):
+    # аудиторія розсилки за компаніями
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_clients_company_id ON clients (company_id)"))
+
+
+def _0008_name_nocase_indexes(engine):
+    # списки клієнтів / компаній з фільтром за початком імені (LIKE 'abc%' без урахування регістру)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_clients_name_nocase ON clients (name COLLATE NOCASE)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_companies_name_nocase ON companies (name COLLATE NOCASE)"))
+
+
+def _0009_messages_source(engine):
+    # повторно доставлений апдейт не створює другого Message (NULL-и у вихідних унікальність не порушують)
+    _add_column(engine, "messages", "source_chat_id", "VARCHAR")
+    _add_column(engine, "messages", "source_message_id", "INTEGER")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_messages_source ON messages (source_chat_id, source_message_id)"
+        ))
+
+
+def _0010_messages_file_path_index(engine):
+    # лічильники посилань для GC сховища медіа
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_messages_file_path ON messages (file_path) WHERE file_path IS NOT NULL"
+        ))
+
+
+def _0011_name_search(engine, batch_size: int = 5000):
+    """
+    clients / companies.name_search = search_key(name) для пошуку за префіксом без урахування регістру:
+    NOCASE-індекси з 0008 ігнорували регістр лише латиниці ("Олена" не знаходилась за "оле").
+    Бекфіл у Python (casefold), пачками за id.
+    """
+    for table in ("clients", "companies"):
+        _add_column(engine, table, "name_search", "VARCHAR")
+        filled, last_id = 0, 0
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(text(
+                    f"SELECT id, name FROM {table} WHERE id > :last ORDER BY id LIMIT :n"
+                ), {"last": last_id, "n": batch_size}).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                params = [{"id": row_id, "key": search_key(name)} for row_id, name in rows if name]
+                if params:
+                    conn.execute(text(f"UPDATE {table} SET name_search = :key WHERE id = :id"), params)
+                filled += len(params)
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_name_search ON {table} (name_search)"))
+            conn.execute(text(f"DROP INDEX IF EXISTS ix_{table}_name_nocase"))
+        logger.info("🧱 [MIGRATION] %s.name_search заповнено для %s рядків", table, filled)
+
+
+def _0012_burst_backlog(engine):
+    """
+    До виправлення кожне продовження серії (burst_head_id) додавало +1 до беклогу, а claim серії
+    знімав лише 1 — прибираємо ці фантомні записи. Віднімання не ідемпотентне, тому міграція
+    сама позначає себе застосованою в тій самій транзакції (сусідній процес її пропустить).
+    """
+    with engine.begin() as conn:
+        marked = conn.execute(text(
+            "INSERT OR IGNORE INTO schema_migrations (name) VALUES ('0012_burst_backlog')"
+        )).rowcount
+        if not marked:
+            return
+        result = conn.execute(text(
+            "UPDATE response_stats SET backlog = MAX(backlog - ("
+            "  SELECT COUNT(*) FROM messages"
+            "  WHERE messages.burst_head_id IS NOT NULL"
+            "    AND date(messages.created_at) = response_stats.day"
+            "    AND COALESCE(messages.company_id, 0) = response_stats.company_id"
+            "), 0) WHERE admin_tg_id = '' AND backlog > 0"
+        ))
+    logger.info("🧱 [MIGRATION] беклог серій виправлено у %s рядках response_stats", result.rowcount or 0)
+
+
+MIGRATIONS = [
+    ("0001_claims_first_response_at", _0001_claims_first_response_at),
+    ("0002_messages_company_id", _0002_messages_company_id),
+    ("0003_messages_client_created_index", _0003_messages_client_created_index),
+    ("0004_messages_album_columns", _0004_messages_album_columns),
+    ("0005_message_bursts", _0005_message_bursts),
+    ("0006_clients_unreachable", _0006_clients_unreachable),
+    ("0007_clients_company_index", _0007_clients_company_index),
+    ("0008_name_nocase_indexes", _0008_name_nocase_indexes),
+    ("0009_messages_source", _0009_messages_source),
+    ("0010_messages_file_path_index", _0010_messages_file_path_index),
+    ("0011_name_search", _0011_name_search),
+    ("0012_burst_backlog", _0012_burst_backlog),
+]
+
+
+def run_migrations(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name VARCHAR PRIMARY KEY, applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT name FROM schema_migrations"))}
+
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        migrate(engine)
+        with engine.begin() as conn:
+            conn.execute(text("INSERT OR IGNORE INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+        logger.info("✅ [MIGRATION] %s застосовано", name)
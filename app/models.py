@@ -1,10 +1,15 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, func
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, Date, UniqueConstraint, Index, func, text
+from sqlalchemy.orm import declarative_base, relationship, validates
 from datetime import datetime
 
 Base = declarative_base()
 
 
+def search_key(name):
+    """Ключ префіксного пошуку за ім'ям / назвою: LIKE і NOCASE у SQLite не знають регістру кирилиці."""
+    return name.casefold() if name else None
+
+
 class Admin(Base):
     __tablename__ = 'admins'
 
@@ -21,12 +26,18 @@ class Company(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
+    name_search = Column(String, index=True)  # search_key(name)
     contact_name = Column(String)
     client_id = Column(String)
     client_secret = Column(String)
 
     clients = relationship("Client", back_populates="company")
 
+    @validates("name")
+    def _set_name_search(self, key, value):
+        self.name_search = search_key(value)
+        return value
+
 
 class Client(Base):
     __tablename__ = 'clients'
@@ -34,16 +45,34 @@ class Client(Base):
     id = Column(Integer, primary_key=True)
     tg_id = Column(String, unique=True)
     name = Column(String)
-    company_id = Column(Integer, ForeignKey('companies.id'))
+    name_search = Column(String, index=True)  # search_key(name)
+    company_id = Column(Integer, ForeignKey('companies.id'), index=True)
+    # клієнт заблокував бота / видалив акаунт: розсилки його пропускають, доки він знову не напише
+    unreachable_at = Column(DateTime, nullable=True)
+    unreachable_reason = Column(String, nullable=True)
 
     company = relationship("Company", back_populates="clients")
     messages = relationship("Message", back_populates="client")
 
+    @validates("name")
+    def _set_name_search(self, key, value):
+        self.name_search = search_key(value)
+        return value
+
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_company_created", "company_id", "created_at"),
+        Index("ix_messages_client_created", "client_tg_id", "created_at"),
+        # вхідне повідомлення Telegram зберігається один раз, хоч би скільки разів прийшов апдейт
+        Index("uq_messages_source", "source_chat_id", "source_message_id", unique=True),
+        # посилання на файли сховища медіа (app/media_store.py); більшість повідомлень без файлу
+        Index("ix_messages_file_path", "file_path", sqlite_where=text("file_path IS NOT NULL")),
+    )
     id = Column(Integer, primary_key=True)
     client_tg_id = Column(String, ForeignKey("clients.tg_id"))
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=True)  # компанія на момент запису
     admin_tg_id = Column(String, ForeignKey("admins.tg_id"), nullable=True)
     direction = Column(String)
     text = Column(Text)
@@ -52,6 +81,13 @@ class Message(Base):
     file_id = Column(String, nullable=True)  # ✅ додаємо
     file_type = Column(String, nullable=True)  # ✅ тип файлу (photo/document/video/voice)
     file_path = Column(String, nullable=True)
+    media_group_id = Column(String, nullable=True)  # альбом клієнта, збережений одним повідомленням
+    attachments = Column(Text, nullable=True)  # JSON [{"file_id", "file_type"}, ...] для альбомів
+    # перше повідомлення серії (BURST_WINDOW): серія — одне сповіщення і один claim
+    burst_head_id = Column(Integer, ForeignKey('messages.id'), nullable=True, index=True)
+    # чат і message_id оригіналу в клієнт-боті (лише для вхідних; у альбому — перша частина)
+    source_chat_id = Column(String, nullable=True)
+    source_message_id = Column(Integer, nullable=True)
     client = relationship("Client", back_populates="messages")
     admin = relationship("Admin", back_populates="messages")
 
@@ -62,11 +98,86 @@ class Claim(Base):
     client_id = Column(Integer, ForeignKey('clients.id'))
     admin_id = Column(Integer, ForeignKey('admins.id'), nullable=True)
     title = Column(String, nullable=False)
-    message_id = Column(Integer, ForeignKey('messages.id'))  # <- Додаємо сюди
+    message_id = Column(Integer, ForeignKey('messages.id'), index=True)  # <- Додаємо сюди
     description = Column(Text)
     status = Column(String, default='open')  # open / in_progress / closed
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
+    first_response_at = Column(DateTime, nullable=True)  # перша відповідь клієнту (для SLA)
 
     client = relationship("Client")
     admin = relationship("Admin")
+
+
+class ResponseStat(Base):
+    """Інкрементальна SLA-статистика: один рядок на день / компанію / адміна.
+
+    Рядки з admin_tg_id='' — вхідні повідомлення (ще без адміна), company_id=0 — клієнт без компанії.
+    """
+    __tablename__ = 'response_stats'
+    __table_args__ = (UniqueConstraint('day', 'company_id', 'admin_tg_id', name='uq_response_stats_key'),)
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    company_id = Column(Integer, nullable=False, default=0)
+    admin_tg_id = Column(String, nullable=False, default="")
+    inbound_count = Column(Integer, nullable=False, default=0)
+    claim_count = Column(Integer, nullable=False, default=0)
+    outbound_count = Column(Integer, nullable=False, default=0)
+    first_response_count = Column(Integer, nullable=False, default=0)
+    first_response_sum_sec = Column(Integer, nullable=False, default=0)
+    backlog = Column(Integer, nullable=False, default=0)  # вхідні цього дня, які ще ніхто не взяв
+
+
+class ResponseLatency(Base):
+    """Гістограма часу першої відповіді (bucket — індекс у stats.LATENCY_BUCKETS)."""
+    __tablename__ = 'response_latency'
+    __table_args__ = (UniqueConstraint('day', 'company_id', 'admin_tg_id', 'bucket', name='uq_response_latency_key'),)
+
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    company_id = Column(Integer, nullable=False, default=0)
+    admin_tg_id = Column(String, nullable=False, default="")
+    bucket = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class BotState(Base):
+    """Стан PTB (user_data / chat_data / стани ConversationHandler) — один рядок на ключ, значення в JSON."""
+    __tablename__ = 'bot_state'
+    __table_args__ = (UniqueConstraint('bot', 'kind', 'key', name='uq_bot_state_key'),)
+
+    id = Column(Integer, primary_key=True)
+    bot = Column(String, nullable=False)    # client / admin — обидва боти працюють з однією БД
+    kind = Column(String, nullable=False)   # user_data, chat_data, bot_data, conversation:<name>
+    key = Column(String, nullable=False)
+    value = Column(Text, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class ScheduledBroadcast(Base):
+    """
+    Відкладена / повторювана розсилка. Виконує її JobQueue адмін-бота (app/broadcast.py).
+    cursor — останній оброблений clients.id: розсилка, що не вмістилась у вікно або обірвалась
+    рестартом, продовжується з нього, а не з початку.
+    """
+    __tablename__ = 'scheduled_broadcasts'
+    __table_args__ = (Index('ix_scheduled_broadcasts_status_run_at', 'status', 'run_at'),)
+
+    id = Column(Integer, primary_key=True)
+    admin_tg_id = Column(String, nullable=False)
+    text = Column(Text, nullable=True)
+    file_id = Column(String, nullable=True)
+    file_type = Column(String, nullable=True)
+    media_path = Column(String, nullable=True)
+    audience = Column(Text, nullable=True)           # JSON, як у broadcast.new_audience()
+    run_at = Column(DateTime, nullable=False)        # наступний запуск (UTC)
+    repeat = Column(String, nullable=True)           # None / daily / weekly
+    window_minutes = Column(Integer, nullable=True)  # скільки хвилин від run_at можна слати; None — до кінця
+    rate = Column(Integer, nullable=True)            # повідомлень/с для цієї розсилки; None — загальний ліміт
+    workers = Column(Integer, nullable=True)
+    cursor = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False, default="scheduled")  # scheduled / running / done / cancelled
+    last_run_at = Column(DateTime, nullable=True)
+    last_result = Column(Text, nullable=True)        # JSON зі статистикою останнього запуску
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,162 @@
+import html
+import logging
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+from app.db import SessionLocal
+from app.utils import get_companies_page
+from app.pagination.listings import get_prefix, set_prefix, _short
+
+logger = logging.getLogger(__name__)
+
+PICKER_PAGE_SIZE = 8
+
+# Пікер компаній: сторінка кнопок за keyset-курсором замість клавіатури з усіма компаніями.
+# callback_data: pick_co:<purpose>:<op>:<value>
+#   op = n|p — наступна / попередня сторінка від id, f — фільтр за назвою, x — скинути фільтр,
+#        s — вибір компанії <value>, d — «Готово» (для множинного вибору)
+# n/p/f/x обробляє сам пікер; s/d — той, хто його відкрив (див. company_picker_callback).
+PICKERS = {
+    # вибір веде одразу у view_history — окремий обробник не потрібен
+    "history": {
+        "title": "🕓 Оберіть компанію для перегляду історії:",
+        "select": "view_history:{id}",
+        "back": "back_to_main",
+    },
+    "client": {
+        "title": "🏢 Оберіть компанію клієнта (або введіть її ID / початок назви):",
+        "select": "pick_co:client:s:{id}",
+    },
+    "bc": {
+        "title": "🏢 Оберіть компанії для розсилки (або введіть ID через кому / початок назви).\n"
+                 "Нічого не обрано — усі компанії. Скасувати: /cancel",
+        "select": "pick_co:bc:s:{id}",
+        "multi": True,
+    },
+}
+
+
+def picker_selected(context, purpose: str) -> set:
+    """Вже обрані компанії для множинного вибору (розсилка: audience.company_ids)."""
+    if purpose == "bc":
+        bc = context.user_data.get("broadcast") or {}
+        return set((bc.get("audience") or {}).get("company_ids") or [])
+    return set()
+
+
+def parse_picker_data(data: str):
+    _, purpose, op, value = data.split(":", 3)
+    return purpose, op, int(value)
+
+
+def render_company_picker(session, context, purpose: str, after_id: int = None, before_id: int = None):
+    """(text, markup, has_rows) однієї сторінки пікера; курсор запам'ятовується, щоб перемалювати ту ж сторінку."""
+    config = PICKERS[purpose]
+    prefix = get_prefix(context, f"picker:{purpose}")
+    rows, has_prev, has_next = get_companies_page(
+        session, prefix=prefix, after_id=after_id, before_id=before_id, limit=PICKER_PAGE_SIZE,
+    )
+    pages = dict(context.user_data.get("picker_page") or {})
+    pages[purpose] = [after_id, before_id]
+    context.user_data["picker_page"] = pages
+
+    text = config["title"]
+    if prefix:
+        text += f"\n🔎 «{html.escape(prefix)}»"
+    if not rows:
+        text += "\n\n📭 Компаній не знайдено."
+
+    selected = picker_selected(context, purpose) if config.get("multi") else set()
+    buttons = []
+    for comp in rows:
+        mark = "✅" if comp.id in selected else "🏢"
+        buttons.append([InlineKeyboardButton(f"{mark} {_short(comp.name, 40)}",
+                                             callback_data=config["select"].format(id=comp.id))])
+
+    nav = []
+    if rows and has_prev:
+        nav.append(InlineKeyboardButton("⬅️ Попередні", callback_data=f"pick_co:{purpose}:p:{rows[0].id}"))
+    if rows and has_next:
+        nav.append(InlineKeyboardButton("Наступні ➡️", callback_data=f"pick_co:{purpose}:n:{rows[-1].id}"))
+    if nav:
+        buttons.append(nav)
+
+    filter_row = [InlineKeyboardButton("🔎 Фільтр за назвою", callback_data=f"pick_co:{purpose}:f:0")]
+    if prefix:
+        filter_row.append(InlineKeyboardButton("✖️ Скинути фільтр", callback_data=f"pick_co:{purpose}:x:0"))
+    buttons.append(filter_row)
+
+    if config.get("multi"):
+        buttons.append([InlineKeyboardButton(f"✅ Готово ({len(selected) or 'усі'})",
+                                             callback_data=f"pick_co:{purpose}:d:0")])
+    if config.get("back"):
+        buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data=config["back"])])
+    return text, InlineKeyboardMarkup(buttons), bool(rows)
+
+
+async def send_company_picker(message, context: ContextTypes.DEFAULT_TYPE, purpose: str,
+                              reset_filter: bool = False) -> bool:
+    """Перша сторінка пікера новим повідомленням. False — компаній немає взагалі (і фільтра теж)."""
+    if reset_filter:
+        set_prefix(context, f"picker:{purpose}", None)
+    session = SessionLocal()
+    try:
+        text, markup, has_rows = render_company_picker(session, context, purpose)
+    finally:
+        session.close()
+    if not has_rows and not get_prefix(context, f"picker:{purpose}"):
+        return False
+    await message.reply_text(text, parse_mode="HTML", reply_markup=markup)
+    return True
+
+
+async def refresh_company_picker(message, context: ContextTypes.DEFAULT_TYPE, purpose: str,
+                                 after_id: int = None, before_id: int = None, keep_page: bool = False):
+    """Перемалювати пікер у тому ж повідомленні (keep_page — поточна сторінка, напр. після позначки)."""
+    if keep_page:
+        after_id, before_id = (context.user_data.get("picker_page") or {}).get(purpose) or (None, None)
+    session = SessionLocal()
+    try:
+        text, markup, _ = render_company_picker(session, context, purpose, after_id, before_id)
+    finally:
+        session.close()
+    try:
+        await message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+    except BadRequest as e:
+        # "Message is not modified" — та сама сторінка
+        logger.debug("edit_text failed: %s", e)
+
+
+def apply_picker_filter(context, purpose: str, text: str):
+    """Введений текст — початок назви компанії; пікер після цього показується з першої сторінки."""
+    context.user_data.pop("action", None)
+    context.user_data.pop("picker_filter_target", None)
+    set_prefix(context, f"picker:{purpose}", text.strip()[:64] or None)
+
+
+async def company_picker_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Гортання та фільтр пікера. Повертає (purpose, op, value); для s / d нічого не робить
+    і не відповідає на query — це справа обробника конкретного сценарію.
+    """
+    query = update.callback_query
+    purpose, op, value = parse_picker_data(query.data)
+    if op in ("s", "d"):
+        return purpose, op, value
+
+    await query.answer()
+    if op == "f":
+        context.user_data["action"] = "picker_filter"
+        context.user_data["picker_filter_target"] = purpose
+        await query.message.reply_text("🔎 Введіть початок назви компанії (без урахування регістру):")
+        return purpose, op, value
+
+    after_id, before_id = None, None
+    if op == "x":
+        set_prefix(context, f"picker:{purpose}", None)
+    elif op == "n":
+        after_id = value or None
+    elif op == "p":
+        before_id = value or None
+    await refresh_company_picker(query.message, context, purpose, after_id, before_id)
+    return purpose, op, value
@@ -0,0 +1,185 @@
+import html
+import logging
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+from app.db import SessionLocal
+from app.models import Company
+from app.utils import get_clients_page, get_companies_page, count_company_clients
+
+logger = logging.getLogger(__name__)
+
+CLIENTS_PER_PAGE = 10
+COMPANIES_PER_PAGE = 5
+
+# callback_data (до 64 байт): курсор — лише id першого / останнього рядка сторінки
+#   clients_page:<company_id|0>:<n|p>:<id>    companies_page:<n|p>:<id>
+#   list_filter:clients:<company_id|0>         list_filter:companies
+#   list_filter_clear:clients:<company_id|0>   list_filter_clear:companies
+# фільтр за початком імені лежить у user_data["list_prefix"] — у callback_data він не вміщається
+
+
+def _short(value, limit: int = 40) -> str:
+    value = str(value or "—")
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+
+def get_prefix(context, kind: str):
+    return (context.user_data.get("list_prefix") or {}).get(kind)
+
+
+def set_prefix(context, kind: str, prefix):
+    prefixes = dict(context.user_data.get("list_prefix") or {})
+    if prefix:
+        prefixes[kind] = prefix
+    else:
+        prefixes.pop(kind, None)
+    context.user_data["list_prefix"] = prefixes
+
+
+def _nav_row(base: str, rows, has_prev: bool, has_next: bool):
+    row = []
+    if rows and has_prev:
+        row.append(InlineKeyboardButton("⬅️ Попередні", callback_data=f"{base}:p:{rows[0].id}"))
+    if rows and has_next:
+        row.append(InlineKeyboardButton("Наступні ➡️", callback_data=f"{base}:n:{rows[-1].id}"))
+    return row
+
+
+def _filter_row(kind_key: str, prefix):
+    row = [InlineKeyboardButton("🔎 Фільтр за назвою", callback_data=f"list_filter:{kind_key}")]
+    if prefix:
+        row.append(InlineKeyboardButton("✖️ Скинути фільтр", callback_data=f"list_filter_clear:{kind_key}"))
+    return row
+
+
+def render_clients_page(session, company_id: int = 0, prefix: str = None, after_id: int = None, before_id: int = None):
+    """
+    (text, markup) сторінки клієнтів: CLIENTS_PER_PAGE рядків за keyset-курсором,
+    назви компаній — тим самим запитом (JOIN), тож вартість не залежить від кількості клієнтів.
+    """
+    page, has_prev, has_next = get_clients_page(
+        session, company_id=company_id or None, prefix=prefix,
+        after_id=after_id, before_id=before_id, limit=CLIENTS_PER_PAGE,
+    )
+    rows = [client for client, _ in page]
+
+    title = "<b>📋 Клієнти</b>"
+    if company_id:
+        company = session.query(Company.name).filter(Company.id == company_id).scalar()
+        title += f" · 🏢 {html.escape(_short(company))}"
+    if prefix:
+        title += f" · 🔎 «{html.escape(prefix)}»"
+
+    buttons = []
+    if not page:
+        text = f"{title}\n\n📭 Немає клієнтів."
+    else:
+        text = f"{title}\n\n"
+        for client, company_name in page:
+            text += (
+                f"👤 <b>{html.escape(_short(client.name))}</b> — <i>{html.escape(_short(company_name))}</i>\n"
+                f"🆔 tg_id: <code>{client.tg_id}</code>\n"
+            )
+            buttons.append([InlineKeyboardButton(f"✉️ {_short(client.name or client.tg_id, 30)}",
+                                                 callback_data=f"write_to_client:{client.tg_id}")])
+
+    nav = _nav_row(f"clients_page:{company_id or 0}", rows, has_prev, has_next)
+    if nav:
+        buttons.append(nav)
+    buttons.append(_filter_row(f"clients:{company_id or 0}", prefix))
+    back = "list_companies_menu" if company_id else "clients_menu"
+    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data=back)])
+    return text, InlineKeyboardMarkup(buttons)
+
+
+def render_companies_page(session, prefix: str = None, after_id: int = None, before_id: int = None):
+    """(text, markup) сторінки компаній: COMPANIES_PER_PAGE компаній і кількість працівників одним GROUP BY."""
+    rows, has_prev, has_next = get_companies_page(
+        session, prefix=prefix, after_id=after_id, before_id=before_id, limit=COMPANIES_PER_PAGE,
+    )
+    counts = count_company_clients(session, [c.id for c in rows])
+
+    title = "<b>🏢 Компанії</b>"
+    if prefix:
+        title += f" · 🔎 «{html.escape(prefix)}»"
+
+    buttons = []
+    if not rows:
+        text = f"{title}\n\n📭 Немає зареєстрованих компаній."
+    else:
+        text = f"{title}\n\n"
+        for comp in rows:
+            text += (
+                f"<b>🏢 {html.escape(_short(comp.name))} (ID: {comp.id})</b>\n"
+                f"👤 Контакт: {html.escape(_short(comp.contact_name))}\n"
+                f"🧩 ClientID: <code>{html.escape(_short(comp.client_id, 64))}</code>\n"
+                f"🔑 ClientSecret: <code>{html.escape(_short(comp.client_secret, 64))}</code>\n"
+                f"👥 Працівників: {counts.get(comp.id, 0)}\n\n"
+            )
+            buttons.append([InlineKeyboardButton(
+                f"👥 {_short(comp.name, 30)} ({counts.get(comp.id, 0)})",
+                callback_data=f"clients_page:{comp.id}:n:0",
+            )])
+
+    nav = _nav_row("companies_page", rows, has_prev, has_next)
+    if nav:
+        buttons.append(nav)
+    buttons.append(_filter_row("companies", prefix))
+    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="companies_menu")])
+    return text, InlineKeyboardMarkup(buttons)
+
+
+def render_listing(session, context, kind_key: str, after_id: int = None, before_id: int = None):
+    """kind_key: "companies" або "clients:<company_id>" — як у callback_data."""
+    if kind_key == "companies":
+        return render_companies_page(session, get_prefix(context, "companies"), after_id, before_id)
+    company_id = int(kind_key.split(":", 1)[1]) if ":" in kind_key else 0
+    return render_clients_page(session, company_id, get_prefix(context, "clients"), after_id, before_id)
+
+
+async def send_listing(message, context: ContextTypes.DEFAULT_TYPE, kind_key: str):
+    """Перша сторінка списку новим повідомленням (далі гортається редагуванням його ж)."""
+    session = SessionLocal()
+    try:
+        text, markup = render_listing(session, context, kind_key)
+    finally:
+        session.close()
+    await message.reply_text(text, parse_mode="HTML", reply_markup=markup)
+
+
+async def view_listing(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Гортання списків клієнтів / компаній та фільтр за назвою — в одному повідомленні."""
+    query = update.callback_query
+    await query.answer()
+
+    parts = query.data.split(":")
+    kind_key, after_id, before_id = None, None, None
+    if parts[0] == "clients_page":
+        # clients_page:<company_id>:<n|p>:<id>
+        kind_key = f"clients:{parts[1]}"
+        cursor = int(parts[3]) or None
+        after_id, before_id = (cursor, None) if parts[2] == "n" else (None, cursor)
+    elif parts[0] == "companies_page":
+        kind_key = "companies"
+        cursor = int(parts[2]) or None
+        after_id, before_id = (cursor, None) if parts[1] == "n" else (None, cursor)
+    elif parts[0] == "list_filter":
+        context.user_data["action"] = "list_filter"
+        context.user_data["list_filter_target"] = ":".join(parts[1:])
+        await query.message.reply_text("🔎 Введіть початок назви / імені (без урахування регістру):")
+        return
+    elif parts[0] == "list_filter_clear":
+        kind_key = ":".join(parts[1:])
+        set_prefix(context, kind_key.split(":", 1)[0], None)
+
+    session = SessionLocal()
+    try:
+        text, markup = render_listing(session, context, kind_key, after_id, before_id)
+    finally:
+        session.close()
+    try:
+        await query.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+    except BadRequest as e:
+        # "Message is not modified" — та сама сторінка
+        logger.debug("edit_text failed: %s", e)
@@ -1,118 +1,194 @@
 import math
 import html
 import logging
+from datetime import timedelta
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 from app.db import SessionLocal
 from app.models import Company, Client, Admin
-from app.utils import get_company_history
+from app.utils import get_company_history, count_company_history, history_range_bounds
 
 # Якщо логгер не ініціалізовано — створимо запасний варіант
 if 'logger' not in locals():
     logger = logging.getLogger(__name__)
 
+PER_PAGE = 4
+
+RANGE_LABELS = {
+    "24h": "24 год",
+    "7d": "7 днів",
+    "30d": "30 днів",
+    "all": "весь час",
+}
+
+
+def range_label(range_token: str) -> str:
+    if range_token in RANGE_LABELS:
+        return RANGE_LABELS[range_token]
+    since, until = history_range_bounds(range_token)
+    return f"{since:%Y-%m-%d} — {until - timedelta(days=1):%Y-%m-%d}"
+
+
+def range_picker_markup(company_id: int) -> InlineKeyboardMarkup:
+    """Кнопки вибору періоду: останні 24 год / 7 / 30 днів / власний / весь час."""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("24 год", callback_data=f"view_history:{company_id}:24h"),
+            InlineKeyboardButton("7 днів", callback_data=f"view_history:{company_id}:7d"),
+            InlineKeyboardButton("30 днів", callback_data=f"view_history:{company_id}:30d"),
+        ],
+        [
+            InlineKeyboardButton("📅 Свій період", callback_data=f"history_custom:{company_id}"),
+            InlineKeyboardButton("♾️ Весь час", callback_data=f"view_history:{company_id}:all"),
+        ],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="history_menu")],
+    ])
+
+
+def render_history_page(session, company, page: int, range_token: str):
+    """
+    Формує (text, markup) для сторінки історії компанії.
+    У БД потрапляють лише COUNT та PER_PAGE рядків поточної сторінки.
+    """
+    since, until = history_range_bounds(range_token)
+    total = count_company_history(session, company.id, since, until)
+    if not total:
+        return (
+            f"📭 У компанії <b>{html.escape(company.name)}</b> немає повідомлень за період "
+            f"<i>{range_label(range_token)}</i>.",
+            range_picker_markup(company.id),
+        )
+
+    total_pages = math.ceil(total / PER_PAGE)
+    page = min(max(page, 0), total_pages - 1)
+
+    # сторінка 0 — найновіші; всередині сторінки показуємо від старіших до новіших
+    subset = get_company_history(
+        session, company.id, since, until,
+        newest_first=True, limit=PER_PAGE, offset=page * PER_PAGE,
+    )
+    subset.reverse()
+
+    # --- Імена клієнтів та адмінів одним запитом на сторінку ---
+    client_ids = {m.client_tg_id for m in subset if m.client_tg_id}
+    admin_ids = {m.admin_tg_id for m in subset if m.admin_tg_id}
+    client_names = dict(
+        session.query(Client.tg_id, Client.name).filter(Client.tg_id.in_(client_ids)).all()
+    ) if client_ids else {}
+    admin_names = dict(
+        session.query(Admin.tg_id, Admin.name).filter(Admin.tg_id.in_(admin_ids)).all()
+    ) if admin_ids else {}
+
+    # --- Формуємо текст ---
+    text = f"<b>🕓 Історія компанії {html.escape(company.name)}</b>\n"
+    text += f"<i>Період: {range_label(range_token)} · сторінка {page + 1} із {total_pages}</i>\n\n"
+
+    for msg in subset:
+        client_name = client_names.get(msg.client_tg_id) or "Клієнт"
+        admin_name = admin_names.get(msg.admin_tg_id) or "Адмін"
+
+        # --- Визначаємо напрямок повідомлення ---
+        if msg.direction == "in":
+            sender = f"👤 {html.escape(client_name)}"
+            recipient = f"🛠️ {html.escape(admin_name)}"
+        else:
+            sender = f"🛠️ {html.escape(admin_name)}"
+            recipient = f"👤 {html.escape(client_name)}"
+
+        safe_text = html.escape(msg.text or "(без тексту)")
+
+        text += (
+            f"<b>{sender} → {recipient}</b>\n"
+            f"<i>{msg.created_at.strftime('%Y-%m-%d %H:%M:%S')}</i>\n"
+            f"{safe_text}\n"
+            f"────────────────────\n"
+        )
+
+    # --- Кнопки пагінації ---
+    buttons = []
+    nav_row = []
+
+    if page < total_pages - 1:
+        nav_row.append(
+            InlineKeyboardButton("⬅️ Старіші", callback_data=f"history_page:{company.id}:{page + 1}:{range_token}")
+        )
+    if page > 0:
+        nav_row.append(
+            InlineKeyboardButton("Новіші ➡️", callback_data=f"history_page:{company.id}:{page - 1}:{range_token}")
+        )
+
+    if nav_row:
+        buttons.append(nav_row)
+
+    buttons.append([InlineKeyboardButton("📅 Інший період", callback_data=f"view_history:{company.id}")])
+    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="history_menu")])
+
+    return text, InlineKeyboardMarkup(buttons)
+
+
+def _is_admin(tg_id) -> bool:
+    session = SessionLocal()
+    try:
+        return session.query(Admin.id).filter_by(tg_id=str(tg_id)).first() is not None
+    finally:
+        session.close()
+
 
 async def view_history_paginated(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обробляє пагінацію історії компанії"""
+    """Обробляє вибір періоду та пагінацію історії компанії"""
     query = update.callback_query
+    # кнопка з inline-результату пошуку може бути в будь-якому чаті — історію бачать лише адміни
+    if query.message is None and not _is_admin(query.from_user.id):
+        await query.answer("⛔ Лише для адміністраторів.", show_alert=True)
+        return
     await query.answer()
 
     data = query.data
     session = SessionLocal()
     try:
-        # --- Витягуємо ID компанії та сторінку ---
-        if data.startswith("view_history:"):
-            company_id = int(data.split(":")[1])
+        # --- Витягуємо ID компанії, сторінку та період ---
+        parts = data.split(":")
+        company_id = int(parts[1])
+        if parts[0] == "view_history":
+            # view_history:<company_id>[:<range>]
+            range_token = parts[2] if len(parts) > 2 else None
             page = 0
+        elif parts[0] == "history_custom":
+            range_token = None
         else:
-            # формат: history_page:<company_id>:<page>
-            _, company_id, page = data.split(":")
-            company_id = int(company_id)
-            page = int(page)
+            # формат: history_page:<company_id>:<page>:<range>
+            page = int(parts[2])
+            range_token = parts[3] if len(parts) > 3 else "all"
 
         # --- Отримуємо компанію ---
         company = session.query(Company).filter_by(id=company_id).first()
         if not company:
-            await query.message.edit_text("❌ Компанію не знайдено.")
+            await query.edit_message_text("❌ Компанію не знайдено.")
             return
 
-        # --- Отримуємо історію ---
-        messages = get_company_history(session, company_id)
-        if not messages:
-            await query.message.edit_text(
-                f"📭 У компанії <b>{html.escape(company.name)}</b> немає історії повідомлень.",
+        if parts[0] == "history_custom":
+            context.user_data["action"] = "history_custom_range"
+            context.user_data["history_company_id"] = company_id
+            await query.edit_message_text(
+                f"📅 Введіть період для <b>{html.escape(company.name)}</b> у форматі\n"
+                f"<code>YYYY-MM-DD YYYY-MM-DD</code> (або одну дату):",
                 parse_mode="HTML"
             )
             return
 
-        # --- Параметри пагінації ---
-        per_page = 4
-        total_pages = math.ceil(len(messages) / per_page)
-        start = len(messages) - (page + 1) * per_page
-        end = len(messages) - page * per_page
-        start = max(start, 0)
-        subset = messages[start:end]
-
-        # --- Формуємо текст ---
-        text = f"<b>🕓 Історія компанії {html.escape(company.name)}</b>\n"
-        text += f"<i>Сторінка {page + 1} із {total_pages}</i>\n\n"
-
-        for msg in subset:
-            # --- Отримуємо ім’я клієнта ---
-            client_name = "Клієнт"
-            if msg.client_tg_id:
-                client = session.query(Client).filter_by(tg_id=msg.client_tg_id).first()
-                if client and client.name:
-                    client_name = client.name
-
-            # --- Отримуємо ім’я адміна ---
-            admin_name = "Адмін"
-            if msg.admin_tg_id:
-                admin = session.query(Admin).filter_by(tg_id=msg.admin_tg_id).first()
-                if admin and admin.name:
-                    admin_name = admin.name
-
-            # --- Визначаємо напрямок повідомлення ---
-            if msg.direction == "in":
-                sender = f"👤 {html.escape(client_name)}"
-                recipient = f"🛠️ {html.escape(admin_name)}"
-            else:
-                sender = f"🛠️ {html.escape(admin_name)}"
-                recipient = f"👤 {html.escape(client_name)}"
-
-            safe_text = html.escape(msg.text or "(без тексту)")
-
-            text += (
-                f"<b>{sender} → {recipient}</b>\n"
-                f"<i>{msg.created_at.strftime('%Y-%m-%d %H:%M:%S')}</i>\n"
-                f"{safe_text}\n"
-                f"────────────────────\n"
-            )
-
-        # --- Кнопки пагінації ---
-        buttons = []
-        nav_row = []
-
-        if page < total_pages - 1:
-            nav_row.append(
-                InlineKeyboardButton("⬅️ Старіші", callback_data=f"history_page:{company_id}:{page + 1}")
+        if range_token is None:
+            await query.edit_message_text(
+                f"🕓 Оберіть період історії компанії <b>{html.escape(company.name)}</b>:",
+                parse_mode="HTML",
+                reply_markup=range_picker_markup(company_id)
             )
-        if page > 0:
-            nav_row.append(
-                InlineKeyboardButton("Новіші ➡️", callback_data=f"history_page:{company_id}:{page - 1}")
-            )
-
-        if nav_row:
-            buttons.append(nav_row)
-
-        buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="history_menu")])
-
-        markup = InlineKeyboardMarkup(buttons)
+            return
 
-        await query.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+        text, markup = render_history_page(session, company, page, range_token)
+        await query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
 
     except Exception as e:
-        logger.error(f"Помилка при пагінації історії: {e}")
-        await query.message.edit_text("⚠️ Помилка при завантаженні історії.")
+        logger.error("Помилка при пагінації історії: %s", e)
+        await query.edit_message_text("⚠️ Помилка при завантаженні історії.")
     finally:
         session.close()
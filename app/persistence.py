@@ -0,0 +1,158 @@
+"""
+Persistence PTB у таблиці bot_state (SQLite) замість пам'яті.
+
+Стани ConversationHandler, user_data (broadcast_active, replying_claim_id, write_to_client_mode,
+target_client_tg...) та chat_data переживають рестарт бота. На відміну від PicklePersistence,
+яка на кожен flush переписує весь файл, тут кожен ключ — окремий рядок з JSON-значенням:
+PTB раз на PERSISTENCE_INTERVAL секунд віддає лише змінені ключі, і вся ця пачка записується
+одною транзакцією (UPSERT / DELETE). Порожні user_data / chat_data та завершені розмови
+видаляються, тож таблиця лишається компактною.
+"""
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+
+from sqlalchemy import delete, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from telegram.ext import BasePersistence, PersistenceInput
+
+from .db import engine, SessionLocal
+from .models import BotState
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = "user_data"
+CHAT_DATA = "chat_data"
+BOT_DATA = "bot_data"
+CONVERSATION = "conversation:"
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+class DbPersistence(BasePersistence):
+    def __init__(self, bot: str, store_data: PersistenceInput = None, update_interval: float = None):
+        super().__init__(
+            store_data=store_data or PersistenceInput(bot_data=False, callback_data=False),
+            update_interval=float(os.getenv("PERSISTENCE_INTERVAL", "5")) if update_interval is None else update_interval,
+        )
+        self.bot_name = bot
+        self._pending = {}          # (kind, key) -> JSON-рядок або None (видалити)
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    # === ЧИТАННЯ (один раз при старті) ===
+    def _load(self, kind: str):
+        session = SessionLocal()
+        try:
+            return session.query(BotState.key, BotState.value).filter(
+                BotState.bot == self.bot_name, BotState.kind == kind
+            ).all()
+        finally:
+            session.close()
+
+    async def get_user_data(self):
+        return {int(key): json.loads(value) for key, value in self._load(USER_DATA)}
+
+    async def get_chat_data(self):
+        return {int(key): json.loads(value) for key, value in self._load(CHAT_DATA)}
+
+    async def get_bot_data(self):
+        rows = self._load(BOT_DATA)
+        return json.loads(rows[0][1]) if rows else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name: str):
+        return {tuple(json.loads(key)): json.loads(value) for key, value in self._load(CONVERSATION + name)}
+
+    # === ЗАПИС (пачками) ===
+    def _queue(self, kind: str, key: str, value):
+        """
+        Ставить зміну в чергу і повертає задачу запису. PTB викликає всі update_* однієї пачки
+        через asyncio.gather, тож задача, створена першим викликом, стартує вже після того,
+        як решта поставила свої зміни, — і пише їх однією транзакцією.
+        """
+        self._pending[(kind, key)] = None if value is None else _dumps(value)
+        return self._ensure_flush()
+
+    def _ensure_flush(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_pending())
+        return self._flush_task
+
+    async def _flush_pending(self):
+        async with self._write_lock:
+            batch, self._pending = self._pending, {}
+            # нові зміни після цього моменту потраплять уже в наступну задачу
+            self._flush_task = None
+            if batch:
+                await asyncio.to_thread(self._write, batch)
+
+    def _write(self, batch: dict):
+        now = datetime.utcnow()
+        upserts = [
+            {"bot": self.bot_name, "kind": kind, "key": key, "value": value, "updated_at": now}
+            for (kind, key), value in batch.items() if value is not None
+        ]
+        deletes = [{"k": kind, "key_": key} for (kind, key), value in batch.items() if value is None]
+
+        with engine.begin() as conn:
+            if upserts:
+                stmt = sqlite_insert(BotState)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["bot", "kind", "key"],
+                    set_={"value": stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+                )
+                conn.execute(stmt, upserts)
+            if deletes:
+                conn.execute(
+                    delete(BotState).where(
+                        BotState.bot == self.bot_name,
+                        BotState.kind == bindparam("k"),
+                        BotState.key == bindparam("key_"),
+                    ),
+                    deletes,
+                )
+        logger.debug("💾 [PERSISTENCE] %s: записано %s, видалено %s", self.bot_name, len(upserts), len(deletes))
+
+    async def update_user_data(self, user_id: int, data):
+        await self._queue(USER_DATA, str(user_id), data or None)
+
+    async def update_chat_data(self, chat_id: int, data):
+        await self._queue(CHAT_DATA, str(chat_id), data or None)
+
+    async def update_bot_data(self, data):
+        await self._queue(BOT_DATA, "", data or None)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name: str, key, new_state):
+        await self._queue(CONVERSATION + name, _dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id: int):
+        await self._queue(USER_DATA, str(user_id), None)
+
+    async def drop_chat_data(self, chat_id: int):
+        await self._queue(CHAT_DATA, str(chat_id), None)
+
+    async def refresh_user_data(self, user_id: int, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Викликається PTB при зупинці: дописує все, що ще в черзі, і чекає поточний запис."""
+        if self._pending:
+            await self._ensure_flush()
+        async with self._write_lock:
+            pass
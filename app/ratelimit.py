@@ -0,0 +1,320 @@
+"""
+Спільна черга вихідних запитів до Bot API з пріоритетами, адаптивним темпом і повторами.
+
+Розсилка, сповіщення адмінів і живі відповіді клієнтам ідуть одним токеном і впираються
+в ті самі ліміти Telegram (~30 повідомлень/с на бота). Раніше розсилка займала весь ліміт,
+і відповідь менеджера чекала в загальній черзі. PriorityRateLimiter — один на токен на процес
+(app/bots.py) — пропускає send*/edit* не швидше за поточний ліміт, а з тих, що чекають,
+першими віддає інтерактивні відповіді, потім сповіщення, і лише потім розсилки.
+
+Клас запиту передається через rate_limit_args методів ExtBot:
+
+    await bot.send_message(chat_id, text, rate_limit_args=BROADCAST_ARGS)
+
+Без rate_limit_args запит вважається інтерактивним.
+
+Стійкість до збоїв — тут же, для всіх викликачів:
+- AIMD: кожен 429 знижує ліміт на чверть (і ставить чергу токена на паузу retry_after), кожна
+  секунда без 429 повертає +AIMD_INCREASE запитів/с — до OUTBOUND_RATE;
+- тимчасові помилки (429, тайм-аут, мережа, 5xx) повторюються до RETRIES[клас] разів:
+  після 429 запит просто знову стає в чергу, після збою мережі — через експоненційну паузу
+  з jitter. Повтори обмежені бюджетом (RETRY_BUDGET_RATIO від успішних запитів), щоб під час
+  збою не множити навантаження. send* / copy / forward повторюються лише після 429 і помилок
+  до відправки (з'єднання, пул): після тайм-ауту читання чи 5xx Telegram міг уже доставити
+  повідомлення, і повтор надіслав би його клієнту вдруге (див. retry_safe);
+- circuit breaker: BREAKER_THRESHOLD збоїв мережі поспіль ставлять усі відправки токена на паузу,
+  далі один пробний запит; невдача подовжує паузу вдвічі (до BREAKER_COOLDOWN_MAX).
+
+Розсилки (BROADCAST_ARGS) не повторюються в черзі: воркер відкладає отримувача в свою чергу
+повторів (app/broadcast.py) і бере наступного, а не спить.
+"""
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import logging
+from datetime import timedelta
+
+import httpx
+from telegram.error import RetryAfter, NetworkError, BadRequest
+from telegram.ext import BaseRateLimiter
+
+from .metrics import (
+    OUTBOUND_REQUESTS, OUTBOUND_WAIT, OUTBOUND_QUEUE, OUTBOUND_RATE, OUTBOUND_RETRIES, OUTBOUND_BREAKER
+)
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"    # відповіді клієнту / адміну на його дію
+NOTIFICATION = "notification"  # сповіщення адмінів про нові запити та claim-и
+BROADCAST = "broadcast"        # масові розсилки
+
+PRIORITIES = {INTERACTIVE: 0, NOTIFICATION: 1, BROADCAST: 2}
+# скільки разів черга сама повторює тимчасово невдалий запит (rate_limit_args["max_retries"] перевизначає)
+RETRIES = {INTERACTIVE: 3, NOTIFICATION: 3, BROADCAST: 0}
+
+NOTIFICATION_ARGS = {"priority": NOTIFICATION}
+BROADCAST_ARGS = {"priority": BROADCAST}
+
+# методи, що рахуються в ліміт повідомлень; решта (getFile, answerCallbackQuery...) — без черги
+LIMITED_PREFIXES = ("send", "edit", "copyMessage", "forwardMessage")
+# методи, повтор яких створює ще одне повідомлення (edit* — ідемпотентні)
+RESEND_PREFIXES = ("send", "copyMessage", "forwardMessage")
+# причини помилки HTTPXRequest, за яких запит гарантовано не дійшов до Telegram
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+DEFAULT_RATE = 25.0
+MIN_RATE = 1.0
+AIMD_DECREASE = 0.75       # множник ліміту на 429
+AIMD_INCREASE = 3.0        # +запитів/с за кожну секунду без 429
+BACKOFF_BASE = 0.5         # с; пауза перед повтором n: BACKOFF_BASE * 2**n з jitter, не більше BACKOFF_CAP
+BACKOFF_CAP = 30.0
+RETRY_BUDGET_RATIO = 0.1   # на кожен успішний запит — 0.1 повтору в бюджет
+RETRY_BUDGET_MAX = 10.0
+BREAKER_THRESHOLD = 5      # збоїв мережі поспіль до паузи
+BREAKER_COOLDOWN = 5.0
+BREAKER_COOLDOWN_MAX = 120.0
+PROBE_WAIT = 0.5           # як часто перевіряти, чи завершився пробний запит
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+def is_transient(error) -> bool:
+    """429, тайм-аут, збій мережі або 5xx — повтор має сенс; BadRequest / Forbidden — ні."""
+    return isinstance(error, RetryAfter) or (isinstance(error, NetworkError) and not isinstance(error, BadRequest))
+
+
+def retry_safe(error, creates_message: bool) -> bool:
+    """
+    Чи можна повторити тимчасово невдалий запит. Для запитів, що створюють повідомлення, —
+    лише 429 (Telegram його відхилив) і збої до відправки; TimedOut читання / 5xx могли вже
+    дійти, тож їх отримує викликач.
+    """
+    if not is_transient(error):
+        return False
+    if isinstance(error, RetryAfter) or not creates_message:
+        return True
+    return isinstance(error.__cause__, NOT_SENT_ERRORS)
+
+
+def backoff_delay(attempt: int, error=None) -> float:
+    """Пауза перед повтором номер attempt (з 0): retry_after для 429, інакше експонента з jitter."""
+    if isinstance(error, RetryAfter):
+        return _seconds(error.retry_after) + random.uniform(0, BACKOFF_BASE)
+    return random.uniform(0.5, 1.0) * min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)
+
+
+class PriorityRateLimiter(BaseRateLimiter):
+    """
+    Token bucket на поточний ліміт запитів/с (запас — секунда трафіку) і купа очікувачів
+    (клас, порядок надходження). Поки черга порожня і є дозвіл, запит іде одразу;
+    інакше його відпускає фонова задача, щойно з'являється наступний дозвіл.
+    """
+
+    def __init__(self, rate: float = None, burst: float = None, name: str = "-"):
+        self.max_rate = rate or float(os.getenv("OUTBOUND_RATE") or DEFAULT_RATE)
+        self.min_rate = min(MIN_RATE, self.max_rate)
+        self.rate = self.max_rate
+        self._fixed_burst = burst
+        self.name = name
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._retry_budget = RETRY_BUDGET_MAX
+        self._failures = 0               # збоїв мережі поспіль
+        self._breaker = CLOSED
+        self._breaker_until = 0.0
+        self._cooldown = BREAKER_COOLDOWN
+        self._probing = False
+        self._waiters = []  # heap: (пріоритет, номер, future, клас)
+        self._seq = itertools.count()
+        self._depth = dict.fromkeys(PRIORITIES, 0)
+        self._wakeup = None
+        self._pump_task = None
+        OUTBOUND_RATE.set(self.rate, bot=self.name)
+
+    @property
+    def burst(self) -> float:
+        return self._fixed_burst or max(1.0, self.rate)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        # один limiter спільний для Application і get_bot(), тож shutdown може прийти двічі
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+
+    # === ДОЗВОЛИ ===
+    def _delay(self) -> float:
+        """Секунд до наступного дозволу (0 — можна зараз)."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._breaker != CLOSED:
+            if now < self._breaker_until:
+                return self._breaker_until - now
+            if self._probing:
+                return PROBE_WAIT
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def _take(self):
+        self._tokens -= 1
+        if self._breaker != CLOSED:
+            # пауза минула: цей запит — пробний, решта чекає на його результат
+            self._breaker = HALF_OPEN
+            self._probing = True
+
+    def _ensure_pump(self):
+        if self._pump_task is None or self._pump_task.done():
+            self._wakeup = asyncio.Event()
+            self._pump_task = asyncio.get_running_loop().create_task(self._pump())
+
+    async def _pump(self):
+        while True:
+            while self._waiters and self._waiters[0][2].done():
+                heapq.heappop(self._waiters)  # викликач скасував очікування
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self._delay()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            self._take()
+            heapq.heappop(self._waiters)[2].set_result(None)
+
+    async def _acquire(self, priority: str):
+        if not self._waiters and self._delay() == 0:
+            self._take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITIES[priority], next(self._seq), future, priority))
+        self._set_depth(priority, 1)
+        self._ensure_pump()
+        self._wakeup.set()
+        try:
+            await future
+        finally:
+            self._set_depth(priority, -1)
+
+    def _set_depth(self, priority: str, delta: int):
+        self._depth[priority] += delta
+        OUTBOUND_QUEUE.set(self._depth[priority], bot=self.name, priority=priority)
+
+    # === АДАПТАЦІЯ ===
+    def _set_rate(self, rate: float):
+        self.rate = max(self.min_rate, min(self.max_rate, rate))
+        OUTBOUND_RATE.set(self.rate, bot=self.name)
+
+    def _api_responded(self):
+        """Bot API відповів (хай і помилкою) — мережа в порядку, breaker закривається."""
+        self._failures = 0
+        self._probing = False
+        if self._breaker != CLOSED:
+            logger.info("✅ [OUTBOUND] %s: Bot API знову відповідає, відправки відновлено", self.name)
+            self._breaker = CLOSED
+            self._cooldown = BREAKER_COOLDOWN
+            OUTBOUND_BREAKER.set(0, bot=self.name)
+
+    def _on_success(self, retried: bool):
+        self._api_responded()
+        if self.rate < self.max_rate:
+            self._set_rate(self.rate + AIMD_INCREASE / self.rate)
+        if not retried:
+            self._retry_budget = min(RETRY_BUDGET_MAX, self._retry_budget + RETRY_BUDGET_RATIO)
+
+    def _on_retry_after(self, error: RetryAfter, endpoint: str):
+        self._api_responded()
+        now = time.monotonic()
+        pause = _seconds(error.retry_after)
+        if now >= self._paused_until:
+            # одне зниження на епізод: запити, що вже були в польоті, отримають той самий 429
+            self._set_rate(self.rate * AIMD_DECREASE)
+        self._paused_until = max(self._paused_until, now + pause)
+        logger.warning("⏳ [OUTBOUND] %s: 429 на %s, черга стоїть %.1fs, ліміт %.1f/с",
+                       self.name, endpoint, pause, self.rate)
+
+    def _on_outage(self, error, endpoint: str):
+        self._failures += 1
+        self._probing = False
+        if self._breaker == HALF_OPEN or (self._breaker == CLOSED and self._failures >= BREAKER_THRESHOLD):
+            self._breaker = OPEN
+            self._breaker_until = time.monotonic() + self._cooldown
+            logger.error("🔌 [OUTBOUND] %s: Bot API недоступний (%s на %s) — відправки на паузі %.0fs",
+                         self.name, error, endpoint, self._cooldown)
+            self._cooldown = min(BREAKER_COOLDOWN_MAX, self._cooldown * 2)
+            OUTBOUND_BREAKER.set(1, bot=self.name)
+
+    def _spend_retry(self) -> bool:
+        if self._retry_budget < 1:
+            return False
+        self._retry_budget -= 1
+        return True
+
+    # === BaseRateLimiter ===
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not endpoint.startswith(LIMITED_PREFIXES):
+            return await callback(*args, **kwargs)
+
+        rate_limit_args = rate_limit_args or {}
+        priority = rate_limit_args.get("priority", INTERACTIVE)
+        if priority not in PRIORITIES:
+            raise ValueError(f"Невідомий клас вихідного запиту: {priority}")
+        max_retries = rate_limit_args.get("max_retries", RETRIES[priority])
+
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            await self._acquire(priority)
+            OUTBOUND_WAIT.observe(time.monotonic() - started, bot=self.name, priority=priority)
+
+            try:
+                response = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                error, result = e, "retry_after"
+                self._on_retry_after(e, endpoint)
+                delay = 0  # пауза вже на всій черзі токена — повтор просто стає в неї
+            except NetworkError as e:
+                error = e
+                if isinstance(e, BadRequest):
+                    result = "error"
+                    self._api_responded()
+                else:
+                    result = "network"
+                    self._on_outage(e, endpoint)
+                delay = backoff_delay(attempt)
+            except asyncio.CancelledError:
+                self._probing = False  # пробний запит скасовано — наступний стане пробним
+                raise
+            except Exception:
+                OUTBOUND_REQUESTS.inc(bot=self.name, priority=priority, result="error")
+                self._api_responded()
+                raise
+            else:
+                self._on_success(retried=attempt > 0)
+                OUTBOUND_REQUESTS.inc(bot=self.name, priority=priority, result="ok")
+                return response
+
+            OUTBOUND_REQUESTS.inc(bot=self.name, priority=priority, result=result)
+            if (result == "error" or not retry_safe(error, endpoint.startswith(RESEND_PREFIXES))
+                    or attempt >= max_retries or not self._spend_retry()):
+                raise error
+            OUTBOUND_RETRIES.inc(bot=self.name, reason=result)
+            logger.info("🔁 [OUTBOUND] %s: повтор %s/%s %s через %.1fs (%s)",
+                        self.name, attempt + 1, max_retries, endpoint, delay, result)
+            attempt += 1
+            if delay:
+                await asyncio.sleep(delay)
@@ -0,0 +1,103 @@
+"""
+Запис вхідних апдейтів у стиснутий JSONL для подальшого відтворення (bench/replay.py).
+
+Вмикається змінною UPDATE_RECORD_PATH, напр. /data/updates_{bot}.jsonl.gz
+({bot} замінюється на client / admin — кожен процес пише у свій файл).
+Рядок: {"ts": <unix time>, "bot": "client", "update": <Update.to_dict()>}.
+
+Запис у файл робить фоновий потік, хендлер лише кладе dict у чергу.
+Файл відкривається в режимі дозапису: кожен запуск бота додає новий gzip-member,
+gzip.open читає їх підряд. Увага: лог містить повні повідомлення клієнтів.
+"""
+import os
+import gzip
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+logger = logging.getLogger(__name__)
+
+# виконується раніше за bind_update (група -1), щоб записати апдейт навіть якщо хендлер впаде
+RECORDER_GROUP = -2
+
+
+class UpdateRecorder:
+    def __init__(self, path: str, bot: str):
+        self.path = path
+        self.bot = bot
+        self._queue = queue.SimpleQueue()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = gzip.open(path, "at", encoding="utf-8")
+        self._thread = threading.Thread(target=self._writer, name=f"update-recorder-{bot}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    async def __call__(self, update: Update, context):
+        self._queue.put({"ts": time.time(), "bot": self.bot, "update": update.to_dict()})
+
+    def _writer(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            lines = [record]
+            # дописуємо все, що встигло накопичитись, і скидаємо буфер одним flush
+            while True:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._queue.put(None)
+                    break
+                lines.append(record)
+            try:
+                for item in lines:
+                    self._file.write(json.dumps(item, ensure_ascii=False) + "\n")
+                self._file.flush()
+            except Exception as e:
+                logger.warning("⚠️ Не вдалося записати апдейти у %s: %s", self.path, e)
+        self._file.close()
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+
+def install_update_recorder(application, bot: str):
+    """Додає запис апдейтів, якщо задано UPDATE_RECORD_PATH. Повертає UpdateRecorder або None."""
+    path = os.getenv("UPDATE_RECORD_PATH")
+    if not path:
+        return None
+    if "{bot}" in path:
+        path = path.format(bot=bot)
+    else:
+        head, tail = os.path.split(path)
+        path = os.path.join(head, f"{bot}_{tail}")
+    recorder = UpdateRecorder(path, bot)
+    application.add_handler(TypeHandler(Update, recorder), group=RECORDER_GROUP)
+    logger.info("📼 Запис апдейтів %s бота у %s", bot, path)
+    return recorder
+
+
+def read_recording(path: str):
+    """Ітерує записи з файлу; обрізаний хвіст (процес вбито посеред запису) ігнорується."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    return
+    except (EOFError, gzip.BadGzipFile) as e:
+        logger.warning("⚠️ %s обрізано: %s", path, e)
@@ -0,0 +1,124 @@
+"""
+Inline-пошук в адмін-боті: "@adminbot acme" у будь-якому чаті.
+
+Клієнти — за початком імені або tg_id, компанії — за початком назви; усі запити лише
+префіксні й ідуть індексами (ix_clients_name_search, clients.tg_id, ix_companies_name_search),
+тож не залежать від розміру таблиць. Кожен результат одразу має дії:
+✍️ написати (deep link у чат з ботом), 🕓 історія компанії, 📥 взяти відкритий запит.
+
+Однакові запити (набір тексту генерує їх десятками) віддаються з кешу на SEARCH_CACHE_TTL секунд;
+застарілий кеш безпечний: claim уже взятого запиту відповість "вже взяв адміністратор".
+"""
+import os
+import html
+import time
+from collections import OrderedDict
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+
+from .utils import search_clients, search_companies, get_open_requests, count_company_clients
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "30"))  # секунд; 0 — без кешу
+SEARCH_CACHE_SIZE = 512
+CLIENT_RESULTS = 20
+COMPANY_RESULTS = 5
+MAX_QUERY = 64
+
+_cache = OrderedDict()  # нормалізований запит -> (час завершення, результати)
+
+
+def normalize_query(text: str) -> str:
+    # casefold, як і name_search у БД: "Олена" та "оле" — той самий регістр
+    return " ".join((text or "").split())[:MAX_QUERY].casefold()
+
+
+def _cached(key: str):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    expires, results = entry
+    if expires < time.monotonic():
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return results
+
+
+def _store(key: str, results):
+    if SEARCH_CACHE_TTL <= 0:
+        return
+    _cache[key] = (time.monotonic() + SEARCH_CACHE_TTL, results)
+    _cache.move_to_end(key)
+    while len(_cache) > SEARCH_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def clear_search_cache():
+    _cache.clear()
+
+
+def _client_result(client, company_name, open_request, bot_username: str):
+    name = client.name or client.tg_id
+    card = (
+        f"👤 <b>{html.escape(name)}</b> — <i>{html.escape(company_name or 'Без компанії')}</i>\n"
+        f"🆔 tg_id: <code>{html.escape(client.tg_id or '')}</code>"
+    )
+    description = f"🏢 {company_name or 'Без компанії'} · 🆔 {client.tg_id}"
+    buttons = [[InlineKeyboardButton("✍️ Написати", url=f"https://t.me/{bot_username}?start=write_{client.tg_id}")]]
+    if client.company_id:
+        buttons.append([InlineKeyboardButton("🕓 Історія компанії", callback_data=f"view_history:{client.company_id}")])
+    if open_request:
+        card += f"\n📬 Відкритий запит #{open_request}"
+        description += f" · 📬 #{open_request}"
+        buttons.append([InlineKeyboardButton(f"📥 Взяти запит #{open_request}", callback_data=f"claim:{open_request}")])
+    return InlineQueryResultArticle(
+        id=f"cl{client.id}",
+        title=f"👤 {name}",
+        description=description,
+        input_message_content=InputTextMessageContent(card, parse_mode="HTML"),
+        reply_markup=InlineKeyboardMarkup(buttons),
+    )
+
+
+def _company_result(company, clients_count: int):
+    card = (
+        f"🏢 <b>{html.escape(company.name or '—')}</b> (ID: {company.id})\n"
+        f"👤 Контакт: {html.escape(company.contact_name or '—')}\n"
+        f"👥 Працівників: {clients_count}"
+    )
+    return InlineQueryResultArticle(
+        id=f"co{company.id}",
+        title=f"🏢 {company.name}",
+        description=f"👥 Працівників: {clients_count} · 👤 {company.contact_name or '—'}",
+        input_message_content=InputTextMessageContent(card, parse_mode="HTML"),
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton("🕓 Історія", callback_data=f"view_history:{company.id}"),
+        ]]),
+    )
+
+
+def search_results(session, text: str, bot_username: str):
+    """
+    Список InlineQueryResultArticle для запиту: клієнти, потім компанії.
+    Не більше чотирьох запитів до БД (клієнти, відкриті запити, компанії, кількість працівників).
+    """
+    key = normalize_query(text)
+    if not key:
+        return []
+    results = _cached(key)
+    if results is not None:
+        return results
+
+    clients = search_clients(session, key, limit=CLIENT_RESULTS)
+    open_requests = get_open_requests(session, [client.tg_id for client, _ in clients])
+    results = [
+        _client_result(client, company_name, open_requests.get(client.tg_id), bot_username)
+        for client, company_name in clients
+    ]
+    if not key.isdigit():
+        companies = search_companies(session, key, limit=COMPANY_RESULTS)
+        counts = count_company_clients(session, [c.id for c in companies])
+        results += [_company_result(c, counts.get(c.id, 0)) for c in companies]
+
+    _store(key, results)
+    return results
@@ -0,0 +1,200 @@
+"""
+SLA-аналітика: час першої відповіді та беклог по компаніях / адмінах / днях.
+
+Зведені таблиці (response_stats, response_latency) оновлюються інкрементально
+в тій самій транзакції, що й вхідне повідомлення, claim або відповідь.
+/stats читає лише їх, тож працює однаково швидко за будь-якого розміру історії.
+Функції record_* не роблять commit — це робить викликач.
+"""
+from datetime import datetime, date, timedelta
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import ResponseStat, ResponseLatency
+
+# Верхні межі бакетів гістограми (секунди); останній бакет — "довше за все".
+LATENCY_BUCKETS = (60, 300, 900, 1800, 3600, 7200, 14400, 43200, 86400)
+
+
+def _key(day: date, company_id, admin_tg_id):
+    return {"day": day, "company_id": company_id or 0, "admin_tg_id": str(admin_tg_id or "")}
+
+
+def _bump(session: Session, day: date, company_id, admin_tg_id, **deltas):
+    """UPSERT рядка response_stats з додаванням deltas до лічильників."""
+    stmt = sqlite_insert(ResponseStat).values(**_key(day, company_id, admin_tg_id), **deltas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "company_id", "admin_tg_id"],
+        set_={col: getattr(ResponseStat, col) + stmt.excluded[col] for col in deltas},
+    )
+    session.execute(stmt)
+
+
+def latency_bucket(seconds: float) -> int:
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if seconds <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+def record_inbound(session: Session, company_id, at: datetime = None, claimable: bool = True):
+    """
+    Нове вхідне повідомлення. claimable=False — продовження серії (burst_head_id): його не беруть
+    в роботу окремо, claim серії знімає з беклогу лише її перше повідомлення.
+    """
+    at = at or datetime.utcnow()
+    if claimable:
+        _bump(session, at.date(), company_id, "", inbound_count=1, backlog=1)
+    else:
+        _bump(session, at.date(), company_id, "", inbound_count=1)
+
+
+def record_claim(session: Session, company_id, admin_tg_id, message_created_at: datetime = None, at: datetime = None):
+    """Адмін взяв запит: +1 claim адміну, -1 беклог у день надходження повідомлення."""
+    at = at or datetime.utcnow()
+    _bump(session, at.date(), company_id, admin_tg_id, claim_count=1)
+
+    backlog_day = (message_created_at or at).date()
+    key = _key(backlog_day, company_id, "")
+    session.execute(
+        update(ResponseStat)
+        .where(ResponseStat.day == key["day"],
+               ResponseStat.company_id == key["company_id"],
+               ResponseStat.admin_tg_id == key["admin_tg_id"],
+               ResponseStat.backlog > 0)
+        .values(backlog=ResponseStat.backlog - 1)
+    )
+
+
+def record_outbound(session: Session, company_id, admin_tg_id, at: datetime = None, first_response_sec: float = None):
+    """Відповідь клієнту; first_response_sec — якщо це перша відповідь на claim."""
+    at = at or datetime.utcnow()
+    if first_response_sec is None:
+        _bump(session, at.date(), company_id, admin_tg_id, outbound_count=1)
+        return
+
+    seconds = max(int(first_response_sec), 0)
+    _bump(session, at.date(), company_id, admin_tg_id,
+          outbound_count=1, first_response_count=1, first_response_sum_sec=seconds)
+
+    stmt = sqlite_insert(ResponseLatency).values(
+        **_key(at.date(), company_id, admin_tg_id), bucket=latency_bucket(seconds), count=1
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["day", "company_id", "admin_tg_id", "bucket"],
+        set_={"count": ResponseLatency.count + 1},
+    )
+    session.execute(stmt)
+
+
+def percentile_from_buckets(counts: dict, pct: float):
+    """Оцінка перцентиля за гістограмою: повертає верхню межу бакета (сек) або None."""
+    total = sum(counts.values())
+    if not total:
+        return None
+    threshold = total * pct
+    running = 0
+    for bucket in sorted(counts):
+        running += counts[bucket]
+        if running >= threshold:
+            return LATENCY_BUCKETS[bucket] if bucket < len(LATENCY_BUCKETS) else float("inf")
+    return float("inf")
+
+
+def get_sla_summary(session: Session, days: int = 7):
+    """
+    Зведення по компаніях за останні `days` днів.
+    Повертає список dict: company_id, inbound, claims, outbound, backlog, avg_sec, p50, p90.
+    Беклог — поточний (за весь час), решта — за період.
+    """
+    since = (datetime.utcnow() - timedelta(days=max(days - 1, 0))).date()
+
+    rows = (
+        session.query(
+            ResponseStat.company_id,
+            func.sum(ResponseStat.inbound_count),
+            func.sum(ResponseStat.claim_count),
+            func.sum(ResponseStat.outbound_count),
+            func.sum(ResponseStat.first_response_count),
+            func.sum(ResponseStat.first_response_sum_sec),
+        )
+        .filter(ResponseStat.day >= since)
+        .group_by(ResponseStat.company_id)
+        .all()
+    )
+    backlog = dict(
+        session.query(ResponseStat.company_id, func.sum(ResponseStat.backlog))
+        .group_by(ResponseStat.company_id)
+        .all()
+    )
+    buckets = {}
+    for company_id, bucket, count in (
+        session.query(ResponseLatency.company_id, ResponseLatency.bucket, func.sum(ResponseLatency.count))
+        .filter(ResponseLatency.day >= since)
+        .group_by(ResponseLatency.company_id, ResponseLatency.bucket)
+        .all()
+    ):
+        buckets.setdefault(company_id, {})[bucket] = count
+
+    summary = {}
+    for company_id, inbound, claims, outbound, fr_count, fr_sum in rows:
+        summary[company_id] = {
+            "company_id": company_id,
+            "inbound": inbound or 0,
+            "claims": claims or 0,
+            "outbound": outbound or 0,
+            "backlog": backlog.get(company_id) or 0,
+            "avg_sec": (fr_sum / fr_count) if fr_count else None,
+            "p50": percentile_from_buckets(buckets.get(company_id, {}), 0.5),
+            "p90": percentile_from_buckets(buckets.get(company_id, {}), 0.9),
+        }
+    # компанії без активності за період, але з незакритим беклогом
+    for company_id, value in backlog.items():
+        if value and company_id not in summary:
+            summary[company_id] = {
+                "company_id": company_id, "inbound": 0, "claims": 0, "outbound": 0,
+                "backlog": value, "avg_sec": None, "p50": None, "p90": None,
+            }
+    return sorted(summary.values(), key=lambda s: (-s["backlog"], -s["inbound"]))
+
+
+def get_admin_summary(session: Session, days: int = 7):
+    """Зведення по адмінах за період: claims, відповіді, середній час першої відповіді."""
+    since = (datetime.utcnow() - timedelta(days=max(days - 1, 0))).date()
+    rows = (
+        session.query(
+            ResponseStat.admin_tg_id,
+            func.sum(ResponseStat.claim_count),
+            func.sum(ResponseStat.outbound_count),
+            func.sum(ResponseStat.first_response_count),
+            func.sum(ResponseStat.first_response_sum_sec),
+        )
+        .filter(ResponseStat.day >= since, ResponseStat.admin_tg_id != "")
+        .group_by(ResponseStat.admin_tg_id)
+        .all()
+    )
+    return [
+        {
+            "admin_tg_id": admin_tg_id,
+            "claims": claims or 0,
+            "outbound": outbound or 0,
+            "avg_sec": (fr_sum / fr_count) if fr_count else None,
+        }
+        for admin_tg_id, claims, outbound, fr_count, fr_sum in rows
+    ]
+
+
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return "—"
+    if seconds == float("inf"):
+        return f"> {format_duration(LATENCY_BUCKETS[-1])}"
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} с"
+    if seconds < 3600:
+        return f"{seconds // 60} хв"
+    if seconds < 86400:
+        return f"{seconds // 3600} год {seconds % 3600 // 60} хв"
+    return f"{seconds // 86400} дн {seconds % 86400 // 3600} год"
@@ -0,0 +1,60 @@
+"""
+Дешевий трасувальник станів адмін-бота (заміна log_tracepoint на inspect.stack()).
+
+inspect.stack() на кожен виклик матеріалізує весь стек разом з рядками вихідного коду;
+тут ім'я викликача береться з sys._getframe(1) — це O(1).
+Трасування можна вимкнути або семплювати на льоту (/trace у адмін-боті, TRACE_SAMPLE_RATE в .env),
+а подія віддається як структурований dict у record.trace (для JSON-логів).
+"""
+import os
+import sys
+import random
+import logging
+
+logger = logging.getLogger("app.trace")
+
+# прапорці user_data, які нас цікавлять при розборі зависань станів
+TRACE_FLAGS = ("broadcast_active", "replying_claim_id", "reply_mode_active")
+
+
+class Tracer:
+    def __init__(self, sample_rate: float = None):
+        self.sample_rate = 1.0
+        self.enabled = True
+        self.configure(sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "1.0")) if sample_rate is None else sample_rate)
+
+    def configure(self, enabled: bool = None, sample_rate: float = None):
+        """Змінює налаштування під час роботи. sample_rate=0 еквівалентно вимкненню."""
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+            self.enabled = self.sample_rate > 0
+        if enabled is not None:
+            self.enabled = enabled
+            if enabled and self.sample_rate == 0:
+                self.sample_rate = 1.0
+
+    def trace(self, tag: str, context=None, **fields):
+        """Фіксує tag, ім'я функції-викликача та прапорці стану з context.user_data."""
+        if not self.enabled:
+            return
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
+        user_data = context.user_data if context is not None and context.user_data is not None else {}
+        event = {"tag": tag, "caller": sys._getframe(1).f_code.co_name}
+        for flag in TRACE_FLAGS:
+            event[flag] = user_data.get(flag)
+        event["has_broadcast"] = bool(user_data.get("broadcast"))
+        event.update(fields)
+
+        logger.info(
+            "[TRACE] %s | caller=%s | broadcast_active=%s | replying_claim_id=%s | reply_mode_active=%s | has_broadcast=%s",
+            tag, event["caller"], event["broadcast_active"], event["replying_claim_id"],
+            event["reply_mode_active"], event["has_broadcast"],
+            extra={"trace": event},
+        )
+
+
+tracer = Tracer()
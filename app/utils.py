@@ -1,9 +1,15 @@
+from datetime import datetime, timedelta
 from .db import engine, SessionLocal
-from .models import Base, Admin, Company, Client, Message, Claim
+from .models import Base, Admin, Company, Client, Message, Claim, search_key
+from .migrations import run_migrations
+from contextlib import contextmanager
+from sqlalchemy import exists, func, or_, update, delete, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 
 def init_db(initial_admin_tg_id: str = None):
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
     session = SessionLocal()
     try:
         if initial_admin_tg_id:
@@ -17,17 +23,50 @@ def init_db(initial_admin_tg_id: str = None):
     finally:
         session.close()
 
+# === ТРАНЗАКЦІЇ ===
+# Кожен CRUD-хелпер за замовчуванням комітить сам (commit=True) — як і раніше. Для складених операцій
+# ("створити компанію і прив'язати до неї 50 клієнтів") хелпери викликаються з commit=False:
+# зміни лише flush-аться (id вже відомі), а фіксує їх один COMMIT у unit_of_work.
+def _finish(session: Session, commit: bool):
+    if commit:
+        session.commit()
+    else:
+        session.flush()
+
+@contextmanager
+def unit_of_work(session: Session = None):
+    """
+    Одна транзакція на кілька змін: COMMIT наприкінці блоку, ROLLBACK — якщо блок кинув виняток.
+
+        with unit_of_work() as session:
+            c = add_company(session, "Acme", commit=False)
+            add_clients(session, [{"tg_id": "1", "company_id": c.id}, ...], commit=False)
+
+    Без session відкриває і закриває власну; передану сесію лише комітить / відкочує.
+    """
+    own = session is None
+    session = session or SessionLocal()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        if own:
+            session.close()
+
 # === ADMIN CRUD ===
 def get_admins(session: Session):
     return session.query(Admin).all()
 
-def add_admin(session: Session, tg_id: str, name: str=None):
+def add_admin(session: Session, tg_id: str, name: str=None, commit: bool = True):
     a = Admin(tg_id=str(tg_id), name=name or "", is_super=False)
     session.add(a)
-    session.commit()
+    _finish(session, commit)
     return a
 
-def update_admin(session: Session, tg_id: str, new_name: str = None, is_super: bool = None):
+def update_admin(session: Session, tg_id: str, new_name: str = None, is_super: bool = None, commit: bool = True):
     a = session.query(Admin).filter_by(tg_id=str(tg_id)).first()
     if not a:
         return None
@@ -35,25 +74,26 @@ def update_admin(session: Session, tg_id: str, new_name: str = None, is_super: b
         a.name = new_name
     if is_super is not None:
         a.is_super = is_super
-    session.commit()
+    _finish(session, commit)
     return a
 
-def delete_admin(session: Session, tg_id: str):
+def delete_admin(session: Session, tg_id: str, commit: bool = True):
     a = session.query(Admin).filter_by(tg_id=str(tg_id)).first()
     if not a:
         return False
     session.delete(a)
-    session.commit()
+    _finish(session, commit)
     return True
 
 # === COMPANY CRUD ===
-def add_company(session: Session, name, contact_name=None, client_id=None, client_secret=None):
+def add_company(session: Session, name, contact_name=None, client_id=None, client_secret=None, commit: bool = True):
     c = Company(name=name, contact_name=contact_name, client_id=client_id, client_secret=client_secret)
     session.add(c)
-    session.commit()
+    _finish(session, commit)
     return c
 
-def update_company(session: Session, company_id: int, name=None, contact_name=None, client_id=None, client_secret=None):
+def update_company(session: Session, company_id: int, name=None, contact_name=None, client_id=None, client_secret=None,
+                   commit: bool = True):
     c = session.query(Company).filter_by(id=company_id).first()
     if not c:
         return None
@@ -65,19 +105,19 @@ def update_company(session: Session, company_id: int, name=None, contact_name=No
         c.client_id = client_id
     if client_secret is not None:
         c.client_secret = client_secret
-    session.commit()
+    _finish(session, commit)
     return c
 
-def delete_company(session: Session, company_id: int):
+def delete_company(session: Session, company_id: int, commit: bool = True):
     c = session.query(Company).filter_by(id=company_id).first()
     if not c:
         return False
     session.delete(c)
-    session.commit()
+    _finish(session, commit)
     return True
 
 # === CLIENT CRUD ===
-def add_client(session: Session, tg_id: str, name: str=None, company_id: int=None):
+def add_client(session: Session, tg_id: str, name: str=None, company_id: int=None, commit: bool = True):
     c = session.query(Client).filter_by(tg_id=str(tg_id)).first()
     if c:
         c.name = name or c.name
@@ -85,10 +125,10 @@ def add_client(session: Session, tg_id: str, name: str=None, company_id: int=Non
     else:
         c = Client(tg_id=str(tg_id), name=name, company_id=company_id)
         session.add(c)
-    session.commit()
+    _finish(session, commit)
     return c
 
-def update_client(session: Session, tg_id: str, name=None, company_id=None):
+def update_client(session: Session, tg_id: str, name=None, company_id=None, commit: bool = True):
     c = session.query(Client).filter_by(tg_id=str(tg_id)).first()
     if not c:
         return None
@@ -96,35 +136,348 @@ def update_client(session: Session, tg_id: str, name=None, company_id=None):
         c.name = name
     if company_id is not None:
         c.company_id = company_id
-    session.commit()
+    _finish(session, commit)
     return c
 
-def delete_client(session: Session, tg_id: str):
+def delete_client(session: Session, tg_id: str, commit: bool = True):
     c = session.query(Client).filter_by(tg_id=str(tg_id)).first()
     if not c:
         return False
     session.delete(c)
-    session.commit()
+    _finish(session, commit)
     return True
- 
-def get_company_history(session: Session, company_id: int):
+
+# --- пакетні варіанти: один SQL на пачку замість SELECT + COMMIT на кожен рядок ---
+# Працюють на рівні таблиці, повз identity map: уже завантажені в сесію Client не оновлюються.
+BULK_CHUNK = 500  # параметрів в одному IN (SQLite старших версій — не більше 999)
+
+def _chunks(items, size: int = BULK_CHUNK):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def add_clients(session: Session, rows, commit: bool = True):
     """
-    Повертає всі повідомлення по компанії (за client.company_id),
-    відсортовані за часом.
+    Upsert клієнтів [{"tg_id", "name", "company_id"}] одним INSERT ... ON CONFLICT(tg_id) DO UPDATE
+    (executemany). Як і add_client: порожні name / company_id не затирають наявні значення.
     """
-    from .models import Message, Client
+    rows = [{"tg_id": str(r["tg_id"]), "name": r.get("name") or None, "name_search": search_key(r.get("name")),
+             "company_id": r.get("company_id") or None}
+            for r in rows]
+    if rows:
+        table = Client.__table__
+        stmt = sqlite_insert(table)
+        stmt = stmt.on_conflict_do_update(index_elements=["tg_id"], set_={
+            "name": func.coalesce(stmt.excluded.name, table.c.name),
+            "name_search": func.coalesce(stmt.excluded.name_search, table.c.name_search),
+            "company_id": func.coalesce(stmt.excluded.company_id, table.c.company_id),
+        })
+        session.execute(stmt, rows)
+    _finish(session, commit)
+    return len(rows)
 
-    q = (
-        session.query(Message)
-        .join(Client, Client.tg_id == Message.client_tg_id)
-        .filter(Client.company_id == company_id)
-        .order_by(Message.created_at.asc())
+def update_clients(session: Session, changes, commit: bool = True):
+    """
+    Оновлює клієнтів [{"tg_id", "name", "company_id"}] одним UPDATE (executemany); None — не змінювати.
+    Повертає кількість знайдених клієнтів.
+    """
+    params = [{"tg": str(c["tg_id"]), "new_name": c.get("name"), "new_name_search": search_key(c.get("name")),
+               "new_company_id": c.get("company_id")}
+              for c in changes]
+    updated = 0
+    if params:
+        table = Client.__table__
+        result = session.execute(
+            update(table)
+            .where(table.c.tg_id == bindparam("tg"))
+            .values(name=func.coalesce(bindparam("new_name"), table.c.name),
+                    name_search=func.coalesce(bindparam("new_name_search"), table.c.name_search),
+                    company_id=func.coalesce(bindparam("new_company_id"), table.c.company_id)),
+            params,
+        )
+        updated = result.rowcount
+    _finish(session, commit)
+    return updated
+
+def delete_clients(session: Session, tg_ids, commit: bool = True):
+    """
+    Видаляє клієнтів за tg_id (DELETE ... IN пачками). Як і delete_client через ORM, повідомлення
+    клієнта лишаються в історії з client_tg_id = NULL. Повертає кількість видалених.
+    """
+    tg_ids = sorted({str(tg) for tg in tg_ids})
+    deleted = 0
+    for chunk in _chunks(tg_ids):
+        session.execute(update(Message.__table__).where(Message.__table__.c.client_tg_id.in_(chunk))
+                        .values(client_tg_id=None))
+        deleted += session.execute(delete(Client.__table__).where(Client.__table__.c.tg_id.in_(chunk))).rowcount
+    _finish(session, commit)
+    return deleted
+
+# === СПИСКИ (keyset-пагінація) ===
+def _prefix_range(column, prefix: str):
+    """Умови "column починається з prefix" діапазоном по індексу: усі такі рядки лежать у [ "abc", "abd" )."""
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return column >= prefix, column < upper
+
+def _keyset_page(q, id_column, after_id: int = None, before_id: int = None, limit: int = 10):
+    """
+    Сторінка за id без OFFSET і COUNT: after_id — наступна (id > after_id), before_id — попередня.
+    Рядки завжди за зростанням id. Повертає (rows, has_prev, has_next) — зайвий (limit+1)-й рядок
+    лише показує, чи є що гортати далі в цьому напрямку.
+    """
+    if before_id:
+        rows = q.filter(id_column < before_id).order_by(id_column.desc()).limit(limit + 1).all()
+        has_prev = len(rows) > limit
+        rows = rows[:limit][::-1]
+        return rows, has_prev, True
+    if after_id:
+        q = q.filter(id_column > after_id)
+    rows = q.order_by(id_column).limit(limit + 1).all()
+    return rows[:limit], bool(after_id), len(rows) > limit
+
+def get_clients_page(session: Session, company_id: int = None, prefix: str = None,
+                     after_id: int = None, before_id: int = None, limit: int = 10):
+    """
+    (Client, назва компанії) сторінкою; company_id — лише працівники компанії (індекс clients.company_id),
+    prefix — ім'я починається з (без урахування регістру, індекс ix_clients_name_search).
+    """
+    q = session.query(Client, Company.name).outerjoin(Company, Company.id == Client.company_id)
+    if company_id:
+        q = q.filter(Client.company_id == company_id)
+    if prefix:
+        q = q.filter(*_prefix_range(Client.name_search, search_key(prefix)))
+    return _keyset_page(q, Client.id, after_id, before_id, limit)
+
+def get_companies_page(session: Session, prefix: str = None, after_id: int = None, before_id: int = None,
+                       limit: int = 10):
+    """Компанії сторінкою; prefix — назва починається з (без урахування регістру, ix_companies_name_search)."""
+    q = session.query(Company)
+    if prefix:
+        q = q.filter(*_prefix_range(Company.name_search, search_key(prefix)))
+    return _keyset_page(q, Company.id, after_id, before_id, limit)
+
+def count_company_clients(session: Session, company_ids):
+    """{company_id: кількість працівників} одним GROUP BY по індексу clients.company_id."""
+    if not company_ids:
+        return {}
+    return dict(
+        session.query(Client.company_id, func.count(Client.id))
+        .filter(Client.company_id.in_(list(company_ids)))
+        .group_by(Client.company_id)
+        .all()
     )
+
+# === ПОШУК (inline-запити) ===
+def search_clients(session: Session, text: str, limit: int = 20):
+    """
+    (Client, назва компанії) за початком tg_id (цифри — діапазон по унікальному індексу tg_id)
+    або імені (ix_clients_name_search). Лише префікс: '%текст%' індекс не використає.
+    """
+    q = session.query(Client, Company.name).outerjoin(Company, Company.id == Client.company_id)
+    if text.isdigit():
+        q = q.filter(*_prefix_range(Client.tg_id, text)).order_by(Client.tg_id)
+    else:
+        q = q.filter(*_prefix_range(Client.name_search, search_key(text))).order_by(Client.name_search)
+    return q.limit(limit).all()
+
+def search_companies(session: Session, text: str, limit: int = 5):
+    """Компанії за початком назви (ix_companies_name_search)."""
+    return (session.query(Company)
+            .filter(*_prefix_range(Company.name_search, search_key(text)))
+            .order_by(Company.name_search).limit(limit).all())
+
+def get_open_requests(session: Session, client_tg_ids):
+    """{tg_id клієнта: id найновішого необробленого запиту} одним GROUP BY (ix_messages_client_created)."""
+    if not client_tg_ids:
+        return {}
+    # coalesce замість IS NULL: інакше для довгого IN планувальник обирає ix_messages_burst_head_id
+    # і перебирає всі "перші" повідомлення бази
+    return dict(
+        session.query(Message.client_tg_id, func.max(Message.id))
+        .filter(Message.client_tg_id.in_(list(client_tg_ids)),
+                Message.direction == "in", func.coalesce(Message.burst_head_id, 0) == 0,
+                ~exists().where(Claim.message_id == Message.id))
+        .group_by(Message.client_tg_id)
+        .all()
+    )
+
+# === HISTORY ===
+HISTORY_RANGES = {
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+}
+
+def history_range_bounds(token: str, now: datetime = None):
+    """
+    Перетворює токен діапазону на (since, until):
+    "24h" / "7d" / "30d" — відносно зараз, "all" — без меж,
+    "YYYYMMDD-YYYYMMDD" — власний діапазон (кінцевий день включно).
+    """
+    now = now or datetime.utcnow()
+    if not token or token == "all":
+        return None, None
+    if token in HISTORY_RANGES:
+        return now - HISTORY_RANGES[token], None
+    start, _, end = token.partition("-")
+    since = datetime.strptime(start, "%Y%m%d")
+    until = datetime.strptime(end or start, "%Y%m%d") + timedelta(days=1)
+    return since, until
+
+def _history_query(session: Session, column, value, since=None, until=None):
+    q = session.query(Message).filter(column == value)
+    if since is not None:
+        q = q.filter(Message.created_at >= since)
+    if until is not None:
+        q = q.filter(Message.created_at < until)
+    return q
+
+def _ordered(q, newest_first: bool, limit: int = None, offset: int = 0):
+    order = Message.created_at.desc() if newest_first else Message.created_at.asc()
+    q = q.order_by(order, Message.id.desc() if newest_first else Message.id.asc())
+    if offset:
+        q = q.offset(offset)
+    if limit is not None:
+        q = q.limit(limit)
     return q.all()
 
-def save_outgoing_message(session: Session, client_tg_id, admin_tg_id, text=None, file_path=None, file_type=None, company_snapshot=None):
+def get_company_history(session: Session, company_id: int, since: datetime = None, until: datetime = None,
+                        newest_first: bool = False, limit: int = None, offset: int = 0):
+    """
+    Повертає повідомлення по компанії (за messages.company_id, зафіксованим при записі),
+    відсортовані за часом. since/until (until не включно), напрямок і limit/offset
+    виконуються в SQL по індексу (company_id, created_at).
+    """
+    q = _history_query(session, Message.company_id, company_id, since, until)
+    return _ordered(q, newest_first, limit, offset)
+
+def count_company_history(session: Session, company_id: int, since: datetime = None, until: datetime = None):
+    return _history_query(session, Message.company_id, company_id, since, until).count()
+
+def get_client_history(session: Session, client_tg_id: str, since: datetime = None, until: datetime = None,
+                       newest_first: bool = False, limit: int = None, offset: int = 0):
+    """Те саме для одного клієнта (індекс (client_tg_id, created_at))."""
+    q = _history_query(session, Message.client_tg_id, str(client_tg_id), since, until)
+    return _ordered(q, newest_first, limit, offset)
+
+def get_unprocessed_messages(session: Session, limit: int = 100):
+    """Вхідні повідомлення без пов'язаного claim, від старіших до новіших (серії — лише першим повідомленням)."""
+    q = session.query(Message).filter(Message.direction == "in", Message.burst_head_id.is_(None))
+    q = q.filter(~exists().where(Claim.message_id == Message.id))
+    return q.order_by(Message.created_at.asc()).limit(limit).all()
+
+def get_burst_texts(session: Session, head_ids):
+    """{id першого повідомлення серії: [тексти наступних, по порядку]} — одним запитом для всіх серій."""
+    texts = {}
+    if not head_ids:
+        return texts
+    rows = (session.query(Message.burst_head_id, Message.text)
+            .filter(Message.burst_head_id.in_(list(head_ids)))
+            .order_by(Message.id).all())
+    for head_id, text in rows:
+        texts.setdefault(head_id, []).append(text or "")
+    return texts
+
+def burst_text(message: Message, texts: dict):
+    """Текст повідомлення разом з рештою його серії."""
+    return "\n".join([message.text or ""] + texts.get(message.id, [])).strip() or None
+
+def get_broadcast_audience(session: Session, retry_unreachable_days: int = None, company_ids=None,
+                           active_days: int = None, reachable_only: bool = True, after_id: int = None):
+    """
+    Запит (tg_id, company_id, id) клієнтів для розсилки, впорядкований за id (для потокового читання;
+    after_id — продовжити з місця, де розсилка зупинилась).
+    company_ids — лише ці компанії (індекс clients.company_id); active_days — лише ті, хто писав
+    за останні N днів (індекс messages (client_tg_id, created_at)). Недоступні (unreachable_at)
+    пропускаються; якщо задано retry_unreachable_days — позначені раніше за стільки днів пробуються знову.
+    """
+    q = session.query(Client.tg_id, Client.company_id, Client.id)
+    if after_id:
+        q = q.filter(Client.id > after_id)
+    if company_ids:
+        q = q.filter(Client.company_id.in_(list(company_ids)))
+    if active_days:
+        since = datetime.utcnow() - timedelta(days=active_days)
+        q = q.filter(exists().where(
+            Message.client_tg_id == Client.tg_id,
+            Message.created_at >= since,
+            Message.direction == "in",
+        ))
+    if reachable_only:
+        if retry_unreachable_days:
+            cutoff = datetime.utcnow() - timedelta(days=retry_unreachable_days)
+            q = q.filter(or_(Client.unreachable_at.is_(None), Client.unreachable_at < cutoff))
+        else:
+            q = q.filter(Client.unreachable_at.is_(None))
+    return q.order_by(Client.id)
+
+def mark_clients_unreachable(session: Session, reasons: dict, at: datetime = None, commit: bool = True):
+    """Позначає клієнтів {tg_id: причина} недоступними одним UPDATE (executemany)."""
+    if not reasons:
+        return 0
+    at = at or datetime.utcnow()
+    session.execute(
+        update(Client.__table__)
+        .where(Client.__table__.c.tg_id == bindparam("tg"))
+        .values(unreachable_at=at, unreachable_reason=bindparam("reason")),
+        [{"tg": str(tg), "reason": reason[:200]} for tg, reason in reasons.items()],
+    )
+    _finish(session, commit)
+    return len(reasons)
+
+def get_unreachable_report(session: Session, since: datetime = None):
+    """Кількість недоступних клієнтів: усього, нових з since і за причинами."""
+    total = session.query(func.count(Client.id)).filter(Client.unreachable_at.isnot(None)).scalar()
+    new = 0
+    if since is not None:
+        new = session.query(func.count(Client.id)).filter(Client.unreachable_at >= since).scalar()
+    reasons = (session.query(Client.unreachable_reason, func.count(Client.id))
+               .filter(Client.unreachable_at.isnot(None))
+               .group_by(Client.unreachable_reason)
+               .order_by(func.count(Client.id).desc()).all())
+    return {"total": total, "new": new, "reasons": reasons}
+
+def extract_media(message):
+    """(file_id, file_type) вкладення повідомлення Telegram або (None, None)."""
+    if message.photo:
+        return message.photo[-1].file_id, "photo"
+    if message.document:
+        return message.document.file_id, "document"
+    if message.video:
+        return message.video.file_id, "video"
+    if message.voice:
+        return message.voice.file_id, "voice"
+    if message.audio:
+        return message.audio.file_id, "audio"
+    return None, None
+
+def inbound_seen(session: Session, chat_id, message_id) -> bool:
+    """Апдейт з цим повідомленням уже оброблено (повторна доставка після рестарту / ретраю)."""
+    return session.query(exists().where(
+        Message.source_chat_id == str(chat_id), Message.source_message_id == message_id,
+    )).scalar()
+
+
+def save_incoming_message(session: Session, source_chat_id, source_message_id, **values):
+    """
+    INSERT ... ON CONFLICT DO NOTHING за (source_chat_id, source_message_id), без commit.
+    -> id нового Message або None, якщо таке повідомлення вже збережене (дубль апдейту).
+    """
+    stmt = (
+        sqlite_insert(Message.__table__)
+        .values(direction='in', source_chat_id=str(source_chat_id), source_message_id=source_message_id, **values)
+        .on_conflict_do_nothing(index_elements=["source_chat_id", "source_message_id"])
+        .returning(Message.__table__.c.id)
+    )
+    row = session.execute(stmt).first()
+    return row[0] if row else None
+
+
+def save_outgoing_message(session: Session, client_tg_id, admin_tg_id, text=None, file_path=None, file_type=None, company_snapshot=None, company_id=None,
+                          commit: bool = True):
     m = Message(client_tg_id=str(client_tg_id), admin_tg_id=str(admin_tg_id), direction='out',
-                text=text, file_path=file_path, file_type=file_type, company_snapshot=company_snapshot)
+                text=text, file_path=file_path, file_type=file_type, company_snapshot=company_snapshot,
+                company_id=company_id)
     session.add(m)
-    session.commit()
+    _finish(session, commit)
     return m
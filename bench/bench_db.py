@@ -0,0 +1,158 @@
+"""
+Бенчмарк гарячих шляхів БД на синтетичних даних.
+
+Наповнює окрему SQLite-базу (bench/seed.py) і міряє p50/p95 та кількість SQL-запитів
+для: get_company_history (весь час / 7 днів), сторінки історії компанії,
+необроблених повідомлень, запиту /history_client, списку компаній (list_companies_menu)
+та пошуку клієнта за tg_id.
+
+    python -m bench.bench_db --companies 200 --clients 10 --messages 50 --iterations 30
+    python -m bench.bench_db --db /tmp/bench.db --reuse --json before.json
+
+--json зберігає результат, щоб порівнювати коміти між собою.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+
+from bench.seed import add_seed_arguments, seed_from_args
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    idx = min(int(round(pct * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[idx]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def build_operations(counts):
+    """(назва, функція(session, rnd), кількість ітерацій-множник) — імпорт app лише після DB_PATH."""
+    from app.models import Client, Company
+    from app.utils import get_company_history, get_client_history, get_unprocessed_messages
+    from app.pagination.view_history import render_history_page
+    from app.pagination.listings import render_clients_page, render_companies_page
+
+    def company_id(rnd):
+        return rnd.randint(1, counts["companies"])
+
+    def client_tg(rnd):
+        return str(100000000 + rnd.randrange(counts["clients"]))
+
+    def history_page(page):
+        def run(session, rnd):
+            company = session.get(Company, company_id(rnd))
+            return render_history_page(session, company, page, "all")
+        return run
+
+    week_ago = datetime.utcnow() - timedelta(days=7)
+    return [
+        ("client_lookup", lambda s, r: s.query(Client).filter_by(tg_id=client_tg(r)).first(), 1.0),
+        ("company_history_all", lambda s, r: get_company_history(s, company_id(r)), 1.0),
+        ("company_history_7d", lambda s, r: get_company_history(s, company_id(r), since=week_ago), 1.0),
+        ("history_page_first", history_page(0), 1.0),
+        ("history_page_deep", history_page(20), 1.0),
+        ("unprocessed_messages", lambda s, r: get_unprocessed_messages(s, limit=100), 0.1),
+        ("history_client_cmd", lambda s, r: get_client_history(s, client_tg(r), newest_first=True, limit=50), 1.0),
+        ("list_companies_page", lambda s, r: render_companies_page(s), 1.0),
+        ("list_clients_page", lambda s, r: render_clients_page(s, after_id=r.randrange(counts["clients"])), 1.0),
+        ("list_clients_prefix", lambda s, r: render_clients_page(s, prefix="client 0001"), 1.0),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="/tmp/support_bot_bench.db")
+    parser.add_argument("--reuse", action="store_true", help="не перестворювати базу, якщо вона існує")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--only", help="кома-список операцій")
+    parser.add_argument("--json", help="зберегти результати у файл")
+    add_seed_arguments(parser)
+    args = parser.parse_args()
+
+    fresh = not (args.reuse and os.path.exists(args.db))
+    if fresh and os.path.exists(args.db):
+        os.remove(args.db)
+    # app.db читає DB_PATH під час імпорту
+    os.environ["DB_PATH"] = args.db
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("METRICS_PORT", "0")
+
+    from sqlalchemy import event, func
+    from app.db import engine, SessionLocal
+    from app.models import Company, Client, Message, Claim
+
+    if fresh:
+        start = time.perf_counter()
+        seed_from_args(engine, args)
+        print(f"seeded {args.db} in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    session = SessionLocal()
+    counts = {
+        "companies": session.query(func.count(Company.id)).scalar(),
+        "clients": session.query(func.count(Client.id)).scalar(),
+        "messages": session.query(func.count(Message.id)).scalar(),
+        "claims": session.query(func.count(Claim.id)).scalar(),
+    }
+    session.close()
+
+    from app.utils import init_db
+    init_db()  # міграції та індекси — як при старті ботів
+    operations = build_operations(counts)
+    if args.only:
+        wanted = set(args.only.split(","))
+        operations = [op for op in operations if op[0] in wanted]
+
+    query_count = [0]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _count(*_):
+        query_count[0] += 1
+
+    rnd = random.Random(args.seed)
+    results = {}
+    for name, fn, weight in operations:
+        iterations = max(int(args.iterations * weight), 3)
+        timings, queries = [], 0
+        for _ in range(iterations):
+            session = SessionLocal()
+            before = query_count[0]
+            start = time.perf_counter()
+            try:
+                fn(session, rnd)
+            finally:
+                timings.append((time.perf_counter() - start) * 1000)
+                queries += query_count[0] - before
+                session.close()
+        results[name] = {
+            "iterations": iterations,
+            "p50_ms": round(_percentile(timings, 0.50), 3),
+            "p95_ms": round(_percentile(timings, 0.95), 3),
+            "queries_per_call": round(queries / iterations, 2),
+        }
+
+    print(f"dataset: {counts}")
+    print(f"{'operation':<24}{'iters':>7}{'p50 ms':>11}{'p95 ms':>11}{'queries':>9}")
+    for name, r in results.items():
+        print(f"{name:<24}{r['iterations']:>7}{r['p50_ms']:>11.2f}{r['p95_ms']:>11.2f}{r['queries_per_call']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"revision": _git_revision(), "dataset": counts, "results": results}, f, indent=2)
+        print(f"saved {args.json}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Мікробенчмарк: вартість одного виклику трасування.
+
+Порівнює старий log_tracepoint (inspect.stack()) з app.tracing.Tracer
+у режимах: увімкнено, семплювання 10%, вимкнено.
+Виклик робиться з глибини стеку, схожої на реальну (хендлер PTB під asyncio).
+
+    python -m bench.bench_tracing [--calls 2000] [--depth 25]
+"""
+import argparse
+import inspect
+import logging
+import time
+from types import SimpleNamespace
+
+from app.tracing import Tracer
+
+legacy_logger = logging.getLogger("bench.legacy_trace")
+
+
+def legacy_log_tracepoint(tag, context=None):
+    """Копія попередньої реалізації з admin_bot.py."""
+    frame = inspect.stack()[1]
+    legacy_logger.info(
+        f"[TRACE] {tag} | caller={frame.function} | "
+        f"broadcast_active={context.user_data.get('broadcast_active')} | "
+        f"replying_claim_id={context.user_data.get('replying_claim_id')} | "
+        f"reply_mode_active={context.user_data.get('reply_mode_active')} | "
+        f"has_broadcast={bool(context.user_data.get('broadcast'))}"
+    )
+
+
+def _at_depth(depth, fn):
+    if depth <= 0:
+        return fn()
+    return _at_depth(depth - 1, fn)
+
+
+def measure(trace_fn, context, calls, depth):
+    def run():
+        start = time.perf_counter()
+        for _ in range(calls):
+            trace_fn("BENCH", context)
+        return time.perf_counter() - start
+
+    elapsed = _at_depth(depth, run)
+    return elapsed / calls * 1e6  # мкс на виклик
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--depth", type=int, default=25, help="глибина стеку в точці виклику")
+    args = parser.parse_args()
+
+    # логи йдуть у NullHandler: міряємо вартість трасування, а не I/O
+    for name in ("bench.legacy_trace", "app.trace"):
+        log = logging.getLogger(name)
+        log.handlers[:] = [logging.NullHandler()]
+        log.setLevel(logging.INFO)
+        log.propagate = False
+
+    context = SimpleNamespace(user_data={
+        "broadcast_active": True,
+        "broadcast": {"text": "x" * 200, "file_id": "AgAC" * 10, "file_type": "photo", "media_path": None},
+    })
+
+    rows = [
+        ("legacy inspect.stack()", legacy_log_tracepoint),
+        ("Tracer enabled", Tracer(sample_rate=1.0).trace),
+        ("Tracer sample_rate=0.1", Tracer(sample_rate=0.1).trace),
+        ("Tracer disabled", Tracer(sample_rate=0.0).trace),
+    ]
+    results = [(name, measure(fn, context, args.calls, args.depth)) for name, fn in rows]
+    baseline = results[0][1]
+
+    print(f"calls={args.calls} depth={args.depth}")
+    print(f"{'variant':<26}{'µs/call':>12}{'speedup':>10}")
+    for name, us in results:
+        print(f"{name:<26}{us:>12.2f}{baseline / us:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
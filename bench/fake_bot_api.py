@@ -0,0 +1,466 @@
+"""
+Локальна заглушка Telegram Bot API для навантажувального тестування без реальних токенів.
+
+Реалізує підмножину методів, якими користуються боти: getMe, getUpdates (long polling),
+sendMessage, sendPhoto/Document/Video/Voice/Audio, getFile + завантаження файлу,
+editMessageReplyMarkup/editMessageText, answerCallbackQuery, setMyCommands, deleteWebhook.
+Кожен токен — окремий бот зі своєю чергою апдейтів.
+
+Налаштовується затримка відповіді (latency + випадковий jitter) та частка відповідей
+429 з retry_after для методів відправки. Боти направляються сюди через
+TELEGRAM_API_BASE_URL / TELEGRAM_FILE_BASE_URL (див. app/bots.py).
+
+    python -m bench.fake_bot_api --port 8081 --latency 0.05 --rate-429 0.01
+
+Апдейти можна підкидати ззовні: POST /_fake/<token>/update з JSON апдейту (без update_id),
+статистика викликів — GET /_fake/stats. У тестах зручніше використовувати FakeBotAPI напряму
+(див. bench/load_test.py).
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import email.parser
+import email.policy
+from collections import Counter, defaultdict, namedtuple
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# параметри, які PTB передає JSON-рядком
+JSON_PARAMS = {"reply_markup", "entities", "caption_entities", "allowed_updates", "media", "commands",
+               "link_preview_options", "reply_parameters", "results"}
+
+# методи, для яких вмикається штучна затримка та 429
+THROTTLED_PREFIXES = ("send", "edit", "answerCallbackQuery", "getFile", "copyMessage", "forwardMessage")
+
+MEDIA_METHODS = {
+    "sendPhoto": "photo",
+    "sendDocument": "document",
+    "sendVideo": "video",
+    "sendVoice": "voice",
+    "sendAudio": "audio",
+}
+
+ApiCall = namedtuple("ApiCall", "token method params result ts")
+
+
+def _bot_id(token: str) -> int:
+    head = token.split(":", 1)[0]
+    return int(head) if head.isdigit() else int(hashlib.md5(token.encode()).hexdigest()[:8], 16)
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# === ПОБУДОВА АПДЕЙТІВ ===
+def _user(user_id: int, first_name: str = None) -> dict:
+    return {"id": int(user_id), "is_bot": False, "first_name": first_name or f"User {user_id}"}
+
+
+def _chat(chat_id: int, first_name: str = None) -> dict:
+    return {"id": int(chat_id), "type": "private", "first_name": first_name or f"User {chat_id}"}
+
+
+def user_message(user_id: int, text: str = None, photo: bool = False, message_id: int = None,
+                 first_name: str = None, media_group_id: str = None) -> dict:
+    """Апдейт з повідомленням користувача в приватному чаті (текст або фото з підписом, частина альбому)."""
+    message = {
+        "message_id": message_id or random.randint(1, 2 ** 31),
+        "date": int(time.time()),
+        "chat": _chat(user_id, first_name),
+        "from": _user(user_id, first_name),
+    }
+    if photo:
+        file_id = f"in-photo-{user_id}-{message['message_id']}"
+        message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+        if text:
+            message["caption"] = text
+        if media_group_id:
+            message["media_group_id"] = media_group_id
+    else:
+        message["text"] = text or ""
+        if message["text"].startswith("/"):
+            command = message["text"].split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"message": message}
+
+
+def callback_query(user_id: int, data: str, message: dict = None) -> dict:
+    """
+    Апдейт натискання inline-кнопки під повідомленням `message` (результат send* заглушки);
+    без message — кнопка під повідомленням, надісланим через inline-режим (лише inline_message_id).
+    """
+    query = {
+        "id": str(random.randint(1, 2 ** 62)),
+        "from": _user(user_id),
+        "chat_instance": str(user_id),
+        "data": data,
+    }
+    if message is None:
+        query["inline_message_id"] = f"inline-{random.randint(1, 2 ** 31)}"
+    else:
+        query["message"] = message
+    return {"callback_query": query}
+
+
+def inline_query(user_id: int, query: str, offset: str = "") -> dict:
+    """Апдейт inline-запиту "@bot <query>"."""
+    return {"inline_query": {
+        "id": str(random.randint(1, 2 ** 62)),
+        "from": _user(user_id),
+        "query": query,
+        "offset": offset,
+    }}
+
+
+# === СЕРВЕР ===
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 rate_429: float = 0.0, retry_after: int = 1, file_size: int = 4096, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.file_size = file_size
+        self.calls = Counter()
+        self.throttled = Counter()
+
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._updates = defaultdict(list)          # token -> [update, ...]
+        self._update_seq = defaultdict(int)        # token -> останній update_id
+        self._cond = threading.Condition(self._lock)
+        self._message_seq = 0
+        self._polling = set()
+        self._listeners = []
+        self.blocked = set()                       # chat_id, що "заблокували" бота (403 на send*)
+
+        self.server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self.server.daemon_threads = True
+        self._thread = None
+
+    # --- адреси для ботів ---
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.address}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"{self.address}/file/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-bot-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._cond:
+            self._cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    # --- керування з тесту ---
+    def push_update(self, token: str, update: dict) -> int:
+        """Ставить апдейт у чергу бота; повертає присвоєний update_id."""
+        with self._cond:
+            self._update_seq[token] += 1
+            update = dict(update, update_id=self._update_seq[token])
+            self._updates[token].append(update)
+            self._cond.notify_all()
+        return update["update_id"]
+
+    def block(self, *chat_ids):
+        """Імітує користувачів, що заблокували бота: send* до них отримують 403 Forbidden."""
+        self.blocked.update(int(c) for c in chat_ids)
+
+    def add_listener(self, callback):
+        """callback(ApiCall) викликається в потоці сервера після кожного успішного методу."""
+        self._listeners.append(callback)
+
+    def is_polling(self, token: str) -> bool:
+        return token in self._polling
+
+    def wait_polling(self, tokens, timeout: float = 30.0) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(self.is_polling(t) for t in tokens):
+                return True
+            time.sleep(0.05)
+        return False
+
+    def stats(self) -> dict:
+        return {"calls": dict(self.calls), "throttled_429": dict(self.throttled)}
+
+    # --- обробка методів ---
+    def call(self, token: str, method: str, params: dict):
+        """Повертає (http_code, payload) для методу Bot API."""
+        with self._lock:
+            self.calls[method] += 1
+
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": self._get_updates(token, params)}
+
+        if method.startswith(THROTTLED_PREFIXES):
+            delay = self.latency + (self._rnd.uniform(0, self.jitter) if self.jitter else 0)
+            if delay:
+                time.sleep(delay)
+            if self.rate_429 and self._rnd.random() < self.rate_429:
+                with self._lock:
+                    self.throttled[method] += 1
+                return 429, {
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+
+        if method.startswith("send") and self.blocked and _int_or_none(params.get("chat_id")) in self.blocked:
+            return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+
+        handler = getattr(self, f"_m_{method}", None)
+        if handler is None:
+            if method in MEDIA_METHODS:
+                result = self._send(token, params, MEDIA_METHODS[method])
+            elif method in ("answerCallbackQuery", "answerInlineQuery", "setMyCommands", "deleteMyCommands", "deleteWebhook",
+                            "sendChatAction", "deleteMessage", "close", "logOut"):
+                result = True
+            else:
+                return 404, {"ok": False, "error_code": 404, "description": f"Not Found: {method} не реалізовано"}
+        else:
+            result = handler(token, params)
+
+        for listener in self._listeners:
+            listener(ApiCall(token, method, params, result, time.monotonic()))
+        return 200, {"ok": True, "result": result}
+
+    def _get_updates(self, token, params):
+        self._polling.add(token)
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        with self._cond:
+            queue = self._updates[token]
+            if offset:
+                queue[:] = [u for u in queue if u["update_id"] >= offset]
+            if not queue and timeout:
+                self._cond.wait_for(lambda: self._updates[token], timeout=timeout)
+                queue = self._updates[token]
+            return queue[:limit]
+
+    def _next_message_id(self):
+        with self._lock:
+            self._message_seq += 1
+            return self._message_seq
+
+    def _bot_user(self, token):
+        bot_id = _bot_id(token)
+        return {"id": bot_id, "is_bot": True, "first_name": "Fake Bot", "username": f"fake_{bot_id}_bot"}
+
+    def _send(self, token, params, media_type=None):
+        message_id = self._next_message_id()
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": _chat(params.get("chat_id", 0)),
+            "from": self._bot_user(token),
+        }
+        if media_type:
+            file_id = f"{media_type}-{message_id}"
+            media = {"file_id": file_id, "file_unique_id": file_id}
+            if media_type in ("photo", "video"):
+                media.update(width=640, height=480)
+            if media_type in ("video", "voice", "audio"):
+                media["duration"] = 1
+            message[media_type] = [media] if media_type == "photo" else media
+            if params.get("caption"):
+                message["caption"] = params["caption"]
+        else:
+            message["text"] = params.get("text", "")
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    def _m_getMe(self, token, params):
+        return self._bot_user(token)
+
+    def _m_sendMessage(self, token, params):
+        return self._send(token, params)
+
+    def _m_sendMediaGroup(self, token, params):
+        # media — JSON-список InputMedia*; кожна частина альбому стає окремим повідомленням
+        group_id = str(self._next_message_id())
+        messages = []
+        for item in params.get("media") or []:
+            message = self._send(token, {"chat_id": params.get("chat_id"), "caption": item.get("caption")},
+                                 item.get("type", "photo"))
+            message["media_group_id"] = group_id
+            messages.append(message)
+        return messages
+
+    def _m_editMessageText(self, token, params):
+        if params.get("inline_message_id"):
+            return True
+        message = self._send(token, params)
+        message["message_id"] = int(params.get("message_id") or 0)
+        message["edit_date"] = message["date"]
+        return message
+
+    def _m_editMessageCaption(self, token, params):
+        if params.get("inline_message_id"):
+            return True
+        message = self._send(token, params, "photo")
+        message["message_id"] = int(params.get("message_id") or 0)
+        message["edit_date"] = message["date"]
+        return message
+
+    def _m_editMessageReplyMarkup(self, token, params):
+        if params.get("inline_message_id"):
+            return True
+        message = {
+            "message_id": int(params.get("message_id") or 0),
+            "date": int(time.time()),
+            "edit_date": int(time.time()),
+            "chat": _chat(params.get("chat_id", 0)),
+            "from": self._bot_user(token),
+            "text": "",
+        }
+        if params.get("reply_markup"):
+            message["reply_markup"] = params["reply_markup"]
+        return message
+
+    def _m_getFile(self, token, params):
+        file_id = params.get("file_id", "")
+        return {"file_id": file_id, "file_unique_id": file_id, "file_size": self.file_size,
+                "file_path": f"files/{file_id}"}
+
+    def file_content(self, file_path: str) -> bytes:
+        pattern = hashlib.sha256(file_path.encode()).digest()
+        return (pattern * (self.file_size // len(pattern) + 1))[:self.file_size]
+
+
+# === HTTP ===
+def _decode_params(raw: dict) -> dict:
+    params = {}
+    for name, value in raw.items():
+        if name in JSON_PARAMS or name == "chat_id":
+            try:
+                value = json.loads(value)
+            except (TypeError, ValueError):
+                pass
+        params[name] = value
+    return params
+
+
+def _parse_body(content_type: str, body: bytes) -> dict:
+    if not body:
+        return {}
+    if content_type.startswith("multipart/form-data"):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        fields, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            if part.get_filename():
+                files[name] = {"filename": part.get_filename(), "size": len(payload)}
+            else:
+                fields[name] = payload.decode("utf-8")
+        params = _decode_params(fields)
+        params.update(files)
+        return params
+    if content_type.startswith("application/json"):
+        return json.loads(body)
+    return _decode_params({k: v[-1] for k, v in parse_qs(body.decode("utf-8"), keep_blank_values=True).items()})
+
+
+def _make_handler(api: FakeBotAPI):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, code: int, body: bytes, content_type: str = "application/json"):
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _json(self, code: int, payload):
+            self._reply(code, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+        def _route(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+            path, _, query = self.path.partition("?")
+            parts = path.strip("/").split("/")
+
+            # /file/bot<token>/<file_path>
+            if len(parts) >= 3 and parts[0] == "file" and parts[1].startswith("bot"):
+                time.sleep(api.latency)
+                with api._lock:
+                    api.calls["file_download"] += 1
+                self._reply(200, api.file_content("/".join(parts[2:])), "application/octet-stream")
+                return
+
+            # /_fake/<token>/update, /_fake/stats
+            if parts[0] == "_fake":
+                if parts[-1] == "stats":
+                    self._json(200, api.stats())
+                elif len(parts) == 3 and parts[2] == "update":
+                    self._json(200, {"update_id": api.push_update(parts[1], json.loads(body))})
+                else:
+                    self._json(404, {"ok": False, "description": "Not Found"})
+                return
+
+            # /bot<token>/<method>
+            if len(parts) != 2 or not parts[0].startswith("bot"):
+                self._json(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                return
+            params = _parse_body(self.headers.get("Content-Type", ""), body)
+            if query:
+                params.update(_decode_params({k: v[-1] for k, v in parse_qs(query).items()}))
+            code, payload = api.call(parts[0][3:], parts[1], params)
+            self._json(code, payload)
+
+        do_GET = _route
+        do_POST = _route
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="затримка методів відправки, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="додатковий випадковий jitter, с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="частка відповідей 429 (0..1)")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                     rate_429=args.rate_429, retry_after=args.retry_after)
+    print(f"TELEGRAM_API_BASE_URL={api.base_url}\nTELEGRAM_FILE_BASE_URL={api.base_file_url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(api.stats(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
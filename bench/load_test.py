@@ -0,0 +1,368 @@
+"""
+Наскрізне навантажувальне тестування обох ботів проти локальної заглушки Bot API.
+
+Піднімає bench/fake_bot_api.py, наповнює окрему SQLite-базу (bench/seed.py) і запускає
+client- та admin-бота окремими процесами (entrypoint.py) з TELEGRAM_API_BASE_URL на заглушку.
+Далі N клієнтів пишуть у клієнтського бота із заданою сумарною швидкістю, а M адмінів
+беруть частину запитів у роботу (кнопка "💬 Відповісти") і відповідають на них.
+
+Міряються (від моменту, коли апдейт став доступний у getUpdates):
+  ack     — клієнт отримав "✅ Ваше повідомлення надіслано менеджерам";
+  notify  — сповіщення отримали всі M адмінів;
+  claim   — від натискання "Відповісти" до "🟢 Ви взяли запит";
+  reply   — від відповіді адміна до доставки клієнту "💬 Відповідь від менеджера".
+
+    python -m bench.load_test --clients 50 --admins 5 --messages 4 --rate 20
+    python -m bench.load_test --latency 0.05 --jitter 0.05 --rate-429 0.02 --json after.json
+
+--media-ratio > 0 надсилає фото: клієнтський бот зберігає їх у сховищі медіа (MEDIA_DIR у тимчасовому каталозі).
+--album-ratio > 0 надсилає частину повідомлень альбомами з --album-size фото (одне звернення,
+одне "✅"; клієнтський бот чекає ALBUM_WINDOW після останньої частини).
+Після прогону беклог у response_stats звіряється з невзятими запитами в базі (errors.backlog_mismatch).
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+from collections import Counter, defaultdict, deque
+
+from sqlalchemy import create_engine, text
+
+from bench.bench_db import _percentile, _git_revision
+from bench.fake_bot_api import FakeBotAPI, user_message, callback_query
+from bench.seed import seed_database
+
+ROOT = Path(__file__).resolve().parent.parent
+CLIENT_TOKEN = "100001:fake-client-token"
+ADMIN_TOKEN = "100002:fake-admin-token"
+
+MARKER_RE = re.compile(r"load (\d+-\d+)")
+REPLY_RE = re.compile(r"reply (\d+-\d+)")
+
+
+class LoadDriver:
+    """Стежить за викликами Bot API і відіграє поведінку адмінів (claim -> відповідь)."""
+
+    def __init__(self, api: FakeBotAPI, admins: list, claim_ratio: float, seed: int = 42):
+        self.api = api
+        self.admins = admins
+        self.claim_ratio = claim_ratio
+        self.rnd = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.sent_at = {}                       # marker -> час появи апдейту
+        self.pending_ack = defaultdict(deque)   # chat_id клієнта -> маркери в порядку відправки
+        self.claimers = {}                      # marker -> tg_id адміна, який його візьме
+        self.notified = defaultdict(dict)       # marker -> {admin: час сповіщення}
+        self.admin_queue = defaultdict(deque)   # адмін -> [(marker, notification message)]
+        self.admin_current = {}                 # адмін -> marker у роботі
+        self.claim_started, self.reply_started = {}, {}
+        self.latencies = defaultdict(list)      # етап -> [секунди]
+        self.last_at = {}                       # етап -> час останньої події
+        self.done = Counter()
+        self.errors = Counter()
+
+        api.add_listener(self.on_call)
+
+    # --- дії ---
+    def send_client_message(self, client_tg: int, marker: str, photo: bool = False, album: int = 0):
+        claimer = self.rnd.choice(self.admins) if self.rnd.random() < self.claim_ratio else None
+        with self.lock:
+            self.sent_at[marker] = time.monotonic()
+            self.pending_ack[client_tg].append(marker)
+            if claimer is not None:
+                self.claimers[marker] = claimer
+        if album > 1:
+            group_id = f"album-{marker}"
+            for i in range(album):
+                self.api.push_update(CLIENT_TOKEN, user_message(
+                    client_tg, f"load {marker}" if i == 0 else None, photo=True, media_group_id=group_id
+                ))
+        else:
+            self.api.push_update(CLIENT_TOKEN, user_message(client_tg, f"load {marker}", photo=photo))
+
+    def _start_claim(self, admin_tg: int, marker: str, notification: dict):
+        """Викликається під self.lock."""
+        self.admin_current[admin_tg] = marker
+        self.claim_started[marker] = time.monotonic()
+        data = notification["reply_markup"]["inline_keyboard"][0][0]["callback_data"]
+        self.api.push_update(ADMIN_TOKEN, callback_query(admin_tg, data, notification))
+
+    def _finish_admin_task(self, admin_tg: int):
+        """Адмін звільнився — беремо наступний запит з його черги. Викликається під self.lock."""
+        self.admin_current.pop(admin_tg, None)
+        if self.admin_queue[admin_tg]:
+            self._start_claim(admin_tg, *self.admin_queue[admin_tg].popleft())
+
+    # --- спостереження за Bot API ---
+    def on_call(self, call):
+        if not call.method.startswith(("send", "edit")) or not isinstance(call.result, dict):
+            return
+        text = call.params.get("text") or call.params.get("caption") or ""
+        try:
+            chat_id = int(call.params.get("chat_id"))
+        except (TypeError, ValueError):
+            return
+
+        with self.lock:
+            if call.token == CLIENT_TOKEN:
+                self._on_client_bot(call, chat_id, text)
+            elif call.token == ADMIN_TOKEN:
+                self._on_admin_bot(call, chat_id, text)
+
+    def _on_client_bot(self, call, chat_id, text):
+        if text.startswith("✅ Ваше повідомлення"):
+            if self.pending_ack[chat_id]:
+                marker = self.pending_ack[chat_id].popleft()
+                self.latencies["ack"].append(call.ts - self.sent_at[marker])
+                self.done["ack"] += 1
+                self.last_at["ack"] = call.ts
+        elif "Відповідь від менеджера" in text:
+            match = REPLY_RE.search(text)
+            if match and match.group(1) in self.reply_started:
+                self.latencies["reply"].append(call.ts - self.reply_started.pop(match.group(1)))
+                self.done["reply"] += 1
+        elif "не зареєстровані" in text:
+            self.errors["client_not_registered"] += 1
+
+    def _on_admin_bot(self, call, chat_id, text):
+        if call.method.startswith("edit"):
+            self._on_burst_edit(call, chat_id, text)
+            return
+        match = MARKER_RE.search(text)
+        if match and call.params.get("reply_markup"):
+            marker = match.group(1)
+            times = self.notified[marker]
+            if chat_id in times:
+                return
+            times[chat_id] = call.ts
+            if len(times) == len(self.admins):
+                self.latencies["notify"].append(call.ts - self.sent_at[marker])
+                self.done["notify"] += 1
+            if self.claimers.get(marker) == chat_id:
+                if chat_id in self.admin_current:
+                    self.admin_queue[chat_id].append((marker, call.result))
+                else:
+                    self._start_claim(chat_id, marker, call.result)
+        elif text.startswith("🟢 Ви взяли запит") and chat_id in self.admin_current:
+            marker = self.admin_current[chat_id]
+            self.latencies["claim"].append(call.ts - self.claim_started.pop(marker))
+            self.done["claim"] += 1
+            self.reply_started[marker] = time.monotonic()
+            self.api.push_update(ADMIN_TOKEN, user_message(chat_id, f"reply {marker}"))
+        elif text.startswith("✅ Відповідь надіслана") and chat_id in self.admin_current:
+            self._finish_admin_task(chat_id)
+        elif text.startswith(("⚠️", "❌")) and chat_id in self.admin_current:
+            self.errors["admin_error"] += 1
+            self._finish_admin_task(chat_id)
+
+    def _on_burst_edit(self, call, chat_id, text):
+        # повідомлення серії (BURST_WINDOW) доходять до адмінів редагуванням сповіщення першого;
+        # claim у серії один — на перше повідомлення, тож решта маркерів із claim-ів знімаються
+        for marker in MARKER_RE.findall(text)[1:]:
+            times = self.notified[marker]
+            if chat_id in times:
+                continue
+            times[chat_id] = call.ts
+            if len(times) == len(self.admins):
+                self.latencies["notify"].append(call.ts - self.sent_at[marker])
+                self.done["notify"] += 1
+            self.claimers.pop(marker, None)
+
+    # --- підсумок ---
+    def expected(self, total: int) -> dict:
+        with self.lock:
+            claims = len(self.claimers)
+        return {"ack": total, "notify": total, "claim": claims, "reply": claims}
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.done)
+
+
+def check_backlog(db_path: str) -> dict:
+    """
+    Беклог у /stats (response_stats) має збігатися з кількістю невзятих запитів прогону:
+    вхідні з source_* (seed їх не має), без burst_head_id (серія — один запит) і без claim.
+    """
+    engine = create_engine(f"sqlite:///{db_path}")
+    try:
+        with engine.connect() as conn:
+            stats = conn.execute(text("SELECT COALESCE(SUM(backlog), 0) FROM response_stats")).scalar()
+            unclaimed = conn.execute(text(
+                "SELECT COUNT(*) FROM messages m WHERE m.direction = 'in' AND m.source_chat_id IS NOT NULL"
+                " AND m.burst_head_id IS NULL AND NOT EXISTS (SELECT 1 FROM claims c WHERE c.message_id = m.id)"
+            )).scalar()
+    finally:
+        engine.dispose()
+    return {"stats": stats, "unclaimed": unclaimed}
+
+
+def spawn_bot(kind: str, env: dict, log_dir: str):
+    log = open(os.path.join(log_dir, f"{kind}_bot.log"), "wb")
+    return subprocess.Popen(
+        [sys.executable, "entrypoint.py"], cwd=ROOT, env=dict(env, BOT_TYPE=kind),
+        stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def stop_bots(processes):
+    for proc in processes:
+        if proc.poll() is None:
+            proc.terminate()
+    for proc in processes:
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def _tail(path: str, lines: int = 20) -> str:
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return "".join(f.readlines()[-lines:])
+    except OSError:
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=50, help="кількість клієнтів (N)")
+    parser.add_argument("--admins", type=int, default=5, help="кількість адмінів (M)")
+    parser.add_argument("--messages", type=int, default=4, help="повідомлень на клієнта")
+    parser.add_argument("--rate", type=float, default=20.0, help="сумарна швидкість клієнтів, повідомлень/с")
+    parser.add_argument("--claim-ratio", type=float, default=0.3, help="частка запитів, які беруть адміни")
+    parser.add_argument("--media-ratio", type=float, default=0.0, help="частка повідомлень з фото")
+    parser.add_argument("--album-ratio", type=float, default=0.0, help="частка повідомлень-альбомів")
+    parser.add_argument("--album-size", type=int, default=10, help="фото в альбомі")
+    parser.add_argument("--burst-window", type=float, help="BURST_WINDOW клієнтського бота, с (0 — без серій)")
+    parser.add_argument("--history", type=int, default=20, help="повідомлень історії на клієнта в базі")
+    parser.add_argument("--latency", type=float, default=0.0, help="затримка Bot API, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="випадковий jitter Bot API, с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="частка відповідей 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120.0, help="максимальне очікування завершення, с")
+    parser.add_argument("--workdir", help="куди покласти базу та логи ботів (за замовчуванням тимчасова)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="зберегти результати у файл")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="support_bot_load_")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = os.path.join(workdir, "support_bot.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    companies = max(1, args.clients // 10)
+    per_company = math.ceil(args.clients / companies)
+    counts = seed_database(create_engine(f"sqlite:///{db_path}"), companies=companies,
+                           clients_per_company=per_company, messages_per_client=args.history,
+                           admins=args.admins, seed=args.seed)
+    clients = [100000000 + n for n in range(args.clients)]
+    admins = [900000 + i for i in range(args.admins)]
+    print(f"seeded {db_path}: {counts}", file=sys.stderr)
+
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                     retry_after=args.retry_after, seed=args.seed).start()
+    driver = LoadDriver(api, admins, args.claim_ratio, seed=args.seed)
+
+    env = dict(
+        os.environ,
+        DB_PATH=db_path,
+        TELEGRAM_TOKEN_CLIENT=CLIENT_TOKEN,
+        TELEGRAM_TOKEN_ADMIN=ADMIN_TOKEN,
+        TELEGRAM_API_BASE_URL=api.base_url,
+        TELEGRAM_FILE_BASE_URL=api.base_file_url,
+        INITIAL_ADMIN_ID=str(admins[0]),
+        MEDIA_DIR=os.path.join(workdir, "media"),
+        METRICS_PORT="0",
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    if args.burst_window is not None:
+        env["BURST_WINDOW"] = str(args.burst_window)
+    processes = [spawn_bot("client", env, workdir), spawn_bot("admin", env, workdir)]
+    try:
+        if not api.wait_polling([CLIENT_TOKEN, ADMIN_TOKEN], timeout=60):
+            for kind in ("client", "admin"):
+                print(f"--- {kind}_bot.log ---\n{_tail(os.path.join(workdir, f'{kind}_bot.log'))}", file=sys.stderr)
+            raise SystemExit("❌ Боти не почали polling за 60 с")
+
+        total = args.clients * args.messages
+        rnd = random.Random(args.seed)
+        start = time.monotonic()
+        for i in range(total):
+            delay = start + i / args.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            client_tg = clients[i % args.clients]
+            driver.send_client_message(client_tg, f"{i % args.clients}-{i // args.clients}",
+                                       photo=rnd.random() < args.media_ratio,
+                                       album=args.album_size if rnd.random() < args.album_ratio else 0)
+        send_duration = time.monotonic() - start
+
+        deadline = start + args.timeout
+        while time.monotonic() < deadline:
+            # claim-и повідомлень, що потрапили в серію, знімаються вже під час прогону
+            expected = driver.expected(total)
+            done = driver.snapshot()
+            if all(done.get(stage, 0) >= n for stage, n in expected.items()):
+                break
+            time.sleep(0.1)
+        elapsed = time.monotonic() - start
+    finally:
+        stop_bots(processes)
+        api.stop()
+
+    done = driver.snapshot()
+    expected = driver.expected(total)
+    results = {
+        "revision": _git_revision(),
+        "params": vars(args),
+        "sent": total,
+        "send_duration_s": round(send_duration, 3),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(done.get("ack", 0) / (driver.last_at["ack"] - start), 2) if done.get("ack") else 0,
+        "stages": {},
+        "errors": dict(driver.errors),
+        "api": api.stats(),
+        "backlog": check_backlog(db_path),
+    }
+    if results["backlog"]["stats"] != results["backlog"]["unclaimed"]:
+        driver.errors["backlog_mismatch"] += 1
+        results["errors"] = dict(driver.errors)
+    print(f"\nsent {total} за {send_duration:.1f}s, завершено за {elapsed:.1f}s, "
+          f"throughput {results['throughput_per_s']} повідомлень/с")
+    print(f"{'stage':<8} {'done':>11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for stage, n in expected.items():
+        samples = driver.latencies.get(stage, [])
+        row = {
+            "expected": n, "done": done.get(stage, 0),
+            "p50_ms": round(_percentile(samples, 0.50) * 1000, 1),
+            "p95_ms": round(_percentile(samples, 0.95) * 1000, 1),
+            "p99_ms": round(_percentile(samples, 0.99) * 1000, 1),
+            "max_ms": round(max(samples, default=0) * 1000, 1),
+        }
+        results["stages"][stage] = row
+        print(f"{stage:<8} {row['done']:>5}/{n:<5} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+              f"{row['p99_ms']:>9} {row['max_ms']:>9}")
+    print(f"api: {results['api']}")
+    print(f"backlog: /stats {results['backlog']['stats']}, невзятих запитів {results['backlog']['unclaimed']}")
+    if driver.errors:
+        print(f"errors: {dict(driver.errors)}")
+    print(f"логи ботів: {workdir}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
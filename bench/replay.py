@@ -0,0 +1,197 @@
+"""
+Відтворення записаних апдейтів (app/recorder.py) проти локальної заглушки Bot API.
+
+Апдейти з одного або кількох файлів UPDATE_RECORD_PATH зливаються за часом і подаються
+у build_client_app() / build_admin_app() в одному процесі з оригінальними інтервалами,
+прискорено (--speed 10) або без пауз (--speed 0). Кожен апдейт іде через update_processor
+застосунку, тож паралельність та черговість такі ж, як у run_polling.
+
+База копіюється з --db (знімок на момент початку запису), тож оригінал не змінюється.
+ts у записі — момент, коли бот почав обробку апдейту. При --speed > 1 адмінські callback-и
+можуть випередити вставку повідомлення клієнтським ботом ("Повідомлення вже не знайдено"),
+тож для порівняння комітів між собою зручніше --speed 1 або --bot client.
+Звіт: час від "надходження" апдейту до завершення обробки (p50/p95/p99) по ботах,
+латентність і кількість SQL-запитів по хендлерах (з app/metrics.py), виклики Bot API.
+
+    python -m bench.replay --db /tmp/snapshot.db /data/updates_client.jsonl.gz /data/updates_admin.jsonl.gz
+    python -m bench.replay --db /tmp/snapshot.db --speed 0 --json after.json /data/updates_*.jsonl.gz
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+from bench.bench_db import _percentile, _git_revision
+from bench.fake_bot_api import FakeBotAPI
+from bench.load_test import CLIENT_TOKEN, ADMIN_TOKEN
+
+
+def load_records(paths, bots=None):
+    from app.recorder import read_recording
+
+    records = []
+    for path in paths:
+        for record in read_recording(path):
+            if bots is None or record.get("bot") in bots:
+                records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+async def replay(records, apps, speed: float):
+    """Подає апдейти у застосунки за розкладом; повертає {bot: [секунди від надходження до кінця обробки]}."""
+    from telegram import Update
+
+    latencies = defaultdict(list)
+    tasks = []
+
+    async def process(app, update, arrived, bot):
+        await app.update_processor.process_update(update, app.process_update(update))
+        latencies[bot].append(time.perf_counter() - arrived)
+
+    start = time.perf_counter()
+    first_ts = records[0]["ts"] if records else 0
+    for record in records:
+        if speed > 0:
+            delay = start + (record["ts"] - first_ts) / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        app = apps[record["bot"]]
+        update = Update.de_json(record["update"], app.bot)
+        tasks.append(asyncio.create_task(process(app, update, time.perf_counter(), record["bot"])))
+        if speed == 0:
+            # без пауз, але з шансом для вже запущених задач (як при пачці з getUpdates)
+            await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    return latencies, time.perf_counter() - start
+
+
+async def run(records, speed):
+    apps = {}
+    bots = {r["bot"] for r in records}
+    if "client" in bots:
+        from app.client_bot import build_client_app
+        apps["client"] = build_client_app()
+    if "admin" in bots:
+        from app.admin_bot import build_admin_app
+        apps["admin"] = build_admin_app()
+
+    for app in apps.values():
+        await app.initialize()
+        await app.start()
+    try:
+        return await replay(records, apps, speed)
+    finally:
+        for app in apps.values():
+            await app.stop()
+            await app.shutdown()
+
+
+def handler_report():
+    from app.metrics import HANDLER_LATENCY, HANDLER_CALLS, DB_QUERIES
+
+    calls = defaultdict(int)
+    for key, value in HANDLER_CALLS.snapshot().items():
+        calls[dict(key)["handler"]] += value
+    queries = {dict(key).get("handler"): value for key, value in DB_QUERIES.snapshot().items()}
+
+    rows = {}
+    for key, (counts, total) in HANDLER_LATENCY.snapshot().items():
+        name = dict(key)["handler"]
+        n = sum(counts)
+        rows[name] = {
+            "calls": calls.get(name, n),
+            "mean_ms": round(total / n * 1000, 2) if n else 0,
+            "p50_ms": round((HANDLER_LATENCY.quantile(0.50, counts) or 0) * 1000, 2),
+            "p95_ms": round((HANDLER_LATENCY.quantile(0.95, counts) or 0) * 1000, 2),
+            "p99_ms": round((HANDLER_LATENCY.quantile(0.99, counts) or 0) * 1000, 2),
+            "queries_per_call": round(queries.get(name, 0) / n, 1) if n else 0,
+        }
+    return dict(sorted(rows.items(), key=lambda item: -item[1]["mean_ms"] * item[1]["calls"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="+", help="файли UPDATE_RECORD_PATH (.jsonl.gz)")
+    parser.add_argument("--db", required=True, help="знімок БД, з якого почався запис (копіюється)")
+    parser.add_argument("--speed", type=float, default=1.0, help="прискорення; 0 — без пауз")
+    parser.add_argument("--bot", choices=("client", "admin"), action="append", help="відтворити лише цього бота")
+    parser.add_argument("--latency", type=float, default=0.0, help="затримка Bot API, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="випадковий jitter Bot API, с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="частка відповідей 429")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="зберегти результати у файл")
+    args = parser.parse_args()
+
+    records = load_records(args.recordings, set(args.bot) if args.bot else None)
+    if not records:
+        raise SystemExit("❌ Немає апдейтів для відтворення")
+    span = records[-1]["ts"] - records[0]["ts"]
+    print(f"{len(records)} апдейтів за {span:.1f}s запису", file=sys.stderr)
+
+    workdir = tempfile.mkdtemp(prefix="support_bot_replay_")
+    db_path = os.path.join(workdir, "support_bot.db")
+    shutil.copy(args.db, db_path)
+
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429, seed=args.seed).start()
+    # app.* читає оточення під час імпорту
+    os.environ.update(
+        DB_PATH=db_path,
+        TELEGRAM_TOKEN_CLIENT=CLIENT_TOKEN,
+        TELEGRAM_TOKEN_ADMIN=ADMIN_TOKEN,
+        TELEGRAM_API_BASE_URL=api.base_url,
+        TELEGRAM_FILE_BASE_URL=api.base_file_url,
+        INITIAL_ADMIN_ID="",
+        UPDATE_RECORD_PATH="",
+        MEDIA_DIR=os.path.join(workdir, "media"),
+        METRICS_PORT="0",
+    )
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    try:
+        latencies, elapsed = asyncio.run(run(records, args.speed))
+    finally:
+        api.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = {
+        "revision": _git_revision(),
+        "params": vars(args),
+        "updates": len(records),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_s": round(len(records) / elapsed, 2) if elapsed else 0,
+        "bots": {},
+        "handlers": handler_report(),
+        "api": api.stats(),
+    }
+    print(f"\n{len(records)} апдейтів за {elapsed:.2f}s ({results['updates_per_s']}/s)")
+    print(f"{'bot':<8} {'updates':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for bot, samples in sorted(latencies.items()):
+        row = {
+            "updates": len(samples),
+            "p50_ms": round(_percentile(samples, 0.50) * 1000, 1),
+            "p95_ms": round(_percentile(samples, 0.95) * 1000, 1),
+            "p99_ms": round(_percentile(samples, 0.99) * 1000, 1),
+            "max_ms": round(max(samples, default=0) * 1000, 1),
+        }
+        results["bots"][bot] = row
+        print(f"{bot:<8} {row['updates']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} {row['max_ms']:>9}")
+
+    print(f"\n{'handler':<32} {'calls':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'sql/call':>9}")
+    for name, row in results["handlers"].items():
+        print(f"{name:<32} {row['calls']:>6} {row['mean_ms']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+              f"{row['p99_ms']:>9} {row['queries_per_call']:>9}")
+    print(f"\napi: {results['api']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
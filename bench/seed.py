@@ -0,0 +1,109 @@
+"""
+Наповнення SQLite синтетичними даними через моделі app/models.py.
+
+    DB_PATH=/tmp/bench.db python -m bench.seed --companies 200 --clients 10 --messages 50
+
+Використовується також з bench_db.py. Вставка йде пачками через Core insert,
+тож 100k повідомлень займають секунди.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app.models import Base, Admin, Company, Client, Message, Claim
+
+BATCH = 5000
+
+
+def _chunks(rows, size=BATCH):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def seed_database(engine, companies=200, clients_per_company=10, messages_per_client=50,
+                  admins=5, claim_ratio=0.8, days=90, seed=42):
+    """
+    Створює схему і заповнює її. Повертає dict з кількостями створених рядків.
+    Повідомлення рівномірно розкидані за останні `days` днів; частина вхідних
+    (claim_ratio) вже взята в роботу, решта — "необроблені".
+    """
+    rnd = random.Random(seed)
+    Base.metadata.create_all(bind=engine)
+    now = datetime.utcnow()
+
+    admin_rows = [{"id": i + 1, "tg_id": str(900000 + i), "name": f"Admin {i}", "is_super": int(i == 0)}
+                  for i in range(admins)]
+    company_rows = [{"id": i + 1, "name": f"Company {i:05d}", "name_search": f"company {i:05d}",
+                     "contact_name": f"Contact {i}", "client_id": f"cid-{i}", "client_secret": f"secret-{i}"}
+                    for i in range(companies)]
+    client_rows = []
+    for comp in company_rows:
+        for j in range(clients_per_company):
+            n = len(client_rows)
+            client_rows.append({"id": n + 1, "tg_id": str(100000000 + n), "name": f"Client {n:06d}",
+                                "name_search": f"client {n:06d}", "company_id": comp["id"]})
+
+    message_rows, claim_rows = [], []
+    span = days * 86400
+    for cl in client_rows:
+        for k in range(messages_per_client):
+            mid = len(message_rows) + 1
+            created = now - timedelta(seconds=rnd.randrange(span))
+            inbound = k % 2 == 0
+            admin = rnd.choice(admin_rows)
+            message_rows.append({
+                "id": mid, "client_tg_id": cl["tg_id"], "company_id": cl["company_id"],
+                "admin_tg_id": None if inbound else admin["tg_id"],
+                "direction": "in" if inbound else "out",
+                "text": f"message {mid} " + "lorem ipsum " * rnd.randint(1, 8),
+                "created_at": created, "company_snapshot": f"Company {cl['company_id'] - 1:05d}",
+            })
+            if inbound and rnd.random() < claim_ratio:
+                claim_rows.append({
+                    "id": len(claim_rows) + 1, "client_id": cl["id"], "admin_id": admin["id"],
+                    "title": f"Запит від {cl['name']}", "message_id": mid, "description": "",
+                    "status": "in_progress", "created_at": created + timedelta(minutes=rnd.randint(1, 120)),
+                })
+
+    with engine.begin() as conn:
+        for model, rows in ((Admin, admin_rows), (Company, company_rows), (Client, client_rows),
+                            (Message, message_rows), (Claim, claim_rows)):
+            for chunk in _chunks(rows):
+                conn.execute(insert(model), chunk)
+
+    return {"admins": len(admin_rows), "companies": len(company_rows), "clients": len(client_rows),
+            "messages": len(message_rows), "claims": len(claim_rows)}
+
+
+def add_seed_arguments(parser):
+    parser.add_argument("--companies", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=10, help="клієнтів на компанію")
+    parser.add_argument("--messages", type=int, default=50, help="повідомлень на клієнта")
+    parser.add_argument("--admins", type=int, default=5)
+    parser.add_argument("--claim-ratio", type=float, default=0.8)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--seed", type=int, default=42)
+
+
+def seed_from_args(engine, args):
+    return seed_database(engine, companies=args.companies, clients_per_company=args.clients,
+                         messages_per_client=args.messages, admins=args.admins,
+                         claim_ratio=args.claim_ratio, days=args.days, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_seed_arguments(parser)
+    args = parser.parse_args()
+
+    from app.db import engine, DB_PATH
+    start = time.perf_counter()
+    counts = seed_from_args(engine, args)
+    print(f"{DB_PATH}: {counts} за {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()